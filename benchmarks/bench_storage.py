@@ -0,0 +1,73 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+"""
+Compares how long it takes to load every record from each kind of
+storage.
+
+Run it from the repository root::
+
+    python benchmarks/bench_storage.py [NUMBER_OF_RECORDS ...]
+
+It defaults to 1000, 10000 and 50000 records. Each load uses a fresh
+storage object so nothing is kept in memory between runs. The OS
+file cache is warm, which is the usual case for status, verify and
+webedit.
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench_verify import make_records
+from steve.storage import STORAGES
+
+
+PATHS = {
+    'files': 'json',
+    'jsonl': 'videos.jsonl',
+    'sqlite': 'videos.sqlite',
+}
+
+
+def timeit(fun):
+    start = time.time()
+    fun()
+    return time.time() - start
+
+
+def main(argv):
+    counts = [int(arg) for arg in argv] or [1000, 10000, 50000]
+
+    print '{0:>8s}  {1:>8s}  {2:>9s}  {3:>9s}'.format(
+        'records', 'storage', 'save', 'load')
+    for count in counts:
+        records = make_records(count)
+        path = tempfile.mkdtemp()
+        try:
+            for name in sorted(STORAGES):
+                full_path = os.path.join(path, PATHS[name])
+                save_time = timeit(
+                    lambda: STORAGES[name](full_path).save(records))
+
+                def load():
+                    assert len(list(STORAGES[name](full_path).load())) == count
+
+                # Best of three.
+                load_time = min(timeit(load) for i in range(3))
+                print '{0:8d}  {1:>8s}  {2:8.3f}s  {3:8.3f}s'.format(
+                    count, name, save_time, load_time)
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,314 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+"""
+Times the things steve spends most of its time doing, at a few
+project sizes, against a stand-in richard api so it runs offline.
+
+For each size it times:
+
+* ``load_json_files`` and ``verify_json_files``
+* webedit's home page (rendered, from the page cache, and 304) and an
+  edit page
+* ``push`` of every video, ``get_all_categories`` and ``pull`` of
+  every video, through ``steve-cmd`` against
+  ``benchmarks/stub_richard.py``
+
+Results are written to a JSON file, by default
+``benchmarks/results/steve-VERSION-DATE.json``. Pass an older one
+with ``--compare`` to see what changed.
+
+Run it from the repository root::
+
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --sizes 100 1000 --latency 5
+    python benchmarks/bench_suite.py --compare benchmarks/results/old.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+from click.testing import CliRunner
+
+import steve
+from bench_verify import make_records
+from steve.cmdline import cli
+from steve.richardapi import get_all_categories
+from steve.util import (
+    get_project_config,
+    load_json_files,
+    save_json_files,
+    verify_json_files,
+)
+from steve.webedit import ProjectStore, WebEditRequestHandler, WebEditServer
+from stub_richard import start_server_process
+
+
+CATEGORY = u'Bench Category'
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class QuietHandler(WebEditRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def make_clean_records(count):
+    """Like make_records, but every record can be pushed"""
+    records = []
+    for fn, data in make_records(count):
+        data.pop('whatever', None)
+        data['speakers'] = [speaker for speaker in data['speakers'] if speaker]
+        data['category'] = CATEGORY
+        records.append((fn, data))
+    return records
+
+
+def make_project(path, api_url):
+    os.makedirs(path)
+    with open(os.path.join(path, 'steve.ini'), 'w') as fp:
+        fp.write('\n'.join([
+            '[project]',
+            'category = {0}'.format(CATEGORY),
+            'api_url = {0}'.format(api_url),
+            'username = bench',
+            'api_key = benchkey',
+            ''
+        ]))
+    os.chdir(path)
+    return get_project_config()
+
+
+def timeit(fun, repeat=1):
+    """Returns the best time of ``repeat`` calls to ``fun``"""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        fun()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def time_requests(url, count, headers=None):
+    """Returns the median time to fetch ``url``"""
+    times = []
+    for i in range(count):
+        req = urllib2.Request(url, headers=headers or {})
+        start = time.time()
+        try:
+            urllib2.urlopen(req).read()
+        except urllib2.HTTPError as exc:
+            if exc.code != 304:
+                raise
+        times.append(time.time() - start)
+    return median(times)
+
+
+def bench_webedit(cfg, filenames, count):
+    httpd = WebEditServer(('127.0.0.1', 0), QuietHandler,
+                          store=ProjectStore(cfg), workers=4)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+
+    try:
+        results = {}
+        # The first request loads the project.
+        start = time.time()
+        resp = urllib2.urlopen(base_url + '/')
+        resp.read()
+        results['webedit_first_home'] = time.time() - start
+
+        etag = resp.info().getheader('ETag')
+        results['webedit_home'] = time_requests(base_url + '/', count)
+        if etag:
+            results['webedit_home_304'] = time_requests(
+                base_url + '/', count, {'If-None-Match': etag})
+        results['webedit_edit'] = time_requests(
+            base_url + '/edit/' + filenames[len(filenames) // 2], count)
+        return results
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def run_command(args, **kwargs):
+    result = CliRunner().invoke(cli, args, **kwargs)
+    if result.exit_code != 0:
+        print '    {0} exited with {1}:'.format(args[0], result.exit_code)
+        print '\n'.join('      ' + line for line in result.output.splitlines()[-5:])
+    return result.exit_code == 0
+
+
+def bench_size(size, args):
+    """Runs every benchmark for one project size
+
+    :returns: dict of name -> seconds and dict of name -> whether it
+        worked
+
+    """
+    server, api_url = start_server_process(
+        categories=[CATEGORY] + [u'Category {0}'.format(i) for i in range(size // 10)],
+        latency=args.latency / 1000.0,
+        error_rate=args.error_rate,
+        error_status=args.error_status)
+    tmpdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    timings = {}
+    ok = {}
+    try:
+        cfg = make_project(os.path.join(tmpdir, 'push'), api_url)
+        records = make_clean_records(size)
+        save_json_files(cfg, records)
+
+        data = []
+        timings['load_json_files'] = timeit(
+            lambda: data.__setitem__(slice(None), load_json_files(cfg)),
+            repeat=3)
+        timings['verify_json_files'] = timeit(
+            lambda: verify_json_files(data, CATEGORY), repeat=3)
+
+        timings.update(bench_webedit(
+            cfg, [fn for fn, _ in records], args.requests))
+
+        jobs = ['--jobs', str(args.jobs), '--retries', str(args.retries)]
+        start = time.time()
+        ok['push'] = run_command(['push', '--quiet'] + jobs, input='y\n')
+        timings['push'] = time.time() - start
+
+        timings['get_all_categories'] = timeit(
+            lambda: get_all_categories(api_url, ttl=0), repeat=3)
+
+        make_project(os.path.join(tmpdir, 'pull'), api_url)
+        start = time.time()
+        ok['pull'] = run_command(['pull', '--quiet'] + jobs)
+        timings['pull'] = time.time() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir)
+        server.terminate()
+
+    return timings, ok
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Prints how each timing changed between two result files"""
+    old_timings = dict(
+        ((r['name'], r['size']), r['seconds']) for r in old['results'])
+
+    print
+    print 'Compared to {0} ({1}):'.format(
+        old['steve_version'], old.get('git_revision') or old['date'])
+    for result in new['results']:
+        before = old_timings.get((result['name'], result['size']))
+        if not before:
+            continue
+        print '  {0:20s} {1:6d}  {2:9.4f}s -> {3:9.4f}s  {4:+7.1f}%'.format(
+            result['name'], result['size'], before, result['seconds'],
+            (result['seconds'] - before) / before * 100)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Runs the steve benchmarks.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='numbers of videos to run with')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds the stub api waits before answering')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of api requests that fail')
+    parser.add_argument('--error-status', type=int, default=429,
+                        help='status code failed api requests get')
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='--jobs for push and pull')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='--retries for push and pull')
+    parser.add_argument('--requests', type=int, default=20,
+                        help='requests per webedit page timing')
+    parser.add_argument('--output', help='where to write the results')
+    parser.add_argument('--compare', help='earlier results to compare with')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        print '{0} videos'.format(size)
+        timings, ok = bench_size(size, args)
+        for name in sorted(timings):
+            results.append({
+                'name': name,
+                'size': size,
+                'seconds': timings[name],
+                'ok': ok.get(name, True),
+            })
+            print '  {0:20s} {1:9.4f}s{2}'.format(
+                name, timings[name], '' if ok.get(name, True) else '  FAILED')
+
+    output = {
+        'steve_version': steve.__version__,
+        'git_revision': get_git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'latency_ms': args.latency,
+            'error_rate': args.error_rate,
+            'error_status': args.error_status,
+            'jobs': args.jobs,
+            'retries': args.retries,
+        },
+        'results': results,
+    }
+
+    path = args.output
+    if not path:
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        path = os.path.join(RESULTS_DIR, 'steve-{0}-{1}.json'.format(
+            steve.__version__, time.strftime('%Y%m%d-%H%M%S')))
+    with open(path, 'w') as fp:
+        json.dump(output, fp, indent=2, sort_keys=True)
+    print 'Wrote {0}'.format(path)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(json.load(fp), output)
+
+    if not all(result['ok'] for result in results):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
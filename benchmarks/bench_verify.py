@@ -0,0 +1,81 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+"""
+Measures the per-record cost of verifying video data.
+
+Run it from the repository root::
+
+    python benchmarks/bench_verify.py [NUMBER_OF_RECORDS]
+
+"""
+
+import sys
+import time
+
+from steve.util import (
+    VideoValidator,
+    get_video_validator,
+    verify_json_files,
+)
+
+
+def make_records(count):
+    """Builds ``count`` synthetic records, some of which have errors"""
+    records = []
+    for i in range(count):
+        data = {
+            'title': u'Talk {0}'.format(i),
+            'category': u'Test Category',
+            'language': u'English',
+            'state': 1 + (i % 2),
+            'summary': u'Summary for talk {0}'.format(i),
+            'description': u'',
+            'speakers': [u'Speaker {0}'.format(i)],
+            'tags': [u'python', u'web'],
+            'source_url': u'http://example.com/{0}'.format(i),
+            'video_ogv_download_only': False,
+        }
+        if i % 10 == 0:
+            data['speakers'].append(u'')
+        if i % 25 == 0:
+            data['whatever'] = 1
+        records.append(('{0:05d}_talk.json'.format(i), data))
+    return records
+
+
+def timeit(fun):
+    start = time.time()
+    fun()
+    return time.time() - start
+
+
+def main(argv):
+    count = int(argv[0]) if argv else 10000
+    records = make_records(count)
+    requirements = get_video_validator().requirements
+
+    def rebuild_per_record():
+        # What verifying used to cost: working out the checks for
+        # every single record.
+        for fn, data in records:
+            VideoValidator(requirements).verify(data, 'Test Category')
+
+    def shared_validator():
+        verify_json_files(records, 'Test Category')
+
+    print 'Verifying {0} records'.format(count)
+    for name, fun in (('validator per record', rebuild_per_record),
+                      ('shared validator', shared_validator)):
+        elapsed = timeit(fun)
+        print '  {0:22s} {1:8.3f}s  {2:8.2f}us/record'.format(
+            name, elapsed, elapsed * 1000000 / count)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,125 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+"""
+Load-tests webedit with several people editing at the same time.
+
+Each client loops loading an edit page and saving it. While that
+runs, one connection is opened and left stalled, like a browser that
+went away.
+
+Run it from the repository root::
+
+    python benchmarks/bench_webedit.py [SECONDS] [CLIENTS]
+
+"""
+
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+
+from bench_verify import make_records
+from steve.util import get_project_config, save_json_files
+from steve.webedit import ProjectStore, WebEditRequestHandler, WebEditServer
+
+
+class QuietHandler(WebEditRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def make_project(count):
+    path = tempfile.mkdtemp()
+    with open(os.path.join(path, 'steve.ini'), 'w') as fp:
+        fp.write('[project]\ncategory = Test Category\n')
+    os.chdir(path)
+    cfg = get_project_config()
+    save_json_files(cfg, make_records(count))
+    return path, cfg
+
+
+def client(base_url, filenames, deadline, results):
+    while time.time() < deadline:
+        fn = random.choice(filenames)
+        start = time.time()
+        try:
+            urllib2.urlopen(base_url + '/edit/' + fn, timeout=2).read()
+            form = urllib.urlencode({
+                'title': 'Talk {0}'.format(random.randint(0, 1000)),
+                'language': 'English',
+                'state': '1',
+            })
+            # This redirects back to the edit page, so it's a save and
+            # a page load.
+            urllib2.urlopen(base_url + '/save/' + fn, form, timeout=2).read()
+            results.append(time.time() - start)
+        except (urllib2.URLError, socket.timeout):
+            results.append(None)
+
+
+def run(cfg, workers, seconds, clients):
+    httpd = WebEditServer(('127.0.0.1', 0), QuietHandler,
+                          store=ProjectStore(cfg), workers=workers)
+    # Clients that gave up cause broken pipes. That's expected.
+    httpd.handle_error = lambda request, client_address: None
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+
+    # A browser that connected and then went quiet.
+    stalled = socket.create_connection(httpd.server_address)
+
+    filenames = [fn for fn, _ in httpd.store.items()]
+    results = []
+    deadline = time.time() + seconds
+    threads = [
+        threading.Thread(target=client,
+                         args=(base_url, filenames, deadline, results))
+        for i in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stalled.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+    done = sorted(r for r in results if r is not None)
+    failed = len(results) - len(done)
+    print '  workers={0:<3d} {1:6.1f} edit+save/s  median {2:7.1f}ms  failed {3}'.format(
+        workers,
+        len(done) / float(seconds),
+        done[len(done) // 2] * 1000 if done else 0,
+        failed)
+
+
+def main(argv):
+    seconds = int(argv[0]) if argv else 5
+    clients = int(argv[1]) if len(argv) > 1 else 8
+
+    path, cfg = make_project(1000)
+    try:
+        print 'Editing 1000 files with {0} clients for {1}s'.format(clients, seconds)
+        for workers in (1, clients):
+            run(cfg, workers, seconds, clients)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,247 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+"""
+A stand-in for a richard instance's api, for benchmarks.
+
+It keeps everything in memory and implements just enough for steve:
+
+* ``GET /api/v2/category/`` -- paginated listing; ``limit=0`` gets
+  everything on one page
+* ``GET /api/v2/video/ID/`` -- a video
+* ``POST /api/v2/video/`` -- creates a video
+* ``PUT /api/v2/video/ID/`` -- updates a video
+
+Every request can be slowed down by ``latency`` seconds and a
+fraction ``error_rate`` of them fail with ``error_status``.
+
+Run it by itself with::
+
+    python benchmarks/stub_richard.py [PORT]
+
+"""
+
+import BaseHTTPServer
+import json
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+import urlparse
+from SocketServer import ThreadingMixIn
+
+
+API_PATH = '/api/v2/'
+
+
+def slugify(title):
+    return re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
+
+
+class StubRichardHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep connections open like a real server would.
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write. Lots of little ones run into
+    # Nagle's algorithm and delayed ACKs on kept-open connections.
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, content, headers=None):
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def dispatch(self, method):
+        server = self.server
+        parts = urlparse.urlparse(self.path)
+        qs = urlparse.parse_qs(parts.query)
+        path = parts.path[len(API_PATH):].strip('/').split('/')
+
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length)
+
+        server.count(method)
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_rate and server.random() < server.error_rate:
+            server.count('errors')
+            self.send_json(server.error_status, {'error': 'injected'})
+            return
+
+        if not parts.path.startswith(API_PATH):
+            self.send_json(404, {'error': 'not found'})
+        elif path == ['category'] and method == 'GET':
+            self.send_json(200, server.list_categories(qs))
+        elif path == ['video'] and method == 'POST':
+            self.send_json(201, server.save_video(None, json.loads(body)))
+        elif len(path) == 2 and path[0] == 'video' and path[1].isdigit():
+            video_id = int(path[1])
+            if video_id not in server.videos:
+                self.send_json(404, {'error': 'not found'})
+            elif method == 'GET':
+                self.send_json(200, server.videos[video_id])
+            elif method == 'PUT':
+                self.send_json(200, server.save_video(video_id, json.loads(body)))
+            else:
+                self.send_json(405, {'error': 'method not allowed'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+
+class StubRichardServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """In-memory richard api
+
+    :arg server_address: ``(host, port)``; port 0 picks a free one
+    :arg categories: titles of the categories to start with
+    :arg latency: seconds to wait before answering each request
+    :arg error_rate: fraction of requests that fail
+    :arg error_status: status failed requests get
+    :arg page_size: categories per page
+    :arg seed: seed for picking which requests fail
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, categories=(), latency=0.0,
+                 error_rate=0.0, error_status=503, page_size=50, seed=0):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, server_address, StubRichardHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.page_size = page_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.requests = {}
+        self.videos = {}
+        self.categories = [
+            {'id': i, 'title': title, 'slug': slugify(title), 'videos': []}
+            for i, title in enumerate(categories, 1)
+        ]
+
+    @property
+    def api_url(self):
+        return 'http://{0}:{1}{2}'.format(
+            self.server_address[0], self.server_address[1], API_PATH)
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def count(self, key):
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def list_categories(self, qs):
+        page = int(qs.get('page', ['1'])[0])
+        size = int(qs.get('limit', [self.page_size])[0]) or len(self.categories)
+        start = (page - 1) * size
+        results = self.categories[start:start + size]
+
+        next_url = None
+        if start + size < len(self.categories):
+            next_url = '{0}category/?page={1}'.format(self.api_url, page + 1)
+        return {
+            'count': len(self.categories),
+            'next': next_url,
+            'previous': None,
+            'results': results,
+            # The old tastypie api called them objects.
+            'objects': results,
+        }
+
+    def save_video(self, video_id, data):
+        with self._lock:
+            if video_id is None:
+                video_id = len(self.videos) + 1
+                data['slug'] = slugify(data.get('title', '')) or str(video_id)
+                for cat in self.categories:
+                    if cat['title'] == data.get('category'):
+                        cat['videos'].append('{0}video/{1}/{2}'.format(
+                            self.api_url, video_id, data['slug']))
+            else:
+                data['slug'] = self.videos[video_id]['slug']
+            data['id'] = video_id
+            data['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self.videos[video_id] = data
+            return data
+
+
+def start_server(**kwargs):
+    """Starts a :py:class:`StubRichardServer` on a free port in a thread
+
+    :arg kwargs: passed to :py:class:`StubRichardServer`
+
+    :returns: the server; call ``shutdown()`` and ``server_close()``
+        when you're done with it
+
+    """
+    server = StubRichardServer(('127.0.0.1', 0), **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _serve(queue, kwargs):
+    server = StubRichardServer(('127.0.0.1', 0), **kwargs)
+    queue.put(server.api_url)
+    server.serve_forever()
+
+
+def start_server_process(**kwargs):
+    """Starts a :py:class:`StubRichardServer` in another process
+
+    Benchmarks should use this so the server doesn't compete with
+    steve for the GIL.
+
+    :arg kwargs: passed to :py:class:`StubRichardServer`
+
+    :returns: ``(process, api_url)``; call ``process.terminate()``
+        when you're done with it
+
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, kwargs))
+    process.daemon = True
+    process.start()
+    return process, queue.get(timeout=10)
+
+
+def main(argv):
+    port = int(argv[0]) if argv else 8000
+    server = StubRichardServer(('127.0.0.1', port),
+                               categories=['Test Category'])
+    print 'Serving {0}'.format(server.api_url)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
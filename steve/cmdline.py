@@ -7,6 +7,7 @@
 #######################################################################
 
 import ConfigParser
+import json
 import os
 import sys
 import traceback
@@ -15,27 +16,45 @@ import click
 import tabulate
 
 from steve import __version__
+import steve.metrics
 import steve.restapi
 import steve.richardapi
+import steve.storage
+import steve.webedit
+from steve.scrapers import ScraperError
 from steve.util import (
+    changed_since_pull,
     ConfigNotFound,
     create_project_config_file,
     convert_to_json,
+    diff_sync_manifest,
     generate_filename,
+    get_cache_path,
     get_from_config,
     get_project_config,
     get_project_config_file_name,
     get_video_id,
+    get_youtube_id,
+    iter_json_files,
+    iter_scrape_videos,
+    iter_scrape_videos_parallel,
+    iter_verify_json_files,
+    JSONFileCache,
+    list_json_files,
+    load_fetch_checkpoint,
     load_json_files,
+    load_sync_manifest,
+    pool_map,
+    save_fetch_checkpoint,
     save_json_file,
     save_json_files,
+    save_sync_manifest,
     scrape_video,
-    scrape_videos,
+    SteveException,
     stringify,
-    verify_json_files,
+    update_sync_manifest,
     with_config,
 )
-from steve.webedit import serve
 
 
 BYLINE = ('steve-cmd: {0} ({1}).'.format(steve.__version__,
@@ -44,6 +63,9 @@ BYLINE = ('steve-cmd: {0} ({1}).'.format(steve.__version__,
 USAGE = '%prog [options] [command] [command-options]'
 VERSION = 'steve ' + __version__
 
+# Number of pushed files to collect before writing them back to disk.
+PUSH_SAVE_BATCH_SIZE = 50
+
 DESC = """
 Command line interface for steve.
 """
@@ -56,12 +78,36 @@ def click_run():
     except ConfigNotFound as cnf:
         click.echo(VERSION)
         click.echo(cnf, err=True)
+    except steve.storage.StorageError as exc:
+        click.echo(VERSION)
+        click.echo(exc, err=True)
 
 
 @click.group()
-def cli():
+@click.option('--stats/--no-stats', default=False,
+              help='At the end, print how long requests and youtube-dl runs took')
+@click.option('--trace', type=click.Path(dir_okay=False, writable=True),
+              help='Save a timeline of requests in Chrome trace format to this file')
+@click.pass_context
+def cli(ctx, stats, trace):
     """Utility for aggregating and editing video metadata for a richard instance."""
-    pass
+    if not stats and not trace:
+        return
+
+    steve.metrics.registry.clear()
+    steve.metrics.enable()
+
+    def finish():
+        steve.metrics.disable()
+        if stats:
+            click.echo(u'', err=True)
+            click.echo(steve.metrics.report(), err=True)
+        if trace:
+            steve.metrics.save_trace(trace)
+            click.echo(u'Saved trace to {0}.'.format(trace), err=True)
+
+    # Runs after the command is done, even if it failed.
+    ctx.call_on_close(finish)
 
 
 @cli.command()
@@ -100,24 +146,25 @@ def createproject(ctx, quiet, projectname):
 @cli.command()
 @click.option('--quiet/--no-quiet', default=False)
 @click.option('--force/--no-force', default=False)
+@click.option('--incremental/--no-incremental', default=False,
+              help='Only scrape videos that no earlier fetch has seen')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of youtube-dl processes to scrape videos with')
+@click.option('--retries', default=2, type=click.IntRange(min=0),
+              help='With --jobs, times to retry a video that fails')
 @click.pass_context
 @with_config
-def fetch(cfg, ctx, quiet, force):
+def fetch(cfg, ctx, quiet, force, incremental, jobs, retries):
     """Fetches videos and generates JSON files."""
     if not quiet:
         click.echo(VERSION)
 
-    jsonpath = cfg.get('project', 'jsonpath')
-
     # source_url -> filename
     source_map = dict(
         (item['source_url'], fn)
-        for fn, item in load_json_files(cfg)
+        for fn, item in iter_json_files(cfg)
     )
 
-    if not os.path.exists(jsonpath):
-        os.makedirs(jsonpath)
-
     try:
         url = cfg.get('project', 'url')
     except ConfigParser.NoOptionError:
@@ -130,37 +177,92 @@ def fetch(cfg, ctx, quiet, force):
                 get_project_config_file_name())
         )
 
-    click.echo(u'Scraping {0}...'.format(url))
-    click.echo(u'(This can take a *long* time with no indication of progress.)')
-    videos = scrape_videos(url)
-
-    click.echo(u'Found {0} videos...'.format(len(videos)))
-    for i, video in enumerate(videos):
-        if video['source_url'] in source_map and not force:
-            click.echo(u'Skipping {0}... already exists.'.format(
-                stringify(video['title'])))
-            continue
+    # YouTube ids of every video we know about: the ones in the
+    # project and the ones earlier fetches saw.
+    seen_ids = load_fetch_checkpoint(cfg, url)
+    seen_ids.update(
+        video_id for video_id in map(get_youtube_id, source_map)
+        if video_id)
+
+    skip_ids = None
+    first_index = 0
+    if incremental and not force:
+        skip_ids = set(seen_ids)
+        # New videos go after the ones we have.
+        first_index = len(source_map)
+        click.echo(u'Skipping {0} videos seen before.'.format(len(skip_ids)))
 
-        filename = generate_filename(video['title'])
-        filename = '{index:04d}_{basename}.json'.format(
-            index=i, basename=filename[:40])
+    click.echo(u'Scraping {0}...'.format(url))
 
-        click.echo(u'Created {0}... ({1})'.format(
-            stringify(video['title']), filename))
+    # Each video is saved as soon as youtube-dl finds it, so a long
+    # scrape shows progress and an interrupted one keeps what it got.
+    found = created = 0
+    failed = []
+    try:
+        if jobs > 1:
+            # List the videos, then scrape each one in its own
+            # youtube-dl. One video failing doesn't stop the rest.
+            results = iter_scrape_videos_parallel(
+                url, skip_ids=skip_ids, jobs=jobs, retries=retries)
+        else:
+            videos = iter_scrape_videos(url, skip_ids=skip_ids)
+            results = (videos if videos is None
+                       else ((None, video, None) for video in videos))
+        if results is None:
+            raise click.ClickException(
+                u'steve doesn\'t know how to scrape {0}.'.format(url))
+
+        for i, (video_id, video, exc) in enumerate(results, first_index):
+            found += 1
+            if exc is not None:
+                click.echo(u'[{0}] Error scraping {1}: {2}'.format(
+                    found, video_id, exc), err=True)
+                failed.append(video_id)
+                continue
+
+            video_id = get_youtube_id(video['source_url'])
+            if video_id:
+                seen_ids.add(video_id)
+
+            if video['source_url'] in source_map and not force:
+                click.echo(u'[{0}] Skipping {1}... already exists.'.format(
+                    found, stringify(video['title'])))
+                continue
+
+            filename = generate_filename(video['title'])
+            filename = '{index:04d}_{basename}.json'.format(
+                index=i, basename=filename[:40])
+
+            save_json_file(cfg, filename, json.loads(convert_to_json(video)))
+            created += 1
+            click.echo(u'[{0}] Created {1}... ({2})'.format(
+                found, stringify(video['title']), filename))
+
+            # TODO: what if there's a file there already? on the first one,
+            # prompt the user whether to stomp on existing files or skip.
+
+    except ScraperError as exc:
+        raise click.ClickException(
+            u'{0} (Created {1} files before that.)'.format(exc, created))
 
-        with open(os.path.join(jsonpath, filename), 'w') as fp:
-            fp.write(convert_to_json(video))
+    finally:
+        save_fetch_checkpoint(cfg, url, seen_ids)
 
-        # TODO: what if there's a file there already? on the first one,
-        # prompt the user whether to stomp on existing files or skip.
+    click.echo(u'Found {0} videos, created {1} files.'.format(found, created))
+    if failed:
+        raise click.ClickException(
+            u'{0} of {1} videos could not be scraped: {2}'.format(
+                len(failed), found, u', '.join(failed)))
 
 
 @cli.command()
 @click.option('--quiet/--no-quiet', default=False)
 @click.option('--aslist/--no-aslist', default=False, help='Lists in-progress files one per line')
+@click.option('--cache/--no-cache', default=True,
+              help='Only re-parse files that changed since the last run')
 @click.pass_context
 @with_config
-def status(cfg, ctx, quiet, aslist):
+def status(cfg, ctx, quiet, aslist, cache):
     """Shows status for all videos in this project."""
     quiet = quiet or aslist
     if not quiet:
@@ -168,22 +270,23 @@ def status(cfg, ctx, quiet, aslist):
         click.echo('Video status:')
         click.echo()
 
-    files = load_json_files(cfg)
-
-    if not files:
-        if not aslist:
-            click.echo('No files')
-        return
-
     done_files = []
     in_progress_files = []
 
-    for fn, contents in files:
+    file_cache = JSONFileCache(cfg) if cache else None
+    for fn, contents in iter_json_files(cfg, cache=file_cache):
         whiteboard = contents.get('whiteboard', '')
         if whiteboard:
             in_progress_files.append((fn, whiteboard))
         else:
             done_files.append(fn)
+    if file_cache is not None:
+        file_cache.save()
+
+    if not done_files and not in_progress_files:
+        if not aslist:
+            click.echo('No files')
+        return
 
     if aslist:
         for fn in in_progress_files:
@@ -207,28 +310,41 @@ def status(cfg, ctx, quiet, aslist):
 
 @cli.command()
 @click.option('--quiet/--no-quiet', default=False)
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of processes to verify files with')
+@click.option('--cache/--no-cache', default=True,
+              help='Only re-verify files that changed since the last run')
 @click.pass_context
 @with_config
-def verify(cfg, ctx, quiet):
+def verify(cfg, ctx, quiet, jobs, cache):
     """Verifies JSON data."""
     if not quiet:
         click.echo(VERSION)
 
-    files = load_json_files(cfg)
-    if not files:
-        click.echo('No files')
-        return
-
-    filename_to_errors = verify_json_files(
-        files, cfg.get('project', 'category'))
-    for filename in sorted(filename_to_errors.keys()):
-        errors = filename_to_errors[filename]
+    total = 0
+    bad = 0
+    file_cache = JSONFileCache(cfg) if cache else None
+    results = iter_verify_json_files(
+        cfg, cfg.get('project', 'category'), jobs=jobs, cache=file_cache)
+    for filename, errors in results:
+        total += 1
         if errors:
+            bad += 1
             click.echo(filename)
             for error in errors:
                 click.echo('  - {0}'.format(error))
+    if file_cache is not None:
+        file_cache.save()
+
+    if not total:
+        click.echo('No files')
+        return
 
+    if bad:
+        click.echo('{0} of {1} files have errors.'.format(bad, total))
     click.echo('Done!')
+    if bad:
+        ctx.exit(1)
 
 
 @cli.command()
@@ -242,43 +358,85 @@ def scrapevideo(ctx, quiet, save, video_url):
     if not quiet:
         click.echo(VERSION)
 
-    data = scrape_video(video_url)[0]
+    data = scrape_video(video_url)
+    if not data:
+        raise click.ClickException(
+            u'steve doesn\'t know how to scrape {0}.'.format(video_url))
+    data = data[0]
     if save:
         cfg = get_project_config()
 
-        jsonpath = cfg.get('project', 'jsonpath')
-
-        if not os.path.exists(jsonpath):
-            os.makedirs(jsonpath)
-
         fn = generate_filename(data['title']) + '.json'
-        full_path = os.path.join(jsonpath, fn)
 
-        if os.path.exists(fn):
+        if fn in list_json_files(cfg):
             raise click.ClickException(u'File "%s" already exists!' % fn)
 
-        with open(full_path, 'w') as fp:
-            fp.write(convert_to_json(data))
+        # convert_to_json knows how to deal with things like dates.
+        save_json_file(cfg, fn, json.loads(convert_to_json(data)))
         click.echo(u'Saved as {0}'.format(fn))
 
     else:
         click.echo(convert_to_json(data))
 
 
+def _get_api(cfg, api_url, jobs, rate, retries):
+    """Returns an API for push and pull to talk to api_url with
+
+    ``jobs`` only sizes the connection pool. The scheduler starts out
+    allowing as many requests in flight as there are connections and
+    backs off from there if the server struggles, so the category
+    listing goes at full speed even when videos go one at a time.
+
+    """
+    if rate is None:
+        try:
+            rate = float(cfg.get('project', 'api_rate') or 0) or None
+        except ConfigParser.NoOptionError:
+            pass
+        except ValueError:
+            raise click.ClickException(u'api_rate in steve.ini must be a number.')
+
+    pool_size = max(jobs, steve.restapi.DEFAULT_POOL_SIZE)
+    return steve.restapi.API(
+        api_url,
+        pool_size=pool_size,
+        concurrency=pool_size,
+        rate=rate,
+        retries=retries)
+
+
 @cli.command()
 @click.option('--quiet/--no-quiet', default=False)
 @click.option('--apikey', default='', help='Pass in your API key via the command line')
 @click.option('--update/--no-update', default=False,
               help='Update data rather than push new data (PUT vs. POST)')
 @click.option('--overwrite/--no-overwrite', default=False, help='If it exists, overwrite it?')
+@click.option('--changed-only/--no-changed-only', default=False,
+              help='With --update, skip files that have not changed since they were pulled')
+@click.option('--sync/--no-sync', default=False,
+              help='Create new videos and update changed ones; skip the rest')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of videos to push at the same time')
+@click.option('--rate', default=None, type=click.FloatRange(min=0.1),
+              help='Maximum requests per second; overrides api_rate in steve.ini')
+@click.option('--retries', default=3, type=click.IntRange(min=0),
+              help='Times to retry a request that fails or is throttled')
 @click.argument('files', nargs=-1)
 @click.pass_context
 @with_config
-def push(cfg, ctx, quiet, apikey, update, overwrite, files):
+def push(cfg, ctx, quiet, apikey, update, overwrite, changed_only, sync, jobs,
+         rate, retries, files):
     """Pushes metadata to a richard instance."""
     if not quiet:
         click.echo(VERSION)
 
+    if sync and (update or overwrite or changed_only):
+        raise click.ClickException(
+            u'--sync can\'t be used with --update, --overwrite or --changed-only.')
+
+    if changed_only and not update:
+        raise click.ClickException(u'--changed-only only works with --update.')
+
     # Get username, api_url and api_key.
 
     username = get_from_config(cfg, 'username')
@@ -299,10 +457,7 @@ def push(cfg, ctx, quiet, apikey, update, overwrite, files):
     if not username or not api_url or not apikey:
         raise click.ClickException(u'Missing username, api_url or api_key.')
 
-    data = load_json_files(cfg)
-
-    if files:
-        data = [(fn, contents) for fn, contents in data if fn in files]
+    data = load_json_files(cfg, filenames=files or None)
 
     # There are two modes:
     #
@@ -317,13 +472,28 @@ def push(cfg, ctx, quiet, apikey, update, overwrite, files):
     # Go through and make sure there aren't any problems with
     # categories.
 
-    all_categories = dict(
-        [(cat['title'], cat)
-         for cat in steve.richardapi.get_all_categories(api_url)])
+    api = _get_api(cfg, api_url, jobs, rate, retries)
 
     try:
         category = cfg.get('project', 'category')
         category = category.strip()
+        wanted = set([category])
+    except ConfigParser.NoOptionError:
+        category = None
+        wanted = set(contents['category'] for fn, contents in data
+                     if contents.get('category'))
+
+    cache_file = get_cache_path(cfg, 'categories.json')
+    all_categories = steve.richardapi.get_all_categories(
+        api_url, cache_file=cache_file, api=api)
+    if not wanted.issubset(cat['title'] for cat in all_categories):
+        # A category might have been created since the list was
+        # cached, so check with the server.
+        all_categories = steve.richardapi.get_all_categories(
+            api_url, cache_file=cache_file, ttl=0, api=api)
+    all_categories = dict([(cat['title'], cat) for cat in all_categories])
+
+    if category is not None:
         if category not in all_categories:
             raise click.ClickException(
                 u'Category "{0}" does not exist on server. Build it there '
@@ -331,8 +501,6 @@ def push(cfg, ctx, quiet, apikey, update, overwrite, files):
             )
         else:
             click.echo('Category {0} exists on site.'.format(category))
-    except ConfigParser.NoOptionError:
-        category = None
 
     errors = []
     for fn, contents in data:
@@ -372,69 +540,143 @@ def push(cfg, ctx, quiet, apikey, update, overwrite, files):
     if errors:
         raise click.ClickException('\n'.join(errors))
 
+    for fn, contents in data:
+        contents['category'] = category or contents.get('category')
+
+    manifest = load_sync_manifest(cfg, api_url)
+    if sync:
+        new, modified, unchanged = diff_sync_manifest(manifest, data)
+
     # Everything looks ok. So double-check with the user and push.
 
     click.echo('Pushing to: {0}'.format(api_url))
     click.echo('Username:   {0}'.format(username))
     click.echo('api_key:    {0}'.format(apikey))
-    click.echo('update?:    {0}'.format(update))
-    click.echo('# videos:   {0}'.format(len(data)))
+    if sync:
+        click.echo('new:        {0}'.format(len(new)))
+        click.echo('modified:   {0}'.format(len(modified)))
+        click.echo('unchanged:  {0}'.format(len(unchanged)))
+    else:
+        click.echo('update?:    {0}'.format(update))
+        click.echo('# videos:   {0}'.format(len(data)))
     click.echo('Once you push, you can not undo it. Push for realz? Y/N')
     if not raw_input().strip().lower().startswith('y'):
         raise click.Abort()
 
-    for fn, contents in data:
-        contents['category'] = category or contents.get('category')
-
-        if not update:
+    if sync:
+        # Videos with ids get updated; the rest get created.
+        to_push = new + modified
+    else:
+        to_push = []
+        for fn, contents in data:
             # Nix any id field since that causes problems.
-            if 'id' in contents:
+            if not update and 'id' in contents:
                 if not overwrite:
-                    click.echo(u'Skipping... already exists.')
+                    click.echo(u'Skipping {0}... already exists.'.format(fn))
                     continue
                 del contents['id']
 
-            click.echo('Pushing {0}'.format(fn))
-            try:
-                vid = steve.richardapi.create_video(api_url, apikey, contents)
-
-                if 'id' in vid:
-                    contents['id'] = vid['id']
-                    click.echo('   Now has id {0}'.format(vid['id']))
-                else:
-                    click.echo('   Errors?: {0}'.format(vid), err=True)
-            except steve.restapi.RestAPIException as exc:
-                click.echo('   Error?: {0}'.format(exc), err=True)
-                click.echo('   "{0}"'.format(exc.response.content), err=True)
-
-        else:
-            click.echo('Updating {0} "{1}" ({2})'.format(
-                contents['id'], contents['title'], fn))
-            try:
-                vid = steve.richardapi.update_video(
-                    api_url, apikey, contents['id'], contents)
-            except steve.restapi.RestAPIException as exc:
-                click.echo('   Error?: {0}'.format(exc), err=True)
-                click.echo('   "{0}"'.format(exc.response.content), err=True)
-
-        save_json_file(cfg, fn, contents)
+            if changed_only and not changed_since_pull(manifest, fn, contents):
+                click.echo(u'Skipping {0}... unchanged since pull.'.format(fn))
+                continue
+
+            to_push.append((fn, contents))
+
+    def push_video(item):
+        fn, contents = item
+        if 'id' not in contents:
+            vid = steve.richardapi.create_video(
+                api_url, apikey, contents, api=api)
+            if 'id' not in vid:
+                raise SteveException('Errors?: {0}'.format(vid))
+            contents['id'] = vid['id']
+            return 'created', contents['id']
+
+        vid = steve.richardapi.update_video(
+            api_url, apikey, contents['id'], contents, api=api)
+        if 'updated' in vid:
+            contents['updated'] = vid['updated']
+        return 'updated', contents['id']
+
+    def save_pushed(to_save):
+        save_json_files(cfg, to_save)
+        # The server now has exactly what's on disk.
+        for fn, contents in to_save:
+            if ledger[fn]['status'] != 'error':
+                update_sync_manifest(manifest, fn, contents)
+        save_sync_manifest(cfg, api_url, manifest)
+
+    # filename -> {'status': ..., 'id': ..., 'error': ...}
+    ledger = {}
+    to_save = []
+    try:
+        for (fn, contents), result, exc in pool_map(push_video, to_push, jobs):
+            if exc is None:
+                status, video_id = result
+                ledger[fn] = {
+                    'status': status,
+                    'id': video_id,
+                    'error': None
+                }
+                click.echo(u'{0} {1} (id {2})'.format(
+                    ledger[fn]['status'].capitalize(), fn, video_id))
+            else:
+                ledger[fn] = {
+                    'status': 'error',
+                    'id': contents.get('id'),
+                    'error': exc
+                }
+                click.echo(u'Error pushing {0}: {1}'.format(fn, exc), err=True)
+                if getattr(exc, 'response', None) is not None:
+                    click.echo(u'   "{0}"'.format(exc.response.content), err=True)
+
+            # Save in batches so a long push doesn't lose every new id
+            # if it gets interrupted.
+            to_save.append((fn, contents))
+            if len(to_save) >= PUSH_SAVE_BATCH_SIZE:
+                save_pushed(to_save)
+                to_save = []
+    finally:
+        if to_save:
+            save_pushed(to_save)
+
+    failed = [fn for fn, _ in to_push if ledger[fn]['status'] == 'error']
+    click.echo()
+    click.echo('Pushed:  {0:4d}'.format(len(to_push) - len(failed)))
+    click.echo('Errors:  {0:4d}'.format(len(failed)))
+    if failed:
+        click.echo(tabulate.tabulate(
+            [[fn, ledger[fn]['id'] or '', ledger[fn]['error']] for fn in failed]))
+        raise click.ClickException(
+            u'{0} of {1} videos could not be pushed.'.format(
+                len(failed), len(to_push)))
 
 
 @cli.command()
+@click.option('--host', default=steve.webedit.HOST, help='Host to listen on')
+@click.option('--port', default=steve.webedit.PORT, type=int, help='Port to listen on')
+@click.option('--workers', default=steve.webedit.WORKERS, type=click.IntRange(min=1),
+              help='Number of requests to handle at the same time')
 @click.pass_context
 @with_config
-def webedit(cfg, ctx):
+def webedit(cfg, ctx, host, port, workers):
     """Launches web server so you can edit in browser."""
     click.echo(VERSION)
-    serve()
+    steve.webedit.serve(host=host, port=port, workers=workers)
 
 
 @cli.command()
 @click.option('--quiet/--no-quiet', default=False)
 @click.option('--apikey', default='', help='Pass in your API key via the command line')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of videos to pull at the same time')
+@click.option('--rate', default=None, type=click.FloatRange(min=0.1),
+              help='Maximum requests per second; overrides api_rate in steve.ini')
+@click.option('--retries', default=3, type=click.IntRange(min=0),
+              help='Times to retry a request that fails or is throttled')
 @click.pass_context
 @with_config
-def pull(cfg, ctx, quiet, apikey):
+def pull(cfg, ctx, quiet, apikey, jobs, rate, retries):
     """Pulls data from a richard instance."""
     if not quiet:
         click.echo(VERSION)
@@ -458,7 +700,7 @@ def pull(cfg, ctx, quiet, apikey):
     if not username or not api_url or not cat_title or not apikey:
         raise click.ClickException(u'Missing username, api_url or api_key.')
 
-    api = steve.restapi.API(api_url)
+    api = _get_api(cfg, api_url, jobs, rate, retries)
 
     all_categories = steve.restapi.get_content(
         api.category.get(username=username, api_key=apikey,
@@ -474,15 +716,27 @@ def pull(cfg, ctx, quiet, apikey):
 
     click.echo('Retrieved category.')
 
-    data = []
-
-    for counter, video_url in enumerate(cat['videos']):
+    def pull_video(item):
+        counter, video_url = item
         video_id = get_video_id(video_url)
-
-        video_data = steve.restapi.get_content(
+        return video_id, steve.restapi.get_content(
             api.video(video_id).get(username=username,
                                     api_key=apikey))
 
+    data = []
+    failed = []
+
+    # The counter comes from the position in the category and not from
+    # the order the requests finish in, so filenames are the same no
+    # matter how many jobs there are.
+    videos = enumerate(cat['videos'])
+    for (counter, video_url), result, exc in pool_map(pull_video, videos, jobs):
+        if exc is not None:
+            click.echo(u'Error pulling {0}: {1}'.format(video_url, exc), err=True)
+            failed.append(video_url)
+            continue
+
+        video_id, video_data = result
         click.echo('Working on "{0}"'.format(video_data['slug']))
 
         # Nix some tastypie bits from the data.
@@ -493,11 +747,82 @@ def pull(cfg, ctx, quiet, apikey):
         # Add id.
         video_data['id'] = video_id
 
-        fn = 'json/{0:4d}_{1}.json'.format(counter, video_data['slug'])
+        fn = '{0:04d}_{1}.json'.format(counter, video_data['slug'])
         data.append((fn, video_data))
 
     click.echo('Saving files....')
     save_json_files(cfg, data)
+    manifest = load_sync_manifest(cfg, api_url)
+    for fn, video_data in data:
+        update_sync_manifest(manifest, fn, video_data)
+    save_sync_manifest(cfg, api_url, manifest)
+
+    if failed:
+        raise click.ClickException(
+            u'{0} of {1} videos could not be pulled.'.format(
+                len(failed), len(cat['videos'])))
+
+
+def _open_other_storage(cfg, storage_name, path):
+    storage = steve.storage.get_storage(cfg)
+    other = steve.storage.open_storage(
+        storage_name or steve.storage.guess_storage_name(path), path)
+    if (other.name == storage.name
+            and os.path.abspath(other.path) == os.path.abspath(storage.path)):
+        raise click.ClickException(u'That\'s where this project keeps its videos.')
+    return storage, other
+
+
+@cli.command('export')
+@click.option('--quiet/--no-quiet', default=False)
+@click.option('--format', 'storage_name', default=None,
+              type=click.Choice(sorted(steve.storage.STORAGES)),
+              help='Kind of storage to write (default: guessed from PATH)')
+@click.argument('path', nargs=1)
+@click.pass_context
+@with_config
+def export_videos(cfg, ctx, quiet, storage_name, path):
+    """Copies all videos to another kind of storage.
+
+    PATH is a directory for json files or a .jsonl or .sqlite file.
+    Use this with import to switch a project between storages.
+    """
+    if not quiet:
+        click.echo(VERSION)
+
+    storage, other = _open_other_storage(cfg, storage_name, path)
+    items = list(storage.load())
+    written = other.save(items)
+    click.echo(u'Exported {0} videos to {1} ({2}), {3} changed.'.format(
+        len(items), path, other.name, len(written)))
+
+
+@cli.command('import')
+@click.option('--quiet/--no-quiet', default=False)
+@click.option('--format', 'storage_name', default=None,
+              type=click.Choice(sorted(steve.storage.STORAGES)),
+              help='Kind of storage to read (default: guessed from PATH)')
+@click.argument('path', nargs=1)
+@click.pass_context
+@with_config
+def import_videos(cfg, ctx, quiet, storage_name, path):
+    """Copies all videos from another kind of storage.
+
+    PATH is a directory of json files or a .jsonl or .sqlite file.
+    Videos are added to this project's storage, replacing ones with
+    the same name.
+    """
+    if not quiet:
+        click.echo(VERSION)
+
+    if not os.path.exists(path):
+        raise click.ClickException(u'"{0}" does not exist.'.format(path))
+
+    storage, other = _open_other_storage(cfg, storage_name, path)
+    items = list(other.load())
+    written = storage.save(items)
+    click.echo(u'Imported {0} videos from {1} ({2}), {3} changed.'.format(
+        len(items), path, other.name, len(written)))
 
 
 def exception_handler(exc_type, exc_value, exc_tb):
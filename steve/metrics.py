@@ -0,0 +1,244 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+"""
+Keeps track of how long the things steve does over the network take.
+
+Nothing is recorded until :py:func:`enable` is called, which is what
+``steve-cmd --stats`` does. After that, every request made with
+:py:mod:`steve.restapi` and every youtube-dl run is recorded and
+:py:func:`report` summarizes them.
+"""
+
+import json
+import os
+import threading
+import time
+
+import tabulate
+
+
+class Event(object):
+    """One request or subprocess run"""
+    __slots__ = ('kind', 'name', 'start', 'duration', 'status',
+                 'bytes_sent', 'bytes_received', 'attempt', 'thread')
+
+    def __init__(self, kind, name, start, duration, status=None,
+                 bytes_sent=0, bytes_received=0, attempt=0, thread=None):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.status = status
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.attempt = attempt
+        self.thread = thread
+
+    @property
+    def failed(self):
+        if self.kind == 'http':
+            return self.status is None or self.status >= 400
+        return self.status != 0
+
+
+def percentile(values, pct):
+    """Returns the ``pct`` percentile of sorted ``values``
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+
+    """
+    if not values:
+        return None
+    index = max(0, int(round(pct / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class MetricsRegistry(object):
+    """Collects events
+
+    :arg enabled: whether :py:meth:`record` keeps anything
+
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._events = []
+        self._started = time.time()
+
+    def clear(self):
+        with self._lock:
+            self._events = []
+            self._started = time.time()
+
+    def record(self, kind, name, start, duration, **kwargs):
+        """Records an event if the registry is enabled
+
+        :arg kind: what sort of thing it was, like ``'http'`` or
+            ``'youtube-dl'``
+        :arg name: what it was; things with the same kind and name
+            are summarized together
+        :arg start: when it started as a ``time.time()``
+        :arg duration: how long it took in seconds
+        :arg kwargs: ``status``, ``bytes_sent``, ``bytes_received``
+            and ``attempt`` (0 for the first try)
+
+        """
+        if not self.enabled:
+            return
+        event = Event(kind, name, start, duration,
+                      thread=threading.current_thread().name, **kwargs)
+        with self._lock:
+            self._events.append(event)
+
+    def events(self):
+        """Returns a list of the recorded :py:class:`Event` objects"""
+        with self._lock:
+            return list(self._events)
+
+    def summary(self):
+        """Summarizes the events by kind and name
+
+        :returns: list of dicts with ``kind``, ``name``, ``count``,
+            ``errors``, ``retries``, ``p50``, ``p90``, ``p99`` and
+            ``max`` (in seconds), ``bytes_sent`` and
+            ``bytes_received``
+
+        """
+        groups = {}
+        for event in self.events():
+            groups.setdefault((event.kind, event.name), []).append(event)
+
+        rows = []
+        for (kind, name), events in sorted(groups.items()):
+            durations = sorted(event.duration for event in events)
+            rows.append({
+                'kind': kind,
+                'name': name,
+                'count': len(events),
+                'errors': sum(1 for event in events if event.failed),
+                'retries': sum(1 for event in events if event.attempt),
+                'p50': percentile(durations, 50),
+                'p90': percentile(durations, 90),
+                'p99': percentile(durations, 99),
+                'max': durations[-1],
+                'bytes_sent': sum(event.bytes_sent for event in events),
+                'bytes_received': sum(event.bytes_received for event in events),
+            })
+        return rows
+
+    def report(self):
+        """Returns the summary as a table"""
+        rows = self.summary()
+        if not rows:
+            return 'No requests.'
+
+        def ms(seconds):
+            return '{0:.1f}'.format(seconds * 1000)
+
+        table = [
+            [row['name'], row['count'], row['errors'], row['retries'],
+             ms(row['p50']), ms(row['p90']), ms(row['p99']), ms(row['max']),
+             row['bytes_sent'], row['bytes_received']]
+            for row in rows
+        ]
+        return tabulate.tabulate(
+            table,
+            headers=['', 'count', 'errors', 'retries', 'p50 ms', 'p90 ms',
+                     'p99 ms', 'max ms', 'sent', 'received'])
+
+    def chrome_trace(self):
+        """Returns the events in Chrome's trace event format
+
+        Save it with :py:meth:`save_trace` and load it in
+        ``chrome://tracing`` or https://ui.perfetto.dev/ to see a
+        timeline of what happened in which thread.
+
+        """
+        pid = os.getpid()
+        threads = {}
+        trace = []
+        for event in self.events():
+            tid = threads.setdefault(event.thread, len(threads) + 1)
+            trace.append({
+                'name': event.name,
+                'cat': event.kind,
+                'ph': 'X',
+                'ts': int((event.start - self._started) * 1000000),
+                'dur': int(event.duration * 1000000),
+                'pid': pid,
+                'tid': tid,
+                'args': {
+                    'status': event.status,
+                    'attempt': event.attempt,
+                    'bytes_sent': event.bytes_sent,
+                    'bytes_received': event.bytes_received,
+                }
+            })
+        for name, tid in threads.items():
+            trace.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                'args': {'name': name}
+            })
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path):
+        """Writes :py:meth:`chrome_trace` to a file as JSON"""
+        with open(path, 'w') as fp:
+            json.dump(self.chrome_trace(), fp)
+
+
+registry = MetricsRegistry()
+
+
+def _record_request(info):
+    registry.record(
+        'http', '{0} {1}'.format(info['method'], info['endpoint']),
+        info['start'], info['duration'],
+        status=info['status'],
+        bytes_sent=info['bytes_sent'],
+        bytes_received=info['bytes_received'],
+        attempt=info['attempt'])
+
+
+def enable():
+    """Starts recording requests and youtube-dl runs"""
+    # Imported here so the scrapers can record things without pulling
+    # in requests.
+    from steve.restapi import add_request_hook
+
+    registry.enabled = True
+    add_request_hook(_record_request)
+
+
+def disable():
+    """Stops recording"""
+    from steve.restapi import remove_request_hook
+
+    registry.enabled = False
+    remove_request_hook(_record_request)
+
+
+def record(kind, name, start, duration, **kwargs):
+    """Records an event in the global registry
+
+    See :py:meth:`MetricsRegistry.record`.
+
+    """
+    registry.record(kind, name, start, duration, **kwargs)
+
+
+def report():
+    """Returns a table summarizing what was recorded"""
+    return registry.report()
+
+
+def save_trace(path):
+    """Saves a Chrome trace of what was recorded to ``path``"""
+    registry.save_trace(path)
@@ -12,9 +12,36 @@ with richard's API. It's a slim layer on top of requests.
 """
 
 import json
+import math
+import random
+import threading
+import time
 import urlparse
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing.pool import ThreadPool
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from steve.util import pool_map
+
+
+# Maximum number of connections kept open per host.
+DEFAULT_POOL_SIZE = 10
+
+# Number of pages paginate fetches at the same time.
+DEFAULT_PAGE_JOBS = 4
+
+# Number of requests an AsyncAPI has in flight at the same time.
+DEFAULT_ASYNC_JOBS = 100
+
+# Methods that are safe to send again when they fail.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# Statuses worth retrying. 429 means the request wasn't handled, so
+# it's retried for any method; the others only for idempotent ones.
+RETRY_STATUSES = (429, 502, 503, 504)
 
 
 def show_me_the_logs():
@@ -135,12 +162,359 @@ def get_content(resp):
         return resp.text
 
 
+def make_session(pool_size=DEFAULT_POOL_SIZE, retries=0):
+    """Builds a requests session with a connection pool
+
+    Connections are kept alive and reused by every request made with
+    the session.
+
+    :arg pool_size: maximum number of connections to keep open per
+        host; set this to at least the number of threads sharing the
+        session
+    :arg retries: number of times to retry idempotent requests that
+        fail to connect or come back with a 502, 503 or 504; 0 turns
+        retrying off
+
+    :returns: requests `Session`
+
+    """
+    if retries:
+        max_retries = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False)
+    else:
+        max_retries = 0
+
+    session = requests.session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=max_retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_request_hooks = []
+
+
+def add_request_hook(hook):
+    """Calls ``hook`` after every request attempt
+
+    ``hook`` gets a dict with:
+
+    * ``method``: the HTTP method
+    * ``url``: the url without the query string
+    * ``endpoint``: the url path with ids replaced by ``{id}``, like
+      ``/api/v2/video/{id}/``, for grouping requests
+    * ``status``: the status code or None if the request failed to
+      get a response
+    * ``bytes_sent`` and ``bytes_received``: body sizes
+    * ``start``: when the request was sent as a ``time.time()``
+    * ``duration``: how long it took in seconds
+    * ``attempt``: 0 for the first try, 1 for the first retry, etc
+
+    Hooks are called in the thread that made the request.
+
+    See :py:mod:`steve.metrics`.
+
+    """
+    if hook not in _request_hooks:
+        _request_hooks.append(hook)
+
+
+def remove_request_hook(hook):
+    """Stops calling a hook added with :py:func:`add_request_hook`"""
+    if hook in _request_hooks:
+        _request_hooks.remove(hook)
+
+
+def endpoint_template(url):
+    """Returns the path of a url with ids replaced by ``{id}``
+
+    >>> endpoint_template('http://example.com/api/v2/video/12/?page=2')
+    '/api/v2/video/{id}/'
+
+    """
+    path = urlparse.urlsplit(url)[2]
+    return '/'.join(
+        '{id}' if part.isdigit() else part for part in path.split('/'))
+
+
+def _call_hooks(method, url, resp, data, start, attempt):
+    info = {
+        'method': method,
+        'url': url,
+        'endpoint': endpoint_template(url),
+        'status': resp.status_code if resp is not None else None,
+        'bytes_sent': len(data or ''),
+        'bytes_received': len(resp.content or '') if resp is not None else 0,
+        'start': start,
+        'duration': time.time() - start,
+        'attempt': attempt,
+    }
+    for hook in list(_request_hooks):
+        hook(info)
+
+
+def get_retry_after(resp):
+    """Returns the number of seconds a response asks us to wait
+
+    :arg resp: requests `Response`
+
+    :returns: seconds as a float or None if the response has no
+        usable ``Retry-After`` header
+
+    """
+    value = resp.headers.get('retry-after')
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(mktime_tz(date) - time.time(), 0.0)
+
+
+class Scheduler(object):
+    """Decides when requests to an api go out
+
+    Every request made through an :py:class:`API` goes through its
+    scheduler, which:
+
+    * keeps requests at most ``rate`` per second
+    * keeps at most ``concurrency`` requests in flight and adapts that
+      to how the server is doing: every 429 or 5xx response or failed
+      connection halves the limit, every other response raises it so
+      that it grows by about one per round of requests
+    * holds off every request when a response has a ``Retry-After``
+      header
+    * retries requests that fail with a connection error or one of
+      ``RETRY_STATUSES``, waiting a random time up to ``backoff *
+      2 ** attempt`` seconds between tries
+
+    Only idempotent requests are retried, except after a 429.
+
+    :arg rate: maximum requests per second; None means no limit
+    :arg concurrency: maximum number of requests in flight; None means
+        no limit
+    :arg retries: number of times to retry a request; 0 turns
+        retrying off
+    :arg backoff: base delay in seconds between retries
+    :arg max_backoff: maximum delay in seconds between retries
+
+    """
+    def __init__(self, rate=None, concurrency=None, retries=0, backoff=0.5,
+                 max_backoff=30.0):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._limit = float(concurrency) if concurrency else None
+        self._in_flight = 0
+        self._next_start = 0.0
+        self._paused_until = 0.0
+        # Every request gets a number. The limit is only halved for
+        # requests sent after the last time it was halved, so a burst
+        # of failures from one round counts once.
+        self._sent = 0
+        self._halved_at = 0
+
+    @property
+    def limit(self):
+        """Current number of requests allowed in flight or None"""
+        if self._limit is None:
+            return None
+        return int(self._limit)
+
+    def acquire(self):
+        """Waits until a request can go out
+
+        :returns: a ticket to pass to :py:meth:`release`
+
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._paused_until > now:
+                    self._cond.wait(self._paused_until - now)
+                elif self._limit is not None and self._in_flight >= int(self._limit):
+                    self._cond.wait()
+                else:
+                    break
+
+            self._in_flight += 1
+            self._sent += 1
+            ticket = self._sent
+            start = now
+            if self.rate:
+                start = max(now, self._next_start)
+                self._next_start = start + 1.0 / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+        return ticket
+
+    def release(self, ticket, failed=False, retry_after=None):
+        """Records how a request went
+
+        :arg ticket: what :py:meth:`acquire` returned
+        :arg failed: whether the server failed or said to slow down
+        :arg retry_after: seconds the server asked us to wait
+
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if retry_after:
+                self._paused_until = max(
+                    self._paused_until, time.time() + retry_after)
+
+            if self._limit is not None:
+                if not failed:
+                    self._limit = min(
+                        float(self.concurrency), self._limit + 1.0 / self._limit)
+                elif ticket > self._halved_at:
+                    self._limit = max(1.0, self._limit / 2)
+                    self._halved_at = self._sent
+
+            self._cond.notify_all()
+
+    def wait_to_retry(self, attempt):
+        """Sleeps a random time before retry number ``attempt + 1``"""
+        time.sleep(random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+
+def resize_pool(session, pool_size):
+    """Makes sure a session can keep ``pool_size`` connections open
+
+    Adapters with smaller pools are replaced; connections they have
+    open are dropped.
+
+    :arg session: requests `Session`
+    :arg pool_size: minimum number of connections to keep per host
+
+    """
+    for prefix, adapter in session.adapters.items():
+        if getattr(adapter, '_pool_maxsize', pool_size) < pool_size:
+            session.mount(prefix, HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size,
+                max_retries=adapter.max_retries))
+
+
+def get_connection_stats(session):
+    """Returns connection counts for a session
+
+    :arg session: requests `Session`
+
+    :returns: dict with ``connections`` (number of connections
+        opened), ``requests`` (number of requests sent) and ``reused``
+        (number of requests that went over an already-open
+        connection)
+
+    """
+    connections = 0
+    sent = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            connections += pool.num_connections
+            sent += pool.num_requests
+
+    return {
+        'connections': connections,
+        'requests': sent,
+        'reused': max(sent - connections, 0)
+    }
+
+
+def iter_pages(resource, first_page=None, jobs=DEFAULT_PAGE_JOBS, **kwargs):
+    """Yields the content of every page of a paginated listing
+
+    richard listings look like this::
+
+        {"count": 120, "next": "...?page=2", "previous": null,
+         "results": [...]}
+
+    Once the first page is in, ``count`` says how many pages there
+    are, so the rest are fetched ``jobs`` at a time rather than
+    following ``next`` one by one. Pages are yielded in order. If the
+    server doesn't say how many there are, this falls back to
+    following ``next``.
+
+    :arg resource: the :py:class:`Resource` for the listing
+    :arg first_page: the content of the first page if you already
+        have it
+    :arg jobs: maximum number of pages to fetch at the same time
+    :arg kwargs: query string parameters for every page
+
+    :returns: generator of page contents
+
+    :raises steve.restapi.RestAPIException: if a page can't be
+        fetched
+
+    """
+    page = first_page
+    if page is None:
+        page = get_content(resource.get(**kwargs))
+    yield page
+
+    page_size = len(page['results'])
+    if page.get('next') and page.get('count') and page_size:
+        num_pages = int(math.ceil(float(page['count']) / page_size))
+
+        def get_page(number):
+            return get_content(resource.get(page=number, **kwargs))
+
+        for number, page, exc in pool_map(get_page, range(2, num_pages + 1), jobs):
+            if exc is not None:
+                raise exc
+            yield page
+
+    # Either the server didn't give a count or things were added
+    # while we were fetching, so follow next for whatever is left.
+    while page.get('next'):
+        qs = urlparse.parse_qs(urlparse.urlparse(page['next']).query)
+        page = get_content(resource.get(page=qs['page'], **kwargs))
+        yield page
+
+
+def paginate(resource, first_page=None, jobs=DEFAULT_PAGE_JOBS, **kwargs):
+    """Yields every result of a paginated listing in order
+
+    Takes the same arguments as :py:func:`iter_pages`.
+
+    Example::
+
+        from steve.restapi import API, paginate
+
+        api = API('http://pyvideo.org/api/v2/')
+        for cat in paginate(api.category):
+            print cat['title']
+
+    """
+    for page in iter_pages(resource, first_page=first_page, jobs=jobs, **kwargs):
+        for item in page['results']:
+            yield item
+
+
 class Resource(object):
     """Convenience wrapper for requests.request.
 
     HTTP methods return requests Response objects or throw
     exceptions in cases where things are weird.
 
+    Resources derived from this one with ``resource(id)`` share its
+    session and thus its connection pool.
+
     """
     def __init__(self, **kwargs):
         self._kwargs = kwargs
@@ -155,7 +529,10 @@ class Resource(object):
             url = url + '/'
 
         self._kwargs['url'] = url
-        self.session = requests.session()
+        self.session = self._kwargs['session'] = (
+            kwargs.get('session') or requests.session())
+        self.scheduler = self._kwargs['scheduler'] = (
+            kwargs.get('scheduler') or Scheduler())
 
     def __call__(self, id_):
         kwargs = dict(self._kwargs)
@@ -181,8 +558,44 @@ class Resource(object):
         if headers:
             default_headers.update(headers)
 
-        resp = self.session.request(method, url, data=data, params=params,
-                                    headers=default_headers)
+        scheduler = self.scheduler
+        attempt = 0
+        while True:
+            ticket = scheduler.acquire()
+            start = time.time()
+            resp = None
+            try:
+                try:
+                    resp = self.session.request(
+                        method, url, data=data, params=params,
+                        headers=default_headers)
+                finally:
+                    if _request_hooks:
+                        _call_hooks(method, url, resp, data, start, attempt)
+            except BaseException as exc:
+                # Whatever went wrong, the slot has to go back or every
+                # later request waits for it forever.
+                scheduler.release(ticket, failed=True)
+                if (not isinstance(exc, requests.ConnectionError)
+                        or method not in IDEMPOTENT_METHODS
+                        or attempt >= scheduler.retries):
+                    raise
+                retry_after = None
+            else:
+                status = resp.status_code
+                failed = status == 429 or status >= 500
+                retry_after = get_retry_after(resp) if failed else None
+                scheduler.release(ticket, failed=failed, retry_after=retry_after)
+
+                if (status not in RETRY_STATUSES
+                        or attempt >= scheduler.retries
+                        or (status != 429 and method not in IDEMPOTENT_METHODS)):
+                    break
+
+            # With a Retry-After, acquire holds off until then.
+            if retry_after is None:
+                scheduler.wait_to_retry(attempt)
+            attempt += 1
 
         if 400 <= resp.status_code <= 499:
             raise Http4xxException(
@@ -195,11 +608,22 @@ class Resource(object):
 
         return resp
 
-    def get(self, auth_token=None, **kwargs):
-        headers = self._get_auth_header(auth_token)
+    def get(self, auth_token=None, headers=None, **kwargs):
+        """Does a GET
 
-        resp = self._request('GET', params=kwargs, headers=headers)
-        if 200 <= resp.status_code <= 299:
+        :arg auth_token: auth token
+        :arg headers: dict of extra request headers; if these include
+            ``If-None-Match`` or ``If-Modified-Since``, a 304 response
+            is returned rather than raising an exception
+        :arg kwargs: query string parameters
+
+        """
+        all_headers = self._get_auth_header(auth_token)
+        if headers:
+            all_headers.update(headers)
+
+        resp = self._request('GET', params=kwargs, headers=all_headers)
+        if 200 <= resp.status_code <= 299 or resp.status_code == 304:
             return resp
         raise RestAPIException(
             'Unknown response: {0}'.format(resp.status_code),
@@ -237,7 +661,7 @@ class Resource(object):
         elif 200 <= resp.status_code <= 299:
             # If the server didn't return the data or a redirect, we
             # go fetch it.
-            if not resp.json:
+            if not resp.content:
                 resp = self._request('GET', params=kwargs)
             return resp
 
@@ -278,13 +702,202 @@ class API(object):
         # Create a new video. This does a POST and if there's a
         # redirect, will pick that up.
         newvideo = api.video.post(data={'somekey': 'newvalue'})
+
+    All resources created from an API share one session, so
+    connections get reused between requests, and one
+    :py:class:`Scheduler`, so rate limits and backoff apply to
+    everything sent to the api.
+
+    :arg base_url: url for the api
+    :arg session: requests `Session` to use; if None, one is built
+        with :py:func:`make_session`
+    :arg pool_size: passed to :py:func:`make_session`
+    :arg retries: passed to :py:class:`Scheduler`
+    :arg rate: passed to :py:class:`Scheduler`
+    :arg concurrency: passed to :py:class:`Scheduler`
+    :arg scheduler: :py:class:`Scheduler` to use instead of building
+        one
+
     """
 
-    def __init__(self, base_url):
+    def __init__(self, base_url, session=None, pool_size=DEFAULT_POOL_SIZE,
+                 retries=0, rate=None, concurrency=None, scheduler=None):
         self.base_url = base_url
+        if session is None:
+            session = make_session(pool_size=pool_size)
+        self.session = session
+        if scheduler is None:
+            scheduler = Scheduler(
+                rate=rate, concurrency=concurrency, retries=retries)
+        self.scheduler = scheduler
 
     def __getattr__(self, key):
         if key in self.__dict__:
             return self.__dict__[key]
 
-        return Resource(url=urljoin(self.base_url, str(key)))
+        return Resource(url=urljoin(self.base_url, str(key)),
+                        session=self.session, scheduler=self.scheduler)
+
+    def connection_stats(self):
+        """Returns connection counts for this API's session
+
+        See :py:func:`get_connection_stats`.
+
+        """
+        return get_connection_stats(self.session)
+
+
+_apis = {}
+_apis_lock = threading.Lock()
+
+
+def get_api(base_url, **kwargs):
+    """Returns the shared API object for a url
+
+    The first call for a url creates the API with ``kwargs``. After
+    that, every call gets the same API back so everything talking to
+    that url shares one connection pool.
+
+    :arg base_url: url for the api
+    :arg kwargs: passed to :py:class:`API` the first time
+
+    :returns: :py:class:`API`
+
+    """
+    with _apis_lock:
+        if base_url not in _apis:
+            _apis[base_url] = API(base_url, **kwargs)
+        return _apis[base_url]
+
+
+class AsyncResource(object):
+    """A :py:class:`Resource` whose methods don't wait
+
+    ``get``, ``post``, ``put`` and ``delete`` take the same arguments
+    as the :py:class:`Resource` ones, but send the request on the
+    :py:class:`AsyncAPI`'s workers and return a
+    ``multiprocessing.pool.AsyncResult`` right away. Its ``get()``
+    waits for the response and returns it or raises the same
+    exceptions the blocking call would.
+
+    """
+    def __init__(self, resource, get_pool):
+        self.resource = resource
+        self._get_pool = get_pool
+
+    def __call__(self, id_):
+        return AsyncResource(self.resource(id_), self._get_pool)
+
+    def _submit(self, method, args, kwargs):
+        return self._get_pool().apply_async(
+            getattr(self.resource, method), args, kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._submit('get', args, kwargs)
+
+    def post(self, *args, **kwargs):
+        return self._submit('post', args, kwargs)
+
+    def put(self, *args, **kwargs):
+        return self._submit('put', args, kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._submit('delete', args, kwargs)
+
+
+class AsyncAPI(object):
+    """An :py:class:`API` whose requests don't wait
+
+    Example::
+
+        from steve.restapi import API, AsyncAPI, get_content
+
+        api = AsyncAPI(API('http://pyvideo.org/api/v2/'))
+
+        # Sends all the requests without waiting for any of them
+        pending = [api.video(video_id).get() for video_id in video_ids]
+
+        # Then waits for each one in turn
+        videos = [get_content(result.get()) for result in pending]
+
+    Up to ``jobs`` requests are in flight at once; the rest wait
+    their turn. The requests go through the wrapped API, so they share
+    its session and :py:class:`Scheduler` with any blocking requests
+    made with it.
+
+    .. Note::
+
+       Python 2 doesn't have asyncio, so the requests are sent from a
+       pool of worker threads.
+
+    :arg api: the :py:class:`API` to send requests with
+    :arg jobs: maximum number of requests in flight
+
+    """
+    def __init__(self, api, jobs=DEFAULT_ASYNC_JOBS):
+        self.api = api
+        self.jobs = jobs
+        self._pool = None
+        self._lock = threading.Lock()
+        resize_pool(api.session, jobs)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.jobs)
+            return self._pool
+
+    def __getattr__(self, key):
+        if key in self.__dict__:
+            return self.__dict__[key]
+
+        return AsyncResource(getattr(self.api, key), self._get_pool)
+
+    def submit(self, fun, *args, **kwargs):
+        """Calls ``fun(*args, **kwargs)`` on a worker
+
+        Use this for things that make requests with the wrapped API
+        themselves, like the :py:mod:`steve.richardapi` functions.
+
+        :returns: ``multiprocessing.pool.AsyncResult``
+
+        """
+        return self._get_pool().apply_async(fun, args, kwargs)
+
+    def close(self):
+        """Waits for requests in flight and stops the workers"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_async_apis = {}
+
+
+def get_async_api(base_url, jobs=DEFAULT_ASYNC_JOBS, **kwargs):
+    """Returns the shared AsyncAPI for a url
+
+    It wraps the API :py:func:`get_api` returns for the url, so it
+    shares that API's connection pool and scheduler.
+
+    :arg base_url: url for the api
+    :arg jobs: maximum number of requests in flight; only used the
+        first time
+    :arg kwargs: passed to :py:func:`get_api`
+
+    :returns: :py:class:`AsyncAPI`
+
+    """
+    api = get_api(base_url, pool_size=jobs, **kwargs)
+    with _apis_lock:
+        if base_url not in _async_apis:
+            _async_apis[base_url] = AsyncAPI(api, jobs=jobs)
+        return _async_apis[base_url]
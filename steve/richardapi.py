@@ -6,11 +6,12 @@
 # license.
 #######################################################################
 
-# FIXME: Fix for python3
-import urlparse
+import json
+import os
+import time
 
 from steve import restapi
-from steve.util import SteveException, verify_video_data
+from steve.util import SteveException, verify_video_data, write_file_atomically
 
 
 STATE_LIVE = 1
@@ -43,10 +44,70 @@ class DoesNotExist(SteveException):
     pass
 
 
-def get_all_categories(api_url):
+# Seconds a cached list of categories is used before checking with
+# the server again.
+CATEGORY_CACHE_TTL = 60 * 60
+
+# api_url -> cache entry; see get_all_categories
+_category_memo = {}
+
+
+def _fetch_categories(api, headers=None):
+    """Fetches all pages of categories
+
+    :returns: ``(first page response, list of categories)``; the list
+        is None if the server said the first page is not modified
+
+    """
+    first = api.category.get(headers=headers)
+    if first.status_code == 304:
+        return first, None
+
+    # If there are more than 50 categories, then the results are
+    # paged.
+    cats = list(restapi.paginate(
+        api.category, first_page=restapi.get_content(first)))
+
+    return first, cats
+
+
+def _load_category_cache(cache_file):
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as fp:
+                return json.load(fp)
+        except ValueError:
+            # Broken cache file. Pretend it's not there.
+            pass
+    return {}
+
+
+def _save_category_cache(cache_file, api_url, entry):
+    cache = _load_category_cache(cache_file)
+    cache[api_url] = entry
+    # A half-written cache would lose every api url's categories, so
+    # it's swapped in whole.
+    write_file_atomically(cache_file, json.dumps(cache), fsync=False)
+
+
+def get_all_categories(api_url, cache_file=None, ttl=CATEGORY_CACHE_TTL,
+                       api=None):
     """Given an api_url, retrieves all categories
 
+    Categories are cached in memory and, if ``cache_file`` is given,
+    on disk, so that calling this again doesn't re-download every
+    page. Once the cached copy is older than ``ttl`` seconds, it's
+    revalidated: if the server sent an ``ETag`` or ``Last-Modified``
+    header last time, a conditional GET is done for the first page;
+    otherwise all the pages are fetched again.
+
     :arg api_url: URL for the api.
+    :arg cache_file: path of the JSON file to cache categories in
+        between runs or None to only cache in memory
+    :arg ttl: seconds a cached copy is good for; 0 always checks with
+        the server
+    :arg api: the :py:class:`steve.restapi.API` to use; None uses
+        the shared one for ``api_url``
 
     :returns: list of dicts each belonging to a category
 
@@ -64,29 +125,50 @@ def get_all_categories(api_url):
         # [u'PyCon 2012', u'PyCon 2011', etc.]
 
     """
-    api = restapi.API(api_url)
+    now = time.time()
 
-    # Build a dict of cat title -> cat data
-    resp = restapi.get_content(api.category.get())
+    entry = _category_memo.get(api_url)
+    if entry is None:
+        entry = _load_category_cache(cache_file).get(api_url)
 
-    cats = resp['results']
+    if entry is not None and now - entry['fetched'] < ttl:
+        _category_memo[api_url] = entry
+        return list(entry['categories'])
 
-    # If there are more than 50 categories, then the results are paged. So we
-    # hit each "next' page until we have all the results.
-    while resp['next'] is not None:
-        parts = urlparse.urlparse(resp['next'])
-        qs = urlparse.parse_qs(parts.query)
-        resp = restapi.get_content(api.category.get(page=qs['page']))
-        cats.extend(resp['results'])
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
 
-    return cats
+    if api is None:
+        api = restapi.get_api(api_url)
+    resp, cats = _fetch_categories(api, headers=headers or None)
 
+    if cats is None:
+        # Not modified, so the cached copy is still good.
+        cats = entry['categories']
 
-def get_category(api_url, title):
+    entry = {
+        'fetched': now,
+        'etag': resp.headers.get('etag'),
+        'last_modified': resp.headers.get('last-modified'),
+        'categories': cats
+    }
+    _category_memo[api_url] = entry
+    if cache_file:
+        _save_category_cache(cache_file, api_url, entry)
+
+    return list(cats)
+
+
+def get_category(api_url, title, cache_file=None):
     """Gets information for specified category
 
     :arg api_url: URL for the api
     :arg title: title of category to retrieve
+    :arg cache_file: see :py:func:`get_all_categories`
 
     :returns: category data
 
@@ -94,10 +176,18 @@ def get_category(api_url, title):
         exist
 
     """
-    all_categories = get_all_categories(api_url)
+    all_categories = get_all_categories(api_url, cache_file=cache_file)
 
     cats_by_title = [cat for cat in all_categories
                      if cat['title'] == title]
+    if not cats_by_title:
+        # The category might have been created since we cached the
+        # list, so check with the server.
+        all_categories = get_all_categories(
+            api_url, cache_file=cache_file, ttl=0)
+        cats_by_title = [cat for cat in all_categories
+                         if cat['title'] == title]
+
     if cats_by_title:
         return cats_by_title[0]
 
@@ -117,11 +207,37 @@ def get_video(api_url, auth_token, video_id):
         exist
 
     """
-    api = restapi.API(api_url)
+    api = restapi.get_api(api_url)
     return restapi.get_content(api.video(video_id).get(auth_token=auth_token))
 
 
-def create_video(api_url, auth_token, video_data):
+def get_videos(api_url, auth_token, video_ids, jobs=restapi.DEFAULT_ASYNC_JOBS):
+    """Gets information for a bunch of videos at once
+
+    Up to ``jobs`` requests are in flight at the same time. See
+    :py:class:`steve.restapi.AsyncAPI`.
+
+    :arg api_url: URL for the api
+    :arg auth_token: auth token
+    :arg video_ids: ids of the videos
+    :arg jobs: maximum number of requests in flight
+
+    :returns: generator of ``(video_id, video data, exception)``
+        tuples in the order of ``video_ids``; exception is None if
+        the video was fetched
+
+    """
+    api = restapi.get_async_api(api_url, jobs=jobs)
+    pending = [(video_id, api.video(video_id).get(auth_token=auth_token))
+               for video_id in video_ids]
+    for video_id, result in pending:
+        try:
+            yield video_id, restapi.get_content(result.get()), None
+        except Exception as exc:
+            yield video_id, None, exc
+
+
+def create_video(api_url, auth_token, video_data, api=None):
     """Creates a video on the site
 
     This creates a video on the site using HTTP POST. It returns
@@ -135,6 +251,8 @@ def create_video(api_url, auth_token, video_data):
     :arg auth_token: auth token
     :arg video_data: Python dict holding the values to create
         this video
+    :arg api: the :py:class:`steve.restapi.API` to use; None uses
+        the shared one for ``api_url``
 
     :returns: the video data
 
@@ -187,12 +305,13 @@ def create_video(api_url, auth_token, video_data):
     # TODO: Check to see if the video exists already. Probably
     # want to use (category, title) as a key.
 
-    api = restapi.API(api_url)
+    if api is None:
+        api = restapi.get_api(api_url)
     return restapi.get_content(
         api.video.post(data=video_data, auth_token=auth_token))
 
 
-def update_video(api_url, auth_token, video_id, video_data):
+def update_video(api_url, auth_token, video_id, video_data, api=None):
     """Updates an existing video on the site
 
     This updates an existing video on the site using HTTP PUT. It
@@ -212,6 +331,8 @@ def update_video(api_url, auth_token, video_id, video_data):
     :arg auth_token: auth token
     :arg video_id: The id for the video
     :arg video_data: Python dict holding all the data for this video
+    :arg api: the :py:class:`steve.restapi.API` to use; None uses
+        the shared one for ``api_url``
 
     :returns: the updated video data
 
@@ -272,13 +393,11 @@ def update_video(api_url, auth_token, video_id, video_data):
         raise MissingRequiredData(
             'video data has errors: {0}'.format(repr(errors)))
 
-    api = restapi.API(api_url)
-
-    # Try to get the video on the site. This will kick up a 404
-    # if it doesn't exist.
-    api.video(video_id).get(auth_token=auth_token)
+    if api is None:
+        api = restapi.get_api(api_url)
 
-    # Everything is probably fine, so try to update the data.
+    # If the video doesn't exist, the PUT kicks up a 404, so there's
+    # no need to GET it first.
     return restapi.get_content(
         api.video(video_id).put(data=video_data,
                                 auth_token=auth_token))
@@ -6,11 +6,17 @@
 # license.
 #######################################################################
 
+import importlib
 import json
+import os
 import subprocess
+import tempfile
+import threading
+import time
 from datetime import datetime
 
-from steve.util import is_youtube
+from steve import metrics
+from steve.util import _url_host, err, is_youtube, pool_map, YOUTUBE_HOSTS
 
 
 class ScraperError(Exception):
@@ -18,12 +24,56 @@ class ScraperError(Exception):
 
 
 class Scraper(object):
-    def scrape(self, url):
+    """Base class for scrapers
+
+    Subclasses list the hosts they handle in ``hosts`` and implement
+    :py:meth:`scrape`. Subdomains of a host are handled too, so
+    ``youtube.com`` covers ``www.youtube.com``.
+
+    """
+    #: hosts this scraper handles
+    hosts = ()
+
+    def scrape(self, url, skip_ids=None):
         """Takes a url and returns list of dicts or None if not handled"""
-        raise NotImplemented
+        raise NotImplementedError
+
+    def iter_scrape(self, url, skip_ids=None):
+        """Like :py:meth:`scrape`, but returns a generator
+
+        Scrapers that can hand back videos as they find them should
+        override this.
 
+        """
+        items = self.scrape(url, skip_ids=skip_ids)
+        if items is None:
+            return
+        return iter(items)
+
+    def iter_scrape_parallel(self, url, skip_ids=None, jobs=4, retries=2):
+        """Scrapes a url working on several videos at once
+
+        Scrapers that can't do that fall back to :py:meth:`iter_scrape`.
+
+        :returns: generator of ``(video_id, dict, exc)`` tuples or None
+            if the url isn't handled
+
+        """
+        items = self.iter_scrape(url, skip_ids=skip_ids)
+        if items is None:
+            return
+        return ((None, item, None) for item in items)
+
+
+class YoutubeScraper(Scraper):
+    # Has to match is_youtube or urls get sent here and then turned
+    # away.
+    hosts = YOUTUBE_HOSTS
+
+    # Seconds to wait before retrying a video. It goes up by this much
+    # with every try.
+    retry_delay = 2
 
-class YoutubeScraper(object):
     def transform_item(self, item):
         """Converts youtube-dl output to richard fields"""
         return {
@@ -45,28 +95,291 @@ class YoutubeScraper(object):
             'speakers': []
         }
 
-    def scrape(self, url):
-        """Scrapes a url by passing it through youtube-dl"""
+    def make_archive(self, skip_ids):
+        """Writes a youtube-dl download archive listing skip_ids
+
+        youtube-dl skips videos in the archive before it fetches their
+        data, so a playlist with a few new videos only costs a few
+        fetches.
+
+        :returns: path of the archive file; delete it when done
+
+        """
+        fd, path = tempfile.mkstemp(prefix='steve-', suffix='.txt')
+        with os.fdopen(fd, 'w') as fp:
+            for video_id in sorted(skip_ids):
+                fp.write('youtube {0}\n'.format(video_id))
+        return path
+
+    def iter_scrape(self, url, skip_ids=None):
+        """Scrapes a url by passing it through youtube-dl
+
+        Videos come back one at a time as youtube-dl finds them, so
+        you can save each one right away and only one is held in
+        memory at a time.
+
+        :arg url: the url to scrape
+        :arg skip_ids: YouTube video ids to skip
+
+        :returns: generator of dicts or None if not handled
+
+        :raises ScraperError: while iterating, if youtube-dl fails
+
+        """
         if not is_youtube(url):
             return
+        return self._iter_youtube_dl(url, skip_ids)
+
+    def _iter_youtube_dl(self, url, skip_ids):
+        cmd = ['youtube-dl', '-j', url]
+        archive = None
+        if skip_ids:
+            archive = self.make_archive(skip_ids)
+            cmd.extend(['--download-archive', archive])
 
-        # FIXME: Sometimes youtube-dl takes a *long* time to run. This
-        # needs to give indication of progress.
+        # stderr goes to a file so youtube-dl can't get stuck writing
+        # to a pipe nobody reads while we're reading stdout.
+        stderr = tempfile.TemporaryFile()
         try:
-            output = subprocess.check_output(
-                ['youtube-dl', '-j', url],
-                stderr=subprocess.STDOUT
-            )
-        except subprocess.CalledProcessError as cpe:
-            raise ScraperError('youtube-dl said "{0}".'.format(cpe.output))
+            start = time.time()
+            try:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                        stderr=stderr)
+            except OSError:
+                raise ScraperError('youtube-dl not installed or not on PATH.')
+
+            received = 0
+            try:
+                # Each line is a single JSON object. readline doesn't
+                # wait for a buffer to fill up like iterating does.
+                for line in iter(proc.stdout.readline, ''):
+                    received += len(line)
+                    if line.strip():
+                        yield self.transform_item(json.loads(line))
+            finally:
+                if proc.poll() is None:
+                    # Whoever was iterating stopped early.
+                    proc.kill()
+                proc.stdout.close()
+                returncode = proc.wait()
+                metrics.record('youtube-dl', 'youtube-dl -j', start,
+                               time.time() - start, status=returncode,
+                               bytes_received=received)
+
+            if returncode != 0:
+                stderr.seek(0)
+                raise ScraperError('youtube-dl said "{0}".'.format(
+                    stderr.read().strip()))
+        finally:
+            stderr.close()
+            if archive is not None:
+                os.remove(archive)
+
+    def _run_youtube_dl(self, args, attempt=0):
+        """Runs youtube-dl and returns its output
+
+        :raises ScraperError: if youtube-dl fails
+
+        """
+        start = time.time()
+        try:
+            proc = subprocess.Popen(['youtube-dl'] + args,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
         except OSError:
             raise ScraperError('youtube-dl not installed or not on PATH.')
+        stdout, stderr = proc.communicate()
+        # The url is left out so runs are summarized together.
+        metrics.record(
+            'youtube-dl', ' '.join(['youtube-dl'] + args[:-1]), start,
+            time.time() - start, status=proc.returncode,
+            bytes_received=len(stdout), attempt=attempt)
+        if proc.returncode != 0:
+            raise ScraperError('youtube-dl said "{0}".'.format(stderr.strip()))
+        return stdout
+
+    def list_video_ids(self, url):
+        """Lists the ids of the videos at a url in playlist order
+
+        This uses youtube-dl's flat playlist mode, which only reads
+        the playlist and doesn't fetch anything for the videos, so
+        it's quick.
 
-        # Each line is a single JSON object.
-        items = []
+        :raises ScraperError: if youtube-dl fails
+
+        """
+        output = self._run_youtube_dl(['--flat-playlist', '-j', url])
+        ids = []
         for line in output.splitlines():
-            items.append(json.loads(line))
+            if line.strip():
+                ids.append(json.loads(line)['id'])
+        return ids
+
+    def scrape_video_id(self, video_id, retries=0):
+        """Scrapes a single video by id
+
+        :arg video_id: YouTube video id
+        :arg retries: how many more times to try if youtube-dl fails
+
+        :returns: dict
+
+        :raises ScraperError: if youtube-dl fails every time
+
+        """
+        url = 'https://www.youtube.com/watch?v={0}'.format(video_id)
+        for attempt in range(retries + 1):
+            try:
+                output = self._run_youtube_dl(['-j', url], attempt=attempt)
+                return self.transform_item(json.loads(output))
+            except ScraperError:
+                if attempt == retries:
+                    raise
+                time.sleep(self.retry_delay * (attempt + 1))
+
+    def iter_scrape_parallel(self, url, skip_ids=None, jobs=4, retries=2):
+        """Scrapes a url with one youtube-dl per video
+
+        First the video ids are listed (see :py:meth:`list_video_ids`),
+        then up to ``jobs`` youtube-dl processes fetch the videos. A
+        video that fails is tried again up to ``retries`` times by
+        itself and if it still fails, the rest carry on.
+
+        :arg url: the url to scrape
+        :arg skip_ids: YouTube video ids to skip
+        :arg jobs: number of youtube-dl processes to run at once
+        :arg retries: how many more times to try a video that fails
+
+        :returns: generator of ``(video_id, dict, exc)`` tuples in
+            playlist order where ``exc`` is None if it worked, or
+            None if the url isn't handled
+
+        :raises ScraperError: if the videos can't be listed
+
+        """
+        if not is_youtube(url):
+            return
+
+        skip_ids = set(skip_ids or [])
+        video_ids = [video_id for video_id in self.list_video_ids(url)
+                     if video_id not in skip_ids]
+        return pool_map(
+            lambda video_id: self.scrape_video_id(video_id, retries),
+            video_ids, jobs)
+
+    def scrape(self, url, skip_ids=None):
+        """Scrapes a url by passing it through youtube-dl
+
+        :arg url: the url to scrape
+        :arg skip_ids: YouTube video ids to skip
+
+        :returns: list of dicts or None if not handled
+
+        """
+        items = self.iter_scrape(url, skip_ids=skip_ids)
+        if items is None:
+            return
+        return list(items)
+
+
+class ScraperRegistry(object):
+    """Knows which scraper handles which host
+
+    Scrapers are looked up by host in an index rather than asked one
+    by one. A scraper can be registered as a class or as a
+    ``'module:Class'`` string. Strings aren't imported until a url for
+    one of their hosts shows up.
+
+    Other packages can add scrapers with ``steve.scrapers`` entry
+    points. The entry point name is a comma-separated list of hosts,
+    so nothing has to be imported to build the index::
+
+        entry_points={
+            'steve.scrapers': [
+                'vimeo.com,player.vimeo.com = stevevimeo:VimeoScraper',
+            ]
+        }
+
+    Entry points are read the first time a url is looked up.
+
+    """
+    ENTRY_POINT_GROUP = 'steve.scrapers'
+
+    def __init__(self):
+        # Reentrant since loading a scraper module might register more.
+        self._lock = threading.RLock()
+        # host -> class or 'module:Class'
+        self._index = {}
+        # class or 'module:Class' -> instance
+        self._instances = {}
+        self._read_entry_points = False
+
+    def register(self, scraper, hosts=None):
+        """Registers a scraper for some hosts
+
+        :arg scraper: a :py:class:`Scraper` subclass or a
+            ``'module:Class'`` string
+        :arg hosts: hosts it handles; defaults to the class's
+            ``hosts``
+
+        """
+        if hosts is None:
+            hosts = scraper.hosts
+        with self._lock:
+            for host in hosts:
+                self._index[host.strip().lower()] = scraper
+
+    def _add_entry_points(self):
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+
+        for entry_point in pkg_resources.iter_entry_points(self.ENTRY_POINT_GROUP):
+            target = '{0}:{1}'.format(
+                entry_point.module_name, '.'.join(entry_point.attrs))
+            hosts = [host for host in entry_point.name.split(',') if host.strip()]
+            self.register(target, hosts=hosts)
+
+    def _load(self, scraper):
+        if isinstance(scraper, basestring):
+            module_name, _, class_name = scraper.partition(':')
+            try:
+                scraper = getattr(importlib.import_module(module_name), class_name)
+            except (ImportError, AttributeError) as exc:
+                err('Could not load scraper {0}: {1}'.format(scraper, exc))
+                return None
+        return scraper()
+
+    def get_scraper(self, url):
+        """Returns a scraper for a url or None if nothing handles it"""
+        parts = _url_host(url).split('.')
+        with self._lock:
+            # Only mark them read once they are, so other threads
+            # wait for them instead of looking in a half-built index.
+            if not self._read_entry_points:
+                self._add_entry_points()
+                self._read_entry_points = True
+
+            for i in range(len(parts) - 1):
+                scraper = self._index.get('.'.join(parts[i:]))
+                if scraper is not None:
+                    break
+            else:
+                return None
+
+            if scraper not in self._instances:
+                self._instances[scraper] = self._load(scraper)
+            return self._instances[scraper]
+
+
+registry = ScraperRegistry()
+registry.register(YoutubeScraper)
+
+
+def get_scraper(url):
+    """Returns the scraper for a url or None if nothing handles it
 
-        items = [self.transform_item(item) for item in items]
+    See :py:class:`ScraperRegistry`.
 
-        return items
+    """
+    return registry.get_scraper(url)
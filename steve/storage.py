@@ -0,0 +1,513 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import ConfigParser
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from steve.util import (
+    _dump_json,
+    _list_json_files_in,
+    _stat_key,
+    AtomicWriteBatch,
+    err,
+    SteveException,
+    write_file_atomically,
+)
+
+
+class StorageError(SteveException):
+    """Raised when the project storage or a record in it can't be
+    read
+    """
+    pass
+
+
+class Storage(object):
+    """Where a project's video data lives
+
+    Every record has a name, which is the filename it has (or would
+    have) as a json file, and data, which is the Python dict of
+    metadata.
+
+    """
+    #: name of the storage in ``steve.ini``
+    name = None
+
+    def __init__(self, path):
+        self.path = path
+
+    def names(self):
+        """Returns sorted list of record names"""
+        raise NotImplementedError
+
+    def load(self, names=None, cache=None):
+        """Yields ``(name, data)`` for records in name order
+
+        :arg names: if not None, only records with these names
+        :arg cache: a :py:class:`steve.util.JSONFileCache`; storages
+            that don't need it ignore it
+
+        """
+        raise NotImplementedError
+
+    def get(self, name):
+        """Returns the data for a record or None if there's no such
+        record
+
+        :raises StorageError: if the record is there but can't be
+            read or parsed
+
+        """
+        raise NotImplementedError
+
+    def save(self, items, **kw):
+        """Saves records, adding the ones that don't exist yet
+
+        Records whose data didn't change aren't written.
+
+        :arg items: list of ``(name, data)`` tuples
+        :arg kw: ``json.dump`` arguments; only the files storage uses
+            them
+
+        :returns: list of names that were written
+
+        """
+        raise NotImplementedError
+
+    def stamp(self, name):
+        """Returns something that changes when the record changes
+
+        It's a tuple whose first item is the time of the last change
+        or None if there's no such record.
+
+        """
+        raise NotImplementedError
+
+    def listing_stamp(self):
+        """Returns something that changes when records are added or
+        removed
+
+        It's a tuple whose first item is the time of the last change.
+
+        """
+        raise NotImplementedError
+
+
+class FileStorage(Storage):
+    """Keeps every record in its own json file in a directory
+
+    This is the default and the layout steve has always used. It's the
+    easiest to edit by hand and works well with version control.
+
+    """
+    name = 'files'
+
+    def __init__(self, path):
+        super(FileStorage, self).__init__(path)
+        self._lock = threading.Lock()
+        self._dir_stat = None
+        self._names_hash = None
+        self._listing_stamp = None
+
+    def names(self):
+        return _list_json_files_in(self.path)
+
+    def load(self, names=None, cache=None):
+        if names is not None:
+            names = set(names)
+
+        for fn in self.names():
+            if names is not None and fn not in names:
+                continue
+
+            full_path = os.path.join(self.path, fn)
+            try:
+                if cache is not None:
+                    data = cache.get(fn)
+                else:
+                    with open(full_path, 'r') as fp:
+                        data = json.load(fp)
+            except Exception:
+                err('Problem with {0}'.format(full_path), wrap=False)
+                raise
+
+            yield fn, data
+
+    def get(self, name):
+        full_path = os.path.join(self.path, name)
+        try:
+            with open(full_path, 'r') as fp:
+                return json.load(fp)
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                return None
+            raise StorageError('{0} can\'t be read: {1}'.format(full_path, exc))
+        except ValueError as exc:
+            raise StorageError('{0} is not valid JSON: {1}'.format(full_path, exc))
+
+    def save(self, items, **kw):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        batch = AtomicWriteBatch()
+        for fn, data in items:
+            assert os.sep not in fn
+            batch.add(os.path.join(self.path, fn), _dump_json(data, dict(kw)))
+        return [os.path.basename(path) for path in batch.commit()]
+
+    def stamp(self, name):
+        try:
+            return tuple(_stat_key(os.path.join(self.path, name)))
+        except OSError:
+            return None
+
+    def listing_stamp(self):
+        try:
+            dir_stat = tuple(_stat_key(self.path))
+        except OSError:
+            return None
+
+        with self._lock:
+            if dir_stat != self._dir_stat:
+                # Every save renames a temp file into the directory,
+                # which changes its mtime without adding or removing
+                # anything, so only a change in the names counts.
+                names = self.names()
+                names_hash = hashlib.md5('\n'.join(names)).hexdigest()
+                if names_hash != self._names_hash:
+                    self._listing_stamp = (dir_stat[0], len(names), names_hash)
+                    self._names_hash = names_hash
+                self._dir_stat = dir_stat
+            return self._listing_stamp
+
+
+class JSONLinesStorage(Storage):
+    """Keeps all records in one JSON Lines file
+
+    Each line is ``{"name": ..., "data": ...}`` and lines are sorted
+    by name. Loading everything is one read and parse instead of a
+    file open per record, but every save rewrites the whole file.
+
+    The file's lines are kept in memory and only read again when the
+    file's mtime or size changes. Records are parsed from their line
+    every time they're asked for, so changing one you got doesn't
+    change the storage.
+    """
+    name = 'jsonl'
+
+    def __init__(self, path):
+        super(JSONLinesStorage, self).__init__(path)
+        self._lock = threading.RLock()
+        self._file_stat = None
+        # name -> (stamp, line); lines are parsed on every read so
+        # callers can change what they get without changing ours
+        self._records = {}
+        self._names = []
+        self._listing_stamp = (None,)
+
+    def _make_line(self, name, data):
+        return '{{"name": {0}, "data": {1}}}'.format(
+            json.dumps(name), json.dumps(data, sort_keys=True))
+
+    def _refresh(self):
+        try:
+            file_stat = tuple(_stat_key(self.path))
+        except OSError:
+            file_stat = None
+        if file_stat is not None and file_stat == self._file_stat:
+            return
+
+        records = {}
+        if file_stat is not None:
+            with open(self.path, 'rb') as fp:
+                for lineno, line in enumerate(fp, 1):
+                    line = line.rstrip('\n')
+                    if not line:
+                        continue
+                    try:
+                        item = json.loads(line)
+                        name, _ = item['name'], item['data']
+                    except (ValueError, KeyError, TypeError) as exc:
+                        raise StorageError('{0} line {1} is bad: {2}'.format(
+                            self.path, lineno, exc))
+                    records[name] = self._make_record(
+                        name, line, file_stat[0])
+
+        self._set_records(records, file_stat)
+
+    def _make_record(self, name, line, mtime):
+        # Keep the old stamp for records whose line didn't change.
+        old = self._records.get(name)
+        if old is not None and old[1] == line:
+            return old
+        stamp = (mtime, hashlib.md5(line).hexdigest())
+        return (stamp, line)
+
+    def _get_data(self, record):
+        return json.loads(record[1])['data']
+
+    def _set_records(self, records, file_stat):
+        names = sorted(records)
+        if names != self._names:
+            self._listing_stamp = (file_stat[0] if file_stat else None,
+                                   len(names))
+        self._records = records
+        self._names = names
+        self._file_stat = file_stat
+
+    def names(self):
+        with self._lock:
+            self._refresh()
+            return list(self._names)
+
+    def load(self, names=None, cache=None):
+        with self._lock:
+            self._refresh()
+            records = self._records
+            wanted = self._names if names is None else sorted(
+                set(names) & set(records))
+        for name in wanted:
+            yield name, self._get_data(records[name])
+
+    def get(self, name):
+        with self._lock:
+            self._refresh()
+            record = self._records.get(name)
+            return self._get_data(record) if record is not None else None
+
+    def save(self, items, **kw):
+        with self._lock:
+            self._refresh()
+            now = time.time()
+            records = dict(self._records)
+            written = []
+            for name, data in items:
+                line = self._make_line(name, data)
+                if name in records and records[name][1] == line:
+                    continue
+                records[name] = ((now, hashlib.md5(line).hexdigest()), line)
+                written.append(name)
+
+            if written:
+                dir_path = os.path.dirname(self.path)
+                if dir_path and not os.path.exists(dir_path):
+                    os.makedirs(dir_path)
+                write_file_atomically(self.path, ''.join(
+                    records[name][1] + '\n' for name in sorted(records)))
+                self._set_records(records, tuple(_stat_key(self.path)))
+            return written
+
+    def stamp(self, name):
+        with self._lock:
+            self._refresh()
+            record = self._records.get(name)
+            return record[0] if record is not None else None
+
+    def listing_stamp(self):
+        with self._lock:
+            self._refresh()
+            return self._listing_stamp
+
+
+class SQLiteStorage(Storage):
+    """Keeps all records in a SQLite database
+
+    Records are stored as JSON text along with a modified time and a
+    revision number. Saving a record only writes that record, so this
+    is the one to use for big projects that are edited a lot.
+
+    """
+    name = 'sqlite'
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS videos ('
+        ' name TEXT PRIMARY KEY,'
+        ' data TEXT NOT NULL,'
+        ' mtime REAL NOT NULL,'
+        ' rev INTEGER NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS listing ('
+        ' id INTEGER PRIMARY KEY CHECK (id = 0),'
+        ' mtime REAL NOT NULL,'
+        ' rev INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO listing VALUES (0, 0, 0)',
+    ]
+
+    def __init__(self, path):
+        super(SQLiteStorage, self).__init__(path)
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+        # webedit uses the storage from several threads. The lock
+        # makes that safe.
+        self._lock = threading.RLock()
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                for statement in self.SCHEMA:
+                    self._db.execute(statement)
+        except sqlite3.Error as exc:
+            raise StorageError('{0} can\'t be opened: {1}'.format(path, exc))
+
+    def _dumps(self, data):
+        return json.dumps(data, sort_keys=True)
+
+    def names(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                'SELECT name FROM videos ORDER BY name')]
+
+    def load(self, names=None, cache=None):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT name, data FROM videos ORDER BY name').fetchall()
+        if names is not None:
+            names = set(names)
+        for name, data in rows:
+            if names is None or name in names:
+                yield name, json.loads(data)
+
+    def get(self, name):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data FROM videos WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError as exc:
+            raise StorageError('{0} in {1} is not valid JSON: {2}'.format(
+                name, self.path, exc))
+
+    def save(self, items, **kw):
+        now = time.time()
+        written = []
+        added = False
+        with self._lock, self._db:
+            for name, data in items:
+                text = self._dumps(data)
+                row = self._db.execute(
+                    'SELECT data FROM videos WHERE name = ?',
+                    (name,)).fetchone()
+                if row is None:
+                    self._db.execute(
+                        'INSERT INTO videos VALUES (?, ?, ?, 1)',
+                        (name, text, now))
+                    added = True
+                elif row[0] != text:
+                    self._db.execute(
+                        'UPDATE videos SET data = ?, mtime = ?, rev = rev + 1 '
+                        'WHERE name = ?', (text, now, name))
+                else:
+                    continue
+                written.append(name)
+
+            if added:
+                self._db.execute(
+                    'UPDATE listing SET mtime = ?, rev = rev + 1', (now,))
+        return written
+
+    def stamp(self, name):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT mtime, rev FROM videos WHERE name = ?',
+                (name,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def listing_stamp(self):
+        with self._lock:
+            return tuple(self._db.execute(
+                'SELECT mtime, rev FROM listing').fetchone())
+
+
+STORAGES = dict(
+    (storage.name, storage)
+    for storage in (FileStorage, JSONLinesStorage, SQLiteStorage))
+
+# name -> default path relative to the projectpath
+DEFAULT_PATHS = {
+    'files': 'json',
+    'jsonl': 'videos.jsonl',
+    'sqlite': 'videos.sqlite',
+}
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def open_storage(name, path):
+    """Returns the storage of the given kind at path
+
+    Storages are kept around, so opening the same one twice gives you
+    the same object.
+
+    :arg name: ``'files'``, ``'jsonl'`` or ``'sqlite'``
+    :arg path: directory for files, file for the others
+
+    :raises StorageError: if there's no such kind of storage
+
+    """
+    if name not in STORAGES:
+        raise StorageError(
+            u'"{0}" is not a kind of storage. Use one of: {1}'.format(
+                name, u', '.join(sorted(STORAGES))))
+
+    key = (name, os.path.abspath(path))
+    with _storages_lock:
+        if key not in _storages:
+            _storages[key] = STORAGES[name](path)
+        return _storages[key]
+
+
+def guess_storage_name(path):
+    """Guesses the kind of storage from a path
+
+    ``.jsonl`` files are JSON Lines, ``.sqlite`` and ``.db`` files
+    are SQLite and anything else is a directory of json files.
+
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.jsonl':
+        return 'jsonl'
+    if ext in ('.sqlite', '.db'):
+        return 'sqlite'
+    return 'files'
+
+
+def get_storage(config):
+    """Returns the storage for a project
+
+    It's set with ``storage`` in the ``[project]`` section of
+    ``steve.ini``: ``files`` (the default), ``jsonl`` or ``sqlite``.
+    For ``files`` the records are in ``jsonpath``. For the others
+    they're in ``storagepath``, which defaults to ``videos.jsonl`` or
+    ``videos.sqlite`` in the projectpath.
+
+    :arg config: the project config
+
+    :raises StorageError: if ``storage`` isn't a kind of storage
+
+    """
+    name = config.get('project', 'storage')
+    if name == 'files':
+        path = config.get('project', 'jsonpath')
+    else:
+        try:
+            path = config.get('project', 'storagepath')
+        except ConfigParser.NoOptionError:
+            path = None
+        if not path:
+            path = os.path.join(config.get('project', 'projectpath'),
+                                DEFAULT_PATHS.get(name, ''))
+    return open_storage(name, path)
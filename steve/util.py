@@ -8,26 +8,65 @@
 
 import ConfigParser
 import datetime
+import hashlib
 import json
+import marshal
+import multiprocessing
 import os
+import stat as stat_module
 import string
 import sys
 import textwrap
+import threading
 import unicodedata
+from collections import OrderedDict
 from functools import wraps
-from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
+from urlparse import parse_qs, urlparse
 
 import html2text
 
 
+YOUTUBE_HOSTS = ('youtube.com', 'youtu.be')
+
+
+def _url_host(url):
+    """Returns the lowercased host of a url without the port"""
+    return urlparse(url).netloc.lower().split(':')[0]
+
+
 def is_youtube(url):
+    """Returns whether a url is on YouTube
+
+    Subdomains count, so ``m.youtube.com`` is YouTube too.
+
+    """
+    host = _url_host(url)
+    return any(host == yt_host or host.endswith('.' + yt_host)
+               for yt_host in YOUTUBE_HOSTS)
+
+
+def get_youtube_id(url):
+    """Returns the video id from a YouTube video url or None
+
+    >>> get_youtube_id('https://www.youtube.com/watch?v=N29XAFjiKf4')
+    'N29XAFjiKf4'
+    >>> get_youtube_id('http://youtu.be/N29XAFjiKf4')
+    'N29XAFjiKf4'
+
+    """
+    if not url or not is_youtube(url):
+        return None
     parsed = urlparse(url)
-    return parsed.netloc.startswith(
-        ('www.youtube.com', 'youtube.com', 'youtu.be'))
+    if parsed.netloc.startswith('youtu.be'):
+        return parsed.path.strip('/') or None
+    return parse_qs(parsed.query).get('v', [None])[0]
 
 
 ALLOWED_LETTERS = string.ascii_letters + string.digits + '-_'
 
+CACHE_DIR_NAME = '.steve-cache'
+
 
 class SteveException(Exception):
     """Base steve exception"""
@@ -91,6 +130,10 @@ class IniConfig(Config):
             cp.get('project', 'jsonpath')
         except ConfigParser.NoOptionError:
             cp.set('project', 'jsonpath', os.path.join(cp.get('project', 'projectpath'), 'json'))
+        try:
+            cp.get('project', 'storage')
+        except ConfigParser.NoOptionError:
+            cp.set('project', 'storage', 'files')
         # If STEVE_CRED_FILE is specified in the environment or there's a
         # cred_file in the config file, then open the file and pull the
         # API information from there:
@@ -141,10 +184,25 @@ class IniConfig(Config):
     # The jsonpath, if set, is where steve will look for the JSON files
     # jsonpath = {jsonpath}
 
+    # How video data is stored. One of:
+    #
+    # * files: one JSON file per video in the jsonpath (default)
+    # * jsonl: all videos in one JSON Lines file
+    # * sqlite: all videos in a SQLite database
+    #
+    # For jsonl and sqlite, storagepath is where the file is. It defaults
+    # to videos.jsonl or videos.sqlite in the projectpath.
+    # storage = files
+    # storagepath =
+
     # The url for the richard instance api.
     # e.g. url = http://example.com/api/v1/
     api_url =
 
+    # Maximum number of requests per second to send to the api. push and
+    # pull also slow down on their own if the server starts failing.
+    # api_rate =
+
     # Your username and api key.
     #
     # Alternatively, you can pass this on the command line or put it in a
@@ -249,6 +307,28 @@ def get_from_config(cfg, key, section='project',
     return None
 
 
+def get_cache_path(config, name):
+    """Returns the path for a file in the project's cache directory
+
+    The cache directory is ``PROJECTPATH/.steve-cache``. It holds
+    things steve can rebuild at any time, so it's safe to delete and
+    you probably want to keep it out of version control.
+
+    The directory is created if it doesn't exist.
+
+    :arg config: the project config
+    :arg name: basename of the cache file
+
+    :returns: full path of the cache file
+
+    """
+    cachepath = os.path.join(config.get('project', 'projectpath'),
+                             CACHE_DIR_NAME)
+    if not os.path.exists(cachepath):
+        os.makedirs(cachepath)
+    return os.path.join(cachepath, name)
+
+
 def load_tags_file(config):
     """Opens the tags file and loads tags
 
@@ -300,12 +380,26 @@ def generate_filename(text):
     return filename
 
 
+VIDEO_REQS_PATH = os.path.join(os.path.dirname(__file__), 'video_reqs.json')
+
+_video_requirements = None
+
+
 def get_video_requirements():
-    fn = os.path.join(os.path.dirname(__file__), 'video_reqs.json')
-    fp = open(fn)
-    data = json.load(fp)
-    fp.close()
-    return data
+    """Returns the field specs from ``video_reqs.json``
+
+    The file is only read the first time. Don't change the returned
+    list---everyone shares it.
+
+    :returns: list of dicts, one per field
+
+    """
+    global _video_requirements
+    if _video_requirements is None:
+        fp = open(VIDEO_REQS_PATH)
+        _video_requirements = json.load(fp)
+        fp.close()
+    return _video_requirements
 
 
 def _required(data):
@@ -314,97 +408,173 @@ def _required(data):
     return True
 
 
-def verify_video_data(data, category=None):
-    """Verify the data in a single json file for a video.
+class VideoValidator(object):
+    """Checks video data against a list of field specs
 
-    :param data: The parsed contents of a JSON file. This should be a
-        Python dict.
-    :param category: The category as specified in the steve.ini file.
+    All the work of figuring out what to check for each field happens
+    once when the validator is built. Use
+    :py:func:`get_video_validator` to get the shared one for
+    ``video_reqs.json``.
 
-        If the steve.ini has a category, then every data file either
-        has to have the same category or no category at all.
-
-        This is None if no category is specified in which case every
-        data file has to have a category.
+    :arg requirements: list of field specs as returned by
+        :py:func:`get_video_requirements`
 
-    :returns: list of error strings.
+    :property requirements: the list of field specs
+    :property fields: dict of field name -> field spec
+    :property allowed_keys: set of keys video data can have
 
     """
-    # TODO: rewrite this to return a dict of fieldname -> list of
-    # errors
-    errors = []
-    requirements = get_video_requirements()
-
-    # First, verify the data is correct.
-    for req in requirements:
+    # Keys that aren't fields but are fine anyway. These will be there
+    # if the data was pulled via the richard API or if we did a push.
+    EXTRA_KEYS = frozenset(['id', 'updated'])
+
+    def __init__(self, requirements):
+        self.requirements = requirements
+        self.fields = dict((req['name'], req) for req in requirements)
+        self.allowed_keys = frozenset(self.fields) | self.EXTRA_KEYS
+        self._checks = [self._build_check(req) for req in requirements]
+
+    def _build_check(self, req):
+        """Returns a function that takes (data, category) and returns
+        an error string or None for this field
+        """
         key = req['name']
 
         if key == 'category':
             # Category is a special case since we can specify it
             # in the steve.ini file.
-
-            if not category and key not in data:
-                errors.append(
-                    '"category" must be in either steve.ini or data file')
-            elif (key in data and (
-                    category is not None and data[key] != category)):
-                errors.append(
-                    '"{0}" field does not match steve.ini category'.format(
-                        key))
-
-        elif key not in data:
-            # Required data must be there.
-
-            # TODO: We add title here because this is the client side
-            # of the API and that's a special case that's differen
-            # than the data model which is where the video_reqs.json
-            # are derived. That should get fixed in richard.
-            if _required(req) or key == 'title':
-                errors.append('"{0}" field is required'.format(key))
-
-        elif req['type'] == 'IntegerField':
-            if not isinstance(data[key], int):
-                if ((_required(req)
-                     or (not _required(req) and data[key] is not None))):
-
-                    errors.append('"{0}" field must be an int'.format(key))
-            elif req['choices'] and data[key] not in req['choices']:
-                errors.append(
-                    '"{0}" field must be one of {1}'.format(
-                        key, req['choices']))
+            def check_category(data, category):
+                if not category and key not in data:
+                    return '"category" must be in either steve.ini or data file'
+                if (key in data and (
+                        category is not None and data[key] != category)):
+                    return '"{0}" field does not match steve.ini category'.format(key)
+            return check_category
+
+        # TODO: We add title here because this is the client side
+        # of the API and that's a special case that's differen
+        # than the data model which is where the video_reqs.json
+        # are derived. That should get fixed in richard.
+        if _required(req) or key == 'title':
+            missing_error = '"{0}" field is required'.format(key)
+        else:
+            missing_error = None
+
+        check_value = self._build_value_check(req)
+
+        def check(data, category):
+            if key not in data:
+                # Required data must be there.
+                return missing_error
+            if check_value is not None:
+                return check_value(data[key])
+        return check
+
+    def _build_value_check(self, req):
+        """Returns a function that takes a value and returns an error
+        string or None or returns None if there's nothing to check
+        """
+        key = req['name']
+        required = _required(req)
+
+        if req['type'] == 'IntegerField':
+            choices = frozenset(req['choices'] or [])
+            int_error = '"{0}" field must be an int'.format(key)
+            choices_error = '"{0}" field must be one of {1}'.format(
+                key, req['choices'])
+
+            def check_integer(value):
+                if not isinstance(value, int):
+                    if required or value is not None:
+                        return int_error
+                elif choices and value not in choices:
+                    return choices_error
+            return check_integer
 
         elif req['type'] == 'TextField':
-            if not req['empty_strings'] and not data[key]:
-                errors.append(
-                    '"{0}" field can\'t be an empty string'.format(key))
-            elif not data[key]:
-                continue
+            if req['empty_strings']:
+                return None
+            empty_error = '"{0}" field can\'t be an empty string'.format(key)
+
+            def check_text(value):
+                if not value:
+                    return empty_error
+            return check_text
 
         elif req['type'] == 'TextArrayField':
-            for mem in data[key]:
-                if not mem:
-                    errors.append(
-                        '"{0}" field has empty strings in it'.format(key))
-                    break
+            empty_error = '"{0}" field has empty strings in it'.format(key)
+
+            def check_text_array(value):
+                for mem in value:
+                    if not mem:
+                        return empty_error
+            return check_text_array
 
         elif req['type'] == 'BooleanField':
-            if data[key] not in (True, False):
-                errors.append('"{0}" field has non-boolean value'.format(key))
+            bool_error = '"{0}" field has non-boolean value'.format(key)
 
-    required_keys = [req['name'] for req in requirements]
+            def check_boolean(value):
+                if value not in (True, False):
+                    return bool_error
+            return check_boolean
 
-    # Second check to make sure there aren't fields that shouldn't
-    # be there.
-    for key in data.keys():
-        # Ignore special cases. These will be there if the data
-        # was pulled via the richard API or if we did a push.
-        if key in ['id', 'updated']:
-            continue
+        return None
+
+    def verify(self, data, category=None):
+        """Verifies video data
 
-        if key not in required_keys:
-            errors.append('"{0}" field shouldn\'t be there.'.format(key))
+        See :py:func:`verify_video_data`.
+
+        """
+        errors = []
 
-    return errors
+        # First, verify the data is correct.
+        for check in self._checks:
+            error = check(data, category)
+            if error is not None:
+                errors.append(error)
+
+        # Second check to make sure there aren't fields that shouldn't
+        # be there.
+        for key in data.keys():
+            if key not in self.allowed_keys:
+                errors.append('"{0}" field shouldn\'t be there.'.format(key))
+
+        return errors
+
+
+_video_validator = None
+
+
+def get_video_validator():
+    """Returns the shared :py:class:`VideoValidator` for
+    ``video_reqs.json``
+    """
+    global _video_validator
+    if _video_validator is None:
+        _video_validator = VideoValidator(get_video_requirements())
+    return _video_validator
+
+
+def verify_video_data(data, category=None):
+    """Verify the data in a single json file for a video.
+
+    :param data: The parsed contents of a JSON file. This should be a
+        Python dict.
+    :param category: The category as specified in the steve.ini file.
+
+        If the steve.ini has a category, then every data file either
+        has to have the same category or no category at all.
+
+        This is None if no category is specified in which case every
+        data file has to have a category.
+
+    :returns: list of error strings.
+
+    """
+    # TODO: rewrite this to return a dict of fieldname -> list of
+    # errors
+    return get_video_validator().verify(data, category)
 
 
 def verify_json_files(json_files, category=None):
@@ -426,13 +596,110 @@ def verify_json_files(json_files, category=None):
     :returns: dict mapping filenames to list of error strings
     """
     filename_to_errors = {}
+    validator = get_video_validator()
 
     for filename, data in json_files:
-        filename_to_errors[filename] = verify_video_data(data, category)
+        filename_to_errors[filename] = validator.verify(data, category)
 
     return filename_to_errors
 
 
+def _verify_json_path(args):
+    """Loads and verifies one json file
+
+    This is a module-level function so that it can be handed to a
+    multiprocessing pool.
+
+    :returns: ``(stat, errors)`` where ``stat`` is the file's stat
+        taken before reading it or None if the file couldn't be read
+
+    """
+    full_path, category = args
+    try:
+        stat = _stat_key(full_path)
+        with open(full_path, 'r') as fp:
+            data = json.load(fp)
+    except EnvironmentError as exc:
+        return None, ['file could not be read: {0}'.format(exc)]
+    except ValueError as exc:
+        return stat, ['file is not valid JSON: {0}'.format(exc)]
+    return stat, get_video_validator().verify(data, category)
+
+
+def _iter_verify_json_paths(args, jobs):
+    """Runs :py:func:`_verify_json_path` over args in order"""
+    if jobs <= 1 or len(args) <= 1:
+        for arg in args:
+            yield _verify_json_path(arg)
+        return
+
+    # Hand out work in chunks so the processes aren't stuck talking to
+    # each other for every little file.
+    chunksize = max(1, min(100, len(args) // (jobs * 4)))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(_verify_json_path, args, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_verify_json_files(config, category=None, jobs=1, cache=None):
+    """Loads and verifies every json file in a project
+
+    With ``jobs`` greater than 1, the files are parsed and verified
+    in that many processes. Either way, results come back in filename
+    order as soon as they're ready.
+
+    Unlike :py:func:`load_json_files`, a file that isn't valid JSON
+    doesn't stop things---it comes back with an error.
+
+    :arg config: the configuration object
+    :arg category: see :py:func:`verify_video_data`
+    :arg jobs: number of processes to use
+    :arg cache: a :py:class:`JSONFileCache`; if given, only files that
+        changed since they were last verified are parsed and verified
+
+    :returns: generator of ``(filename, list of error strings)``
+        tuples
+
+    """
+    from steve.storage import get_storage
+    storage = get_storage(config)
+    if storage.name != 'files':
+        # Everything comes out of one file, so there's nothing to
+        # gain from more processes or the cache.
+        validator = get_video_validator()
+        for fn, data in storage.load():
+            yield fn, validator.verify(data, category)
+        return
+
+    jsonpath = storage.path
+    filenames = storage.names()
+
+    known = {}
+    if cache is not None:
+        for fn in filenames:
+            errors = cache.get_errors(fn, category)
+            if errors is not None:
+                known[fn] = errors
+
+    args = [(os.path.join(jsonpath, fn), category)
+            for fn in filenames if fn not in known]
+    results = _iter_verify_json_paths(args, jobs)
+
+    for fn in filenames:
+        if fn in known:
+            yield fn, known[fn]
+            continue
+
+        stat, errors = next(results)
+        if cache is not None and stat is not None:
+            cache.set_errors(fn, stat, category, errors)
+        yield fn, errors
+
+
 def wrap(text, indent=''):
     return (
         textwrap.TextWrapper(initial_indent=indent, subsequent_indent=indent)
@@ -477,43 +744,382 @@ def out(*output, **kw):
     sys.stdout.write(output + '\n')
 
 
-def load_json_files(config):
+def _stat_key(full_path):
+    st = os.stat(full_path)
+    return [st.st_mtime, st.st_size]
+
+
+def _get_video_requirements_hash():
+    with open(VIDEO_REQS_PATH, 'rb') as fp:
+        return hashlib.md5(fp.read()).hexdigest()
+
+
+class JSONFileCache(object):
+    """On-disk cache of parsed json files and their verify errors
+
+    This keeps the parsed data and the verify errors for every file in
+    the ``.steve-cache`` directory of the project. Cached things for a
+    file are only used if the file's mtime and size haven't changed
+    since, so only files that changed get parsed again.
+
+    The verify errors live in a small index that's read right away.
+    The parsed data is only read the first time someone asks for
+    data, so verifying doesn't pay for it.
+
+    Cached verify errors are thrown out when ``video_reqs.json``
+    changes and aren't used if they were figured out for a different
+    category.
+
+    .. Note::
+
+       The cache files use :py:mod:`marshal` because it's a lot faster
+       to read than JSON. They're tied to the Python version, so
+       steve just ignores cache files it can't read.
+
+    .. Note::
+
+       Don't change the data you get from the cache unless you're
+       going to save it to the file right after.
+
+    Example:
+
+    >>> cache = JSONFileCache(cfg)
+    >>> data = load_json_files(cfg, cache=cache)
+    >>> cache.save()
+
+    :arg config: the configuration object
+
+    """
+    VERSION = 1
+
+    def __init__(self, config):
+        self.jsonpath = config.get('project', 'jsonpath')
+        self.index_path = get_cache_path(config, 'files.idx')
+        self.data_path = get_cache_path(config, 'files.dat')
+        self.reqs_hash = _get_video_requirements_hash()
+
+        # filename -> {'stat': ..., 'errors': ..., 'category': ...}
+        self._index = self._read(self.index_path, video_reqs=self.reqs_hash)
+        self._index_dirty = False
+
+        # filename -> [stat, data]; loaded the first time it's needed
+        self._data = None
+        self._data_dirty = False
+
+    def _read(self, path, **expected):
+        try:
+            with open(path, 'rb') as fp:
+                cache = marshal.load(fp)
+        except (IOError, EOFError, ValueError, TypeError):
+            return {}
+
+        if cache.get('version') != self.VERSION:
+            return {}
+        for key, val in expected.items():
+            if cache.get(key) != val:
+                return {}
+        return cache['files']
+
+    def _write(self, path, files, **extra):
+        cache = dict(extra, version=self.VERSION, files=files)
+        # webedit and the commands can save the cache at the same
+        # time, so each needs its own temp file.
+        write_file_atomically(path, marshal.dumps(cache, 2), fsync=False)
+
+    def _stat(self, fn):
+        return _stat_key(os.path.join(self.jsonpath, fn))
+
+    def get(self, fn):
+        """Returns the parsed data for a file
+
+        If the cached copy is out of date, the file is parsed and the
+        cache is updated.
+
+        :raises ValueError: if the file isn't valid JSON
+
+        """
+        if self._data is None:
+            self._data = self._read(self.data_path)
+
+        stat = self._stat(fn)
+        cached = self._data.get(fn)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+
+        with open(os.path.join(self.jsonpath, fn), 'r') as fp:
+            data = json.load(fp)
+        self._data[fn] = [stat, data]
+        self._data_dirty = True
+        return data
+
+    def get_errors(self, fn, category=None):
+        """Returns cached verify errors for a file or None"""
+        entry = self._index.get(fn)
+        if (entry is None
+                or entry['category'] != category
+                or entry['stat'] != self._stat(fn)):
+            return None
+        return entry['errors']
+
+    def set_errors(self, fn, stat, category, errors):
+        """Caches verify errors for a file
+
+        :arg fn: filename
+        :arg stat: the file's ``[mtime, size]`` from before it was
+            read
+        :arg category: the category the errors were figured out for
+        :arg errors: list of error strings
+
+        """
+        self._index[fn] = {
+            'stat': stat,
+            'errors': errors,
+            'category': category
+        }
+        self._index_dirty = True
+
+    def save(self):
+        """Writes the cache to disk if anything changed
+
+        Entries for files that don't exist anymore are dropped.
+
+        """
+        existing = set(_list_json_files_in(self.jsonpath))
+        for fn in list(self._index):
+            if fn not in existing:
+                del self._index[fn]
+                self._index_dirty = True
+        for fn in list(self._data or {}):
+            if fn not in existing:
+                del self._data[fn]
+                self._data_dirty = True
+
+        if self._index_dirty:
+            self._write(self.index_path, self._index, video_reqs=self.reqs_hash)
+            self._index_dirty = False
+        if self._data_dirty:
+            self._write(self.data_path, self._data)
+            self._data_dirty = False
+
+
+def _list_json_files_in(jsonpath):
+    if not os.path.exists(jsonpath):
+        return []
+
+    return sorted(f for f in os.listdir(jsonpath) if f.endswith('.json'))
+
+
+def list_json_files(config):
+    """Returns the filenames of all video files for a project
+
+    :arg config: the configuration object
+
+    :returns: sorted list of filenames relative to the jsonpath
+
+    """
+    from steve.storage import get_storage
+    return get_storage(config).names()
+
+
+def iter_json_files(config, filenames=None, cache=None):
+    """Parses and yields video files for a project one at a time
+
+    Files are only read when you ask for the next one, so you can stop
+    early without paying for the rest.
+
+    :arg config: the configuration object
+    :arg filenames: if not None, only files with these names are
+        parsed; the rest are skipped without being opened
+    :arg cache: a :py:class:`JSONFileCache`; if given, files that
+        haven't changed since they were cached aren't parsed again
+
+    :returns: generator of (filename, data) tuples in filename order
+        where filename is the string for the json file and data is a
+        Python dict of metadata.
+
+    Example:
+
+    >>> for fn, data in iter_json_files(cfg, filenames=['0001_foo.json']):
+    ...     print data['title']
+
+    """
+    from steve.storage import get_storage
+    return get_storage(config).load(filenames, cache=cache)
+
+
+def load_json_files(config, filenames=None, cache=None):
     """Parses and returns all video files for a project
 
     :arg config: the configuration object
+    :arg filenames: see :py:func:`iter_json_files`
+    :arg cache: see :py:func:`iter_json_files`
     :returns: list of (filename, data) tuples where filename is the
         string for the json file and data is a Python dict of
         metadata.
 
     """
-    jsonpath = config.get('project', 'jsonpath')
+    return list(iter_json_files(config, filenames=filenames, cache=cache))
 
-    if not os.path.exists(jsonpath):
-        return []
 
-    files = [f for f in os.listdir(jsonpath) if f.endswith('.json')]
+def _has_content(path, content):
+    """Returns whether the file at path holds exactly content"""
+    try:
+        if os.path.getsize(path) != len(content):
+            return False
+        with open(path, 'rb') as fp:
+            return fp.read() == content
+    except (IOError, OSError):
+        return False
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Some platforms can't open directories. Nothing to do there.
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_tmp(path, content, fsync):
+    """Writes content to a temp file next to path and returns its path"""
+    dir_path, name = os.path.split(path)
+    tmp_path = os.path.join(dir_path, '.{0}.{1}.{2}.tmp'.format(
+        name, os.getpid(), threading.current_thread().ident))
+
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+            if fsync:
+                fp.flush()
+                os.fsync(fp.fileno())
+        # Keep the permissions of the file we're replacing.
+        if os.path.exists(path):
+            os.chmod(tmp_path, stat_module.S_IMODE(os.stat(path).st_mode))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+class AtomicWriteBatch(object):
+    """Writes a bunch of files so each one is either all old or all new
+
+    Contents are added to the batch in memory. :py:meth:`commit` then
+    writes each one to a temp file next to its target and renames it
+    over the target. A crash or ctrl-c partway through never leaves a
+    truncated file behind.
+
+    Files whose contents are exactly what's on disk already are left
+    alone, so their mtimes don't change and version control doesn't
+    see them.
+
+    With ``fsync=True``, the temp files are flushed to disk before
+    they're renamed and then each directory is flushed once for the
+    whole batch rather than once per file.
+
+    :arg fsync: whether to make sure the files are on disk before
+        :py:meth:`commit` returns
+
+    """
+    def __init__(self, fsync=True):
+        self.fsync = fsync
+        # path -> content
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, path, content):
+        """Adds a file to the batch
+
+        :arg path: path of the file
+        :arg content: bytes to write; unicode is encoded as utf-8
+
+        """
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        self._pending[path] = content
+
+    def commit(self):
+        """Writes the files in the batch and empties it
 
-    data = []
+        :returns: list of paths that were written; paths whose
+            contents didn't change aren't in it
 
-    for fn in sorted(files):
+        """
+        pending, self._pending = self._pending, OrderedDict()
+        todo = [(path, content) for path, content in pending.items()
+                if not _has_content(path, content)]
+
+        tmp_paths = []
         try:
-            full_path = full_path = os.path.join(jsonpath, fn)
-            fp = open(full_path, 'r')
-            data.append((fn, json.load(fp)))
-            fp.close()
-        except Exception as e:
-            err('Problem with {0}'.format(full_path), wrap=False)
-            raise e
+            for path, content in todo:
+                tmp_paths.append(_write_tmp(path, content, self.fsync))
+            for tmp_path, (path, content) in zip(tmp_paths, todo):
+                os.rename(tmp_path, path)
+        finally:
+            # Clean up whatever didn't get renamed if something
+            # went wrong.
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        if self.fsync:
+            for dir_path in set(os.path.dirname(path) for path, _ in todo):
+                _fsync_dir(dir_path or os.curdir)
 
-    return data
+        return [path for path, content in todo]
+
+
+def write_file_atomically(path, content, fsync=True):
+    """Writes a single file atomically
+
+    See :py:class:`AtomicWriteBatch` for details.
+
+    :arg path: path of the file
+    :arg content: bytes to write; unicode is encoded as utf-8
+    :arg fsync: whether to make sure the file is on disk before
+        returning
+
+    :returns: True if the file was written, False if it already had
+        that content
+
+    """
+    batch = AtomicWriteBatch(fsync=fsync)
+    batch.add(path, content)
+    return bool(batch.commit())
+
+
+def _dump_json(contents, kw):
+    if 'indent' not in kw:
+        kw['indent'] = 2
+
+    if 'sort_keys' not in kw:
+        kw['sort_keys'] = True
+
+    return json.dumps(contents, **kw)
 
 
 def save_json_files(config, data, **kw):
     """Saves a bunch of files to json format
 
+    The files are written as one :py:class:`AtomicWriteBatch`, so
+    each file is either completely written or untouched and files
+    that didn't change aren't written at all.
+
     :arg config: the configuration object
     :arg data: list of (filename, data) tuples where filename is the
         string for the json file and data is a Python dict of metadata
+    :arg kw: any keyword arguments accepted by `json.dump`
+
+    :returns: list of filenames that were written
 
     .. Note::
 
@@ -521,55 +1127,167 @@ def save_json_files(config, data, **kw):
        of that function is the `data` argument for this one.
 
     """
-    if 'indent' not in kw:
-        kw['indent'] = 2
-
-    if 'sort_keys' not in kw:
-        kw['sort_keys'] = True
-
-    jsonpath = config.get('project', 'jsonpath')
-    if not os.path.exists(jsonpath):
-        os.makedirs(jsonpath)
-
-    for fn, contents in data:
-        assert os.sep not in fn
-        full_path = os.path.join(jsonpath, fn)
-        fp = open(full_path, 'w')
-        json.dump(contents, fp, **kw)
-        fp.close()
+    from steve.storage import get_storage
+    return get_storage(config).save(data, **kw)
 
 
 def save_json_file(config, filename, contents, **kw):
     """Saves a single json file
 
+    The file is written atomically and not written at all if it
+    didn't change. See :py:class:`AtomicWriteBatch`.
+
     :arg config: configuration object
     :arg filename: filename
     :arg contents: python dict to save
     :arg kw: any keyword arguments accepted by `json.dump`
 
+    :returns: True if the file was written, False if it already had
+        that content
+
     """
-    if 'indent' not in kw:
-        kw['indent'] = 2
+    from steve.storage import get_storage
+    return bool(get_storage(config).save([(filename, contents)], **kw))
 
-    if 'sort_keys' not in kw:
-        kw['sort_keys'] = True
 
-    jsonpath = config.get('project', 'jsonpath')
-    if not os.path.exists(jsonpath):
-        os.makedirs(jsonpath)
+# Keys the server sets. Changes to them aren't worth pushing.
+SYNC_IGNORED_KEYS = ('id', 'updated')
 
-    assert os.sep not in filename
-    full_path = os.path.join(jsonpath, filename)
 
-    fp = open(full_path, 'w')
-    json.dump(contents, fp, **kw)
-    fp.close()
+def get_content_hash(data):
+    """Returns a hash of a video's data
+
+    Key order doesn't matter and keys in ``SYNC_IGNORED_KEYS`` are
+    left out, so the hash only changes when something worth pushing
+    does.
+
+    :arg data: python dict of video data
 
+    :returns: hex string
+
+    """
+    content = dict((key, value) for key, value in data.items()
+                   if key not in SYNC_IGNORED_KEYS)
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True, separators=(',', ':'))).hexdigest()
 
-def scrape_videos(url):
+
+def load_sync_manifest(config, api_url):
+    """Returns what's on a richard instance as far as steve knows
+
+    push and pull remember the id and :py:func:`get_content_hash` of
+    every file they send or get in ``.steve-cache/sync.json``, per
+    api url.
+
+    :arg config: configuration object
+    :arg api_url: url of the richard api
+
+    :returns: dict of filename -> ``{'id': ..., 'hash': ...}``
+
+    """
+    try:
+        with open(get_cache_path(config, 'sync.json'), 'r') as fp:
+            manifests = json.load(fp)
+    except (IOError, ValueError):
+        return {}
+    return manifests.get(api_url, {}).get('files', {})
+
+
+def save_sync_manifest(config, api_url, manifest):
+    """Saves a manifest from :py:func:`load_sync_manifest`
+
+    :arg config: configuration object
+    :arg api_url: url of the richard api
+    :arg manifest: dict of filename -> ``{'id': ..., 'hash': ...}``
+
+    """
+    path = get_cache_path(config, 'sync.json')
+    try:
+        with open(path, 'r') as fp:
+            manifests = json.load(fp)
+    except (IOError, ValueError):
+        manifests = {}
+    manifests[api_url] = {
+        'files': manifest,
+        'synced': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    write_file_atomically(path, json.dumps(manifests, indent=2, sort_keys=True),
+                          fsync=False)
+
+
+def update_sync_manifest(manifest, filename, data):
+    """Records that a file matches what's on the server
+
+    :arg manifest: dict from :py:func:`load_sync_manifest`
+    :arg filename: filename
+    :arg data: python dict with the video's data, including its id
+
+    """
+    manifest[filename] = {'id': data['id'], 'hash': get_content_hash(data)}
+
+
+def diff_sync_manifest(manifest, data):
+    """Sorts videos by whether they need pushing
+
+    Videos without an id are new. Videos whose id or hash doesn't
+    match the manifest are modified. That includes videos the
+    manifest doesn't know about, so deleting the manifest means
+    everything gets pushed again, but nothing is missed.
+
+    :arg manifest: dict from :py:func:`load_sync_manifest`
+    :arg data: list of ``(filename, dict)`` tuples
+
+    :returns: ``(new, modified, unchanged)`` lists of
+        ``(filename, dict)`` tuples
+
+    """
+    new = []
+    modified = []
+    unchanged = []
+    for fn, contents in data:
+        if 'id' not in contents:
+            new.append((fn, contents))
+            continue
+
+        if changed_since_pull(manifest, fn, contents):
+            modified.append((fn, contents))
+        else:
+            unchanged.append((fn, contents))
+    return new, modified, unchanged
+
+
+def changed_since_pull(manifest, filename, data):
+    """Returns whether a video changed since it was last pulled or
+    pushed
+
+    It's compared to the id and content hash in the sync manifest, so
+    it doesn't matter what happened to the file's mtime. Videos the
+    manifest doesn't know about count as changed.
+
+    :arg manifest: dict from :py:func:`load_sync_manifest`
+    :arg filename: filename
+    :arg data: python dict loaded from that file
+
+    :returns: bool
+
+    """
+    entry = manifest.get(filename)
+    return (entry is None
+            or entry['id'] != data.get('id')
+            or entry['hash'] != get_content_hash(data))
+
+
+def _get_scraper(url):
+    from steve.scrapers import get_scraper
+    return get_scraper(url)
+
+
+def scrape_videos(url, skip_ids=None):
     """Scrapes a url for video data. Returns list of dicts.
 
     :arg url: The url to fetch data from
+    :arg skip_ids: YouTube video ids to skip without fetching their
+        data
 
     :returns: list of dicts
 
@@ -577,10 +1295,83 @@ def scrape_videos(url):
     [...]
 
     """
-    # FIXME: generate list of available scrapers.
-    # FIXME: run url through all available scrapers.
-    from steve.scrapers import YoutubeScraper
-    return YoutubeScraper().scrape(url)
+    scraper = _get_scraper(url)
+    if scraper is None:
+        return None
+    return scraper.scrape(url, skip_ids=skip_ids)
+
+
+def iter_scrape_videos(url, skip_ids=None):
+    """Scrapes a url for video data, yielding videos as they're found
+
+    See :py:func:`scrape_videos`.
+
+    :returns: generator of dicts or None if the url isn't handled
+
+    """
+    scraper = _get_scraper(url)
+    if scraper is None:
+        return None
+    return scraper.iter_scrape(url, skip_ids=skip_ids)
+
+
+def iter_scrape_videos_parallel(url, skip_ids=None, jobs=4, retries=2):
+    """Scrapes a url for video data with a youtube-dl per video
+
+    See :py:meth:`steve.scrapers.YoutubeScraper.iter_scrape_parallel`.
+    Scrapers that can't work on several videos at once scrape them
+    one at a time.
+
+    :returns: generator of ``(video_id, dict, exc)`` tuples or None if
+        the url isn't handled
+
+    """
+    scraper = _get_scraper(url)
+    if scraper is None:
+        return None
+    return scraper.iter_scrape_parallel(
+        url, skip_ids=skip_ids, jobs=jobs, retries=retries)
+
+
+def load_fetch_checkpoint(config, url):
+    """Returns the YouTube video ids fetch has seen for a url
+
+    :arg config: configuration object
+    :arg url: the url that was fetched
+
+    :returns: set of video ids
+
+    """
+    try:
+        with open(get_cache_path(config, 'fetch.json'), 'r') as fp:
+            checkpoints = json.load(fp)
+    except (IOError, ValueError):
+        return set()
+    return set(checkpoints.get(url, {}).get('ids', []))
+
+
+def save_fetch_checkpoint(config, url, ids):
+    """Remembers the YouTube video ids fetch has seen for a url
+
+    The next ``fetch --incremental`` of that url skips them.
+
+    :arg config: configuration object
+    :arg url: the url that was fetched
+    :arg ids: every video id seen so far
+
+    """
+    path = get_cache_path(config, 'fetch.json')
+    try:
+        with open(path, 'r') as fp:
+            checkpoints = json.load(fp)
+    except (IOError, ValueError):
+        checkpoints = {}
+    checkpoints[url] = {
+        'ids': sorted(ids),
+        'fetched': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    write_file_atomically(path, json.dumps(checkpoints, indent=2, sort_keys=True),
+                          fsync=False)
 
 
 def scrape_video(url):
@@ -596,11 +1387,51 @@ def scrape_video(url):
     {'url': 'http://www.youtube.com/watch?v=ywToByBkOTc', ...}
 
     """
-    # FIXME: generate list of available scrapers.
-    # FIXME: run url through all available scrapers.
-    from steve.scrapers import YoutubeScraper
-    data = YoutubeScraper().scrape(url)
-    return data
+    scraper = _get_scraper(url)
+    if scraper is None:
+        return None
+    return scraper.scrape(url)
+
+
+def pool_map(fun, items, jobs=1):
+    """Calls ``fun`` on each item using up to ``jobs`` worker threads
+
+    Results come back in the same order as ``items`` regardless of
+    which worker finishes first. Exceptions raised by ``fun`` are
+    caught and handed back so that one bad item doesn't stop the
+    rest.
+
+    :arg fun: function that takes a single item
+    :arg items: iterable of items
+    :arg jobs: maximum number of items to work on at the same time
+
+    :returns: generator of ``(item, result, exc)`` tuples where ``exc``
+        is None if ``fun`` didn't raise an exception
+
+    Example:
+
+    >>> list(pool_map(lambda x: 10 / x, [5, 0], jobs=2))
+    [(5, 2, None), (0, None, ZeroDivisionError(...))]
+
+    """
+    def _call(item):
+        try:
+            return item, fun(item), None
+        except Exception as exc:
+            return item, None, exc
+
+    if jobs <= 1:
+        for item in items:
+            yield _call(item)
+        return
+
+    pool = ThreadPool(jobs)
+    try:
+        for result in pool.imap(_call, items):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def html_to_markdown(text):
@@ -15,12 +15,23 @@
 
 
 import cgi
+import gzip
+import hashlib
+import sys
+import threading
+import time
+import urllib
 import urlparse
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
 
 from jinja2 import Environment, PackageLoader
-from steve.util import (out, get_project_config, load_json_files,
-                        save_json_file, get_video_requirements)
+from steve.storage import get_storage, StorageError
+from steve.util import (out, get_project_config, JSONFileCache,
+                        get_video_validator)
 
 
 # http://blog.doughellmann.com/2007/12/pymotw-basehttpserver.html
@@ -30,19 +41,321 @@ from steve.util import (out, get_project_config, load_json_files,
 env = Environment(loader=PackageLoader('steve', 'templates'), autoescape=True)
 HOST = 'localhost'
 PORT = 8000
+# Number of requests handled at the same time.
+WORKERS = 8
+# Number of files listed per page on the home page by default and at
+# most.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Number of rendered pages to keep around.
+PAGE_CACHE_SIZE = 500
+# Don't bother compressing anything smaller than this.
+MIN_GZIP_SIZE = 500
+
+
+def _as_text(value):
+    if isinstance(value, (list, tuple)):
+        return u' '.join(_as_text(mem) for mem in value)
+    if value is None:
+        return u''
+    return unicode(value)
+
+
+def make_summary(fn, data):
+    """Returns the little bit of a file the home page needs
+
+    :arg fn: the filename
+    :arg data: the file's data
+
+    :returns: dict with ``fn``, ``title``, ``whiteboard``,
+        ``category``, ``state`` and ``search`` (lowercased text
+        ``q`` is matched against)
+
+    """
+    summary = {
+        'fn': fn,
+        'title': _as_text(data.get('title')),
+        'whiteboard': _as_text(data.get('whiteboard')),
+        'category': _as_text(data.get('category')),
+        'state': data.get('state'),
+    }
+    summary['search'] = u' '.join([
+        fn, summary['title'], summary['whiteboard'],
+        _as_text(data.get('speakers'))
+    ]).lower()
+    return summary
+
+
+class ProjectStore(object):
+    """Keeps a project's json files in memory
+
+    Files are read from the project's storage once and then only read
+    again if their stamp changes. The list of files is only read again
+    if the storage's listing stamp changes. For json files, that's the
+    file's mtime and size and the set of filenames in the directory,
+    so saving one file doesn't make the others look changed.
+
+    Alongside the data it keeps a summary of each file (see
+    :py:func:`make_summary`) so the home page can filter and page
+    through the files without touching the full records.
+
+    :arg config: the project config
+
+    """
+    def __init__(self, config):
+        self.config = config
+        self.storage = get_storage(config)
+
+        # Guards everything below; handlers run in their own threads.
+        self._lock = threading.RLock()
+        # filename -> lock held while a file is being changed
+        self._file_locks = {}
+
+        # filename -> (stamp, data)
+        self._records = {}
+        # filename -> summary
+        self._summaries = {}
+        # sorted filenames and filename -> position in that list
+        self._filenames = []
+        self._positions = {}
+        self._listing_stamp = None
+        # Goes up every time anything changes. The token tells this
+        # store's generations apart from another store's.
+        self._generation = 0
+        self._token = '{0:x}'.format(int(time.time() * 1000))
+
+        # Use the on-disk cache for the first load since that's the
+        # one that has to read everything.
+        cache = JSONFileCache(config)
+        self._refresh_listing()
+        stamps = dict((fn, self.storage.stamp(fn)) for fn in self._filenames)
+        for fn, data in self.storage.load(self._filenames, cache=cache):
+            self._set_record(fn, stamps[fn], data)
+        cache.save()
+
+    def _set_record(self, fn, stamp, data):
+        self._records[fn] = (stamp, data)
+        self._summaries[fn] = make_summary(fn, data)
+        self._generation += 1
+
+    def _refresh_listing(self):
+        listing_stamp = self.storage.listing_stamp()
+        if listing_stamp is not None and listing_stamp == self._listing_stamp:
+            return
+
+        self._filenames = self.storage.names()
+        self._generation += 1
+        self._positions = dict((fn, i) for i, fn in enumerate(self._filenames))
+        for fn in list(self._records):
+            if fn not in self._positions:
+                del self._records[fn]
+                del self._summaries[fn]
+        self._listing_stamp = listing_stamp
+
+    def _refresh_file(self, fn):
+        stamp = self.storage.stamp(fn)
+        record = self._records.get(fn)
+        if stamp is not None and (record is None or record[0] != stamp):
+            data = self.storage.get(fn)
+            if data is not None:
+                self._set_record(fn, stamp, data)
+
+    def refresh(self):
+        """Picks up every change on disk"""
+        with self._lock:
+            self._refresh_listing()
+            for fn in self._filenames:
+                self._refresh_file(fn)
+
+    def get(self, fn):
+        """Returns the data for a file or None if there's no such file
+
+        Only that one file is checked for changes.
+
+        """
+        with self._lock:
+            self._refresh_listing()
+            if fn not in self._positions:
+                return None
+            self._refresh_file(fn)
+            return self._records[fn][1]
+
+    def items(self):
+        """Returns list of (filename, data) for all files in order"""
+        with self._lock:
+            self.refresh()
+            return [(fn, self._records[fn][1]) for fn in self._filenames]
+
+    def summaries(self, refresh=True):
+        """Returns list of summaries for all files in order
+
+        :arg refresh: whether to pick up changes on disk first
+
+        """
+        with self._lock:
+            if refresh:
+                self.refresh()
+            return [self._summaries[fn] for fn in self._filenames]
+
+    def query(self, page=1, size=PAGE_SIZE, whiteboard=None, category=None,
+              state=None, q=None, refresh=True):
+        """Returns one page of summaries matching the filters
+
+        :arg page: page number starting at 1
+        :arg size: number of summaries per page
+        :arg whiteboard: ``'set'`` for files with a whiteboard,
+            ``'empty'`` for files without one, None for all files
+        :arg category: only files in this category
+        :arg state: only files with this state
+        :arg q: only files whose filename, title, whiteboard or
+            speakers contain this text (case-insensitive)
+        :arg refresh: whether to pick up changes on disk first; the
+            home page passes False since it just did that to get the
+            :py:meth:`generation`
+
+        :returns: (list of summaries on this page, total number of
+            matching files)
+
+        """
+        checks = []
+        if whiteboard == 'set':
+            checks.append(lambda s: s['whiteboard'].strip())
+        elif whiteboard == 'empty':
+            checks.append(lambda s: not s['whiteboard'].strip())
+        if category:
+            checks.append(lambda s: s['category'] == category)
+        if state is not None:
+            checks.append(lambda s: s['state'] == state)
+        if q:
+            q = q.lower()
+            checks.append(lambda s: q in s['search'])
+
+        matches = [summary for summary in self.summaries(refresh)
+                   if all(check(summary) for check in checks)]
+        start = (page - 1) * size
+        return matches[start:start + size], len(matches)
+
+    def generation(self):
+        """Returns a value that changes whenever any file changes"""
+        with self._lock:
+            self.refresh()
+            return (self._token, self._generation)
+
+    def version(self, fn):
+        """Returns a value that changes whenever a file's page would
+
+        That's the file's stamp and its neighbors, which only change
+        when files are added or removed next to it. Changes to other
+        files leave it alone.
+
+        Call :py:meth:`get` first so the file is up to date.
+
+        :returns: (file stamp, (previous filename, next filename));
+            the first item of the file stamp is the time it last
+            changed
+
+        """
+        with self._lock:
+            return (self._records[fn][0], self.neighbors(fn))
+
+    def neighbors(self, fn):
+        """Returns (previous filename, next filename)
+
+        Either is ``''`` if there isn't one.
+
+        """
+        with self._lock:
+            i = self._positions[fn]
+            prev_fn = self._filenames[i - 1] if i > 0 else ''
+            next_fn = (self._filenames[i + 1] if i < len(self._filenames) - 1
+                       else '')
+            return prev_fn, next_fn
+
+    def file_lock(self, fn):
+        """Returns the lock to hold while changing a file
+
+        Hold it from reading the data through saving it so two people
+        saving the same file at the same time don't stomp on each
+        other halfway through.
+
+        """
+        with self._lock:
+            return self._file_locks.setdefault(fn, threading.Lock())
+
+    def save(self, fn, data):
+        """Saves data to a file and updates the store"""
+        self.storage.save([(fn, data)])
+        with self._lock:
+            self._set_record(fn, self.storage.stamp(fn), data)
+
+
+class PageCache(object):
+    """Keeps the most recently used rendered pages
+
+    Pages are keyed by path and stored along with their ETag. A page
+    is only handed back if the ETag still matches, so changing the
+    data a page was rendered from makes it miss.
+
+    :arg size: maximum number of pages to keep
+
+    """
+    def __init__(self, size=PAGE_CACHE_SIZE):
+        self.size = size
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        """Returns the page dict or None if it's not cached
+
+        The page dict has ``etag``, ``body`` and ``gzip`` (the
+        compressed body or None if nobody's asked for it yet).
+
+        """
+        with self._lock:
+            page = self._pages.pop(key, None)
+            if page is None or page['etag'] != etag:
+                return None
+            self._pages[key] = page
+            return page
+
+    def set(self, key, etag, body):
+        """Stores a page and returns its page dict"""
+        page = {'etag': etag, 'body': body, 'gzip': None}
+        with self._lock:
+            self._pages.pop(key, None)
+            self._pages[key] = page
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+        return page
 
 
-def get_data(cfg, fn):
-    data_files = load_json_files(cfg)
-    data_files = [d for d in data_files if d[0] == fn]
-    return data_files[0] if data_files else None
+def make_etag(*parts):
+    """Returns a quoted ETag built from parts"""
+    return '"{0}"'.format(hashlib.md5(repr(parts)).hexdigest())
+
+
+def gzip_bytes(body):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as fp:
+        fp.write(body)
+    return buf.getvalue()
 
 
 class WebEditRequestHandler(BaseHTTPRequestHandler):
+    # Give up on connections that stall so they don't hold on to a
+    # worker forever.
+    timeout = 60
+
     def parse_path(self):
         path = urlparse.urlparse(self.path).path.split('/')
         return [p for p in path if p]
 
+    def parse_query(self):
+        """Returns dict of query string argument -> last value"""
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        return dict((key, vals[-1].decode('utf-8'))
+                    for key, vals in query.items())
+
     def parse_form(self):
         form = cgi.FieldStorage(
             fp=self.rfile,
@@ -52,70 +365,198 @@ class WebEditRequestHandler(BaseHTTPRequestHandler):
                      })
         return form
 
-    def render_error(self, error_code):
-        self.send_error(error_code)
+    def render_error(self, error_code, message=None):
+        if message is not None:
+            # send_error puts it in the status line too, so it has to
+            # be one line.
+            message = ' '.join(message.split())
+        self.send_error(error_code, message)
 
     def redirect(self, location):
         self.send_response(303)
         self.send_header('Location', location)
         self.end_headers()
 
-    def render_response(self, code, template, variables=None, headers=None):
-        self.send_response(code)
-        if headers:
+    def is_not_modified(self, etag, last_modified=None):
+        """Returns whether the client's copy is still good"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and last_modified is not None:
+            since = parsedate_tz(if_modified_since)
+            if since is not None:
+                return int(last_modified) <= mktime_tz(since)
+        return False
+
+    def accepts_gzip(self):
+        encodings = self.headers.get('Accept-Encoding', '')
+        return 'gzip' in [enc.split(';')[0].strip()
+                          for enc in encodings.split(',')]
+
+    def render_cached(self, etag, template, get_variables,
+                      last_modified=None):
+        """Renders a page the client and server can cache
+
+        Answers with a 304 if the client already has this version of
+        the page. Otherwise the page comes from the server's page
+        cache, only rendering it if it's not there. The page is
+        compressed if the client accepts gzip.
+
+        :arg etag: ETag for this version of the page; it must change
+            whenever anything the page shows changes
+        :arg template: template name
+        :arg get_variables: function returning the template
+            variables; only called if the page has to be rendered
+        :arg last_modified: timestamp of the last change or None
+
+        """
+        headers = [
+            ('ETag', etag),
+            # The data can change at any time, so always check.
+            ('Cache-Control', 'no-cache'),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if last_modified is not None:
+            headers.append(
+                ('Last-Modified', formatdate(last_modified, usegmt=True)))
+
+        if self.is_not_modified(etag, last_modified):
+            self.send_response(304)
             for key, val in headers:
                 self.send_header(key, val)
+            self.end_headers()
+            return
+
+        cache = self.server.page_cache
+        page = cache.get(self.path, etag)
+        if page is None:
+            body = env.get_template(template).render(**get_variables())
+            page = cache.set(self.path, etag, body.encode('utf-8'))
+
+        body = page['body']
+        if len(body) >= MIN_GZIP_SIZE and self.accepts_gzip():
+            if page['gzip'] is None:
+                page['gzip'] = gzip_bytes(body)
+            body = page['gzip']
+            headers.append(('Content-Encoding', 'gzip'))
+
+        self.send_response(200)
+        headers.extend([
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+        ])
+        for key, val in headers:
+            self.send_header(key, val)
         self.end_headers()
-        if variables is None:
-            variables = {}
-        template = env.get_template(template)
-        self.wfile.write(template.render(**variables).encode('utf-8'))
+        self.wfile.write(body)
 
     def do_GET(self):
         path = self.parse_path()
-        if not path:
-            return self.route_home(path)
+        try:
+            if not path:
+                return self.route_home(path)
 
-        if path[0] == 'edit':
-            return self.route_edit(path)
+            if path[0] == 'edit':
+                return self.route_edit(path)
+        except StorageError as exc:
+            # Someone has to fix the file by hand, so say which one.
+            return self.render_error(500, str(exc))
 
         return self.render_error(404)
 
     def do_POST(self):
         path = self.parse_path()
-        if path[0] == 'save':
-            return self.route_save(path)
+        try:
+            if path[0] == 'save':
+                return self.route_save(path)
+        except StorageError as exc:
+            return self.render_error(500, str(exc))
         return self.render_error(404)
 
     def route_home(self, path):
-        config = get_project_config()
-        self.render_response(
-            200, 'home.html', {
-                'title': config.get('project', 'category'),
-                'data_files': load_json_files(config)
-            })
+        store = self.server.store
+        query = self.parse_query()
+
+        def get_int(key, default, low, high):
+            try:
+                return max(low, min(high, int(query.get(key, default))))
+            except ValueError:
+                return default
+
+        page = get_int('page', 1, 1, sys.maxint)
+        size = get_int('size', PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        state = query.get('state') or None
+        if state is not None:
+            state = get_int('state', None, -sys.maxint, sys.maxint)
+
+        filters = {
+            'whiteboard': query.get('whiteboard') or None,
+            'category': query.get('category') or None,
+            'state': state,
+            'q': query.get('q') or None,
+        }
+
+        def get_variables():
+            summaries, total = store.query(
+                page=page, size=size, refresh=False, **filters)
+            num_pages = max(1, (total + size - 1) // size)
+
+            # Keep the filters and size when moving between pages.
+            args = dict((key, val) for key, val in filters.items()
+                        if val is not None)
+            args['size'] = size
+
+            def page_url(num):
+                args['page'] = num
+                return '/?' + urllib.urlencode(
+                    sorted((key, unicode(val).encode('utf-8'))
+                           for key, val in args.items()))
+
+            return {
+                'title': store.config.get('project', 'category'),
+                'summaries': summaries,
+                'total': total,
+                'page': page,
+                'num_pages': num_pages,
+                'size': size,
+                'filters': filters,
+                'prev_url': page_url(page - 1) if page > 1 else '',
+                'next_url': page_url(page + 1) if page < num_pages else '',
+                'states': get_video_validator().fields['state']['choices'],
+            }
+
+        etag = make_etag(self.path, store.generation())
+        self.render_cached(etag, 'home.html', get_variables)
 
     def route_edit(self, path):
-        cfg = get_project_config()
-        data_file = get_data(cfg, path[1])
-        if not data_file:
+        store = self.server.store
+        cfg = store.config
+        fn = path[1]
+        data = store.get(fn)
+        if data is None:
             return self.render_error(404)
 
-        fn, data = data_file
-        reqs = get_video_requirements()
+        category = cfg.get('project', 'category')
+        version = store.version(fn)
+        etag = make_etag(self.path, version, category)
+        last_modified = version[0][0]
+        self.render_cached(
+            etag, 'edit.html',
+            lambda: self.get_edit_variables(fn, data, category),
+            last_modified=last_modified)
+
+    def get_edit_variables(self, fn, data, category):
+        reqs = get_video_validator().requirements
 
         # TODO: verify the data and add the errors to the fields?
 
-        all_files = [filename for filename, _ in load_json_files(cfg)]
-        fn_index = all_files.index(fn)
-        prev_fn = all_files[fn_index - 1] if fn_index > 0 else ''
-        next_fn = (all_files[fn_index + 1] if fn_index < len(all_files) - 1
-                   else '')
+        prev_fn, next_fn = self.server.store.neighbors(fn)
 
         fields = []
 
-        category = cfg.get('project', 'category')
-
         for req in reqs:
             key = req['name']
             if key == 'category' and category:
@@ -134,24 +575,37 @@ class WebEditRequestHandler(BaseHTTPRequestHandler):
                         'value': data.get(key, '')
                     })
 
-        self.render_response(
-            200, 'edit.html', {
-                'title': u'edit {0}'.format(data['title']),
-                'fn': fn,
-                'fields': fields,
-                'prev_fn': prev_fn,
-                'next_fn': next_fn
-            })
+        return {
+            'title': u'edit {0}'.format(data['title']),
+            'fn': fn,
+            'fields': fields,
+            'prev_fn': prev_fn,
+            'next_fn': next_fn
+        }
 
     def route_save(self, path):
-        cfg = get_project_config()
-        data_file = get_data(cfg, path[1])
-        if not data_file:
+        store = self.server.store
+        fn = path[1]
+        if store.get(fn) is None:
             return self.render_error(404)
 
-        fn, data = data_file
         form_data = self.parse_form()
-        reqs = get_video_requirements()
+        with store.file_lock(fn):
+            # Get the data again now that nobody else can change it.
+            data = store.get(fn)
+            if data is None:
+                return self.render_error(404)
+
+            # Work on a copy so the store doesn't have half-saved data
+            # in it if something goes wrong.
+            data = self.apply_form(dict(data), form_data)
+            store.save(fn, data)
+
+        return self.redirect('/edit/{0}'.format(fn))
+
+    def apply_form(self, data, form_data):
+        """Updates video data with the values from the edit form"""
+        reqs = get_video_validator().requirements
 
         for req in reqs:
             key = req['name']
@@ -195,13 +649,49 @@ class WebEditRequestHandler(BaseHTTPRequestHandler):
         if 'category' in data and not data['category'].strip():
             del data['category']
 
-        save_json_file(cfg, fn, data)
+        return data
 
-        return self.redirect('/edit/{0}'.format(fn))
+
+class WebEditServer(ThreadingMixIn, HTTPServer):
+    """HTTP server that handles requests in threads
+
+    At most ``workers`` requests are handled at the same time. The
+    rest wait until a worker frees up.
+
+    :arg server_address: (host, port) tuple
+    :arg handler_class: request handler class
+    :arg store: the :py:class:`ProjectStore` handlers use
+    :arg workers: maximum number of requests to handle at once
+
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, store,
+                 workers=WORKERS):
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.store = store
+        self.page_cache = PageCache()
+        self._workers = threading.BoundedSemaphore(workers)
+
+    def process_request(self, request, client_address):
+        self._workers.acquire()
+        try:
+            ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self._workers.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            self._workers.release()
 
 
-def serve():
-    httpd = HTTPServer((HOST, PORT), WebEditRequestHandler)
-    out('Web edit system running on http://{0}:{1}/'.format(HOST, PORT))
+def serve(host=HOST, port=PORT, workers=WORKERS):
+    httpd = WebEditServer((host, port), WebEditRequestHandler,
+                          store=ProjectStore(get_project_config()),
+                          workers=workers)
+    out('Web edit system running on http://{0}:{1}/'.format(host, port))
     out('ctrl-c to exit.')
     httpd.serve_forever()
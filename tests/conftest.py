@@ -0,0 +1,118 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import json
+import os
+
+import pytest
+
+from steve.util import get_project_config
+
+
+@pytest.fixture
+def config(tmpdir, monkeypatch):
+    """Creates a project in a temp directory and returns its config"""
+    tmpdir.join('steve.ini').write(
+        '[project]\n'
+        'category = Test Category\n'
+    )
+    tmpdir.mkdir('json')
+    monkeypatch.chdir(tmpdir)
+    return get_project_config()
+
+
+# Stands in for youtube-dl.
+#
+# For a playlist url, it prints VIDEO_JSON for every id in VIDEO_IDS
+# that isn't in the --download-archive file. After each video it waits
+# for the file WAIT_FOR to exist, if that's set. At the end it fails
+# with FAIL as the error message, if that's set.
+#
+# With --flat-playlist, it only prints the ids in VIDEO_IDS.
+#
+# For a single video url, it prints VIDEO_JSON for that video. Videos
+# in BAD_IDS always fail. Videos in FLAKY_IDS fail the first time.
+#
+# Every video it prints VIDEO_JSON for is logged to FETCHED_LOG.
+FAKE_YOUTUBE_DL = """#!/bin/sh
+archive=/dev/null
+flat=
+target=
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --download-archive) archive=$2; shift ;;
+        --flat-playlist) flat=1 ;;
+        -j) ;;
+        *) target=$1 ;;
+    esac
+    shift
+done
+
+if [ -n "$flat" ]; then
+    for id in $VIDEO_IDS; do
+        echo "{\\"_type\\": \\"url\\", \\"id\\": \\"$id\\"}"
+    done
+    exit 0
+fi
+
+case "$target" in
+    *watch*)
+        id=${target##*v=}
+        case " $BAD_IDS " in
+            *" $id "*) echo "ERROR: $id is broken" >&2; exit 1 ;;
+        esac
+        case " $FLAKY_IDS " in
+            *" $id "*)
+                if [ ! -e "$FETCHED_LOG.$id" ]; then
+                    touch "$FETCHED_LOG.$id"
+                    echo "ERROR: $id is flaky" >&2
+                    exit 1
+                fi ;;
+        esac
+        echo $id >> $FETCHED_LOG
+        echo "$VIDEO_JSON" | sed "s/VIDEO_ID/$id/g"
+        exit 0 ;;
+esac
+
+for id in $VIDEO_IDS; do
+    if ! grep -q "youtube $id" $archive; then
+        echo $id >> $FETCHED_LOG
+        echo "$VIDEO_JSON" | sed "s/VIDEO_ID/$id/g"
+        if [ -n "$WAIT_FOR" ]; then
+            while [ ! -e "$WAIT_FOR" ]; do sleep 0.01; done
+        fi
+    fi
+done
+if [ -n "$FAIL" ]; then
+    echo "$FAIL" >&2
+    exit 1
+fi
+"""
+
+
+@pytest.fixture
+def fake_youtube_dl(tmpdir, monkeypatch):
+    """Puts a fake youtube-dl on the PATH and returns its log file"""
+    bindir = tmpdir.mkdir('bin')
+    script = bindir.join('youtube-dl')
+    script.write(FAKE_YOUTUBE_DL)
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', '{0}:{1}'.format(bindir, os.environ['PATH']))
+    monkeypatch.setenv('VIDEO_JSON', json.dumps({
+        'fulltitle': 'Talk VIDEO_ID',
+        'description': '',
+        'thumbnail': '',
+        'duration': 1,
+        'webpage_url': 'https://www.youtube.com/watch?v=VIDEO_ID',
+        'upload_date': '20150101',
+        'categories': [],
+    }))
+    log = tmpdir.join('fetched.log')
+    log.write('')
+    monkeypatch.setenv('FETCHED_LOG', str(log))
+    return log
@@ -0,0 +1,36 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bench_suite(tmpdir):
+    """Runs the benchmark suite small so it doesn't rot"""
+    output = str(tmpdir.join('results.json'))
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    args = [sys.executable, os.path.join(ROOT, 'benchmarks', 'bench_suite.py'),
+            '--sizes', '5', '--requests', '2', '--error-rate', '0.2',
+            '--output', output]
+    assert subprocess.call(args, env=env, stdout=open(os.devnull, 'w')) == 0
+
+    with open(output) as fp:
+        results = json.load(fp)
+    names = set(result['name'] for result in results['results'])
+    assert set(['push', 'pull', 'get_all_categories', 'load_json_files',
+                'verify_json_files', 'webedit_home']) <= names
+    assert all(result['ok'] for result in results['results'])
+
+    # Comparing with itself works too.
+    args[-2:] = ['--output', str(tmpdir.join('again.json')), '--compare', output]
+    assert subprocess.call(args, env=env, stdout=open(os.devnull, 'w')) == 0
@@ -1,8 +1,22 @@
+import json
 import os
+import re
+import time
 
+import pytest
 from click.testing import CliRunner
 
+import steve.cmdline
+import steve.restapi
+import steve.richardapi
+import steve.util
 from steve.cmdline import cli
+from steve.util import (
+    SteveException,
+    list_json_files,
+    load_json_files,
+    save_json_file,
+)
 
 
 # helpful for testing command line stuff
@@ -49,30 +63,376 @@ class TestCreateproject:
             assert '{0} exists.'.format(os.path.join(path, 'testprj')) in result.output
 
 
+class TestExportImport:
+    def test_round_trip(self, config, tmpdir):
+        save_json_file(config, 'a.json', {'title': 'A'})
+        save_json_file(config, 'b.json', {'title': 'B'})
+
+        runner = CliRunner()
+        result = runner.invoke(cli, ('export', 'videos.sqlite'))
+        assert result.exit_code == 0
+        assert 'Exported 2 videos' in result.output
+
+        for fn in ('a.json', 'b.json'):
+            tmpdir.join('json', fn).remove()
+        result = runner.invoke(cli, ('import', 'videos.sqlite'))
+        assert result.exit_code == 0
+        assert load_json_files(config) == [
+            ('a.json', {'title': 'A'}), ('b.json', {'title': 'B'})]
+
+    def test_same_storage(self, config):
+        runner = CliRunner()
+        result = runner.invoke(cli, ('export', config.get('project', 'jsonpath')))
+        assert result.exit_code == 1
+
+
 class TestFetch:
     def test_help(self):
         runner = CliRunner()
         result = runner.invoke(cli, ('fetch', '--help'))
         assert result.exit_code == 0
 
+    def test_incremental(self, config, tmpdir, monkeypatch, fake_youtube_dl):
+        tmpdir.join('steve.ini').write(
+            'url = https://www.youtube.com/user/foo\n', mode='a')
+        runner = CliRunner()
+
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb')
+        result = runner.invoke(cli, ('fetch', '--incremental'))
+        assert result.exit_code == 0, result.output
+        assert list_json_files(config) == ['0000_Talk_aaa.json', '0001_Talk_bbb.json']
+        assert fake_youtube_dl.read().split() == ['aaa', 'bbb']
+
+        # The user threw out bbb. It doesn't come back and only the new
+        # video gets fetched.
+        tmpdir.join('json', '0001_Talk_bbb.json').remove()
+        fake_youtube_dl.write('')
+        monkeypatch.setenv('VIDEO_IDS', 'ccc aaa bbb')
+        result = runner.invoke(cli, ('fetch', '--incremental'))
+        assert result.exit_code == 0, result.output
+        assert fake_youtube_dl.read().split() == ['ccc']
+        assert list_json_files(config) == ['0000_Talk_aaa.json', '0001_Talk_ccc.json']
+
+    def test_jobs(self, config, tmpdir, monkeypatch, fake_youtube_dl):
+        tmpdir.join('steve.ini').write(
+            'url = https://www.youtube.com/user/foo\n', mode='a')
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb ccc')
+        monkeypatch.setenv('BAD_IDS', 'bbb')
+
+        result = CliRunner().invoke(cli, ('fetch', '--jobs', '3', '--retries', '0'))
+        assert result.exit_code == 1
+        assert '1 of 3 videos could not be scraped: bbb' in result.output
+        assert list_json_files(config) == ['0000_Talk_aaa.json', '0002_Talk_ccc.json']
+
+    def test_scraper_error_keeps_files(self, config, tmpdir, monkeypatch,
+                                       fake_youtube_dl):
+        tmpdir.join('steve.ini').write(
+            'url = https://www.youtube.com/user/foo\n', mode='a')
+        monkeypatch.setenv('VIDEO_IDS', 'aaa')
+        monkeypatch.setenv('FAIL', 'ERROR: rate limited')
+
+        result = CliRunner().invoke(cli, ('fetch',))
+        assert result.exit_code == 1
+        assert 'ERROR: rate limited' in result.output
+        assert 'Created 1 files before that.' in result.output
+        assert list_json_files(config) == ['0000_Talk_aaa.json']
+
+    def test_stats(self, config, tmpdir, monkeypatch, fake_youtube_dl):
+        tmpdir.join('steve.ini').write(
+            'url = https://www.youtube.com/user/foo\n', mode='a')
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb')
+        trace = tmpdir.join('trace.json')
+
+        result = CliRunner().invoke(
+            cli, ('--stats', '--trace', str(trace), 'fetch', '--jobs', '2'))
+        assert result.exit_code == 0, result.output
+        lines = result.output.splitlines()
+        stats = [line.split() for line in lines if line.startswith('youtube-dl')]
+        # One run to list the videos and one for each of them.
+        assert [row[:4] for row in stats] == [
+            ['youtube-dl', '--flat-playlist', '-j', '1'],
+            ['youtube-dl', '-j', '2', '0'],
+        ]
+
+        events = json.loads(trace.read())['traceEvents']
+        assert len([event for event in events if event['ph'] == 'X']) == 3
+
     # FIXME: More extensive tests
 
 
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return self.content
+
+
+class FakePullAPI(object):
+    """Stands in for the slumber-ish API pull talks to
+
+    :arg videos: list of ``(video_id, slug)`` in category order
+    :arg delays: video_id -> seconds the GET takes
+    :arg broken: video ids whose GET fails
+
+    """
+    def __init__(self, videos, delays=None, broken=()):
+        self.videos = videos
+        self.delays = delays or {}
+        self.broken = broken
+        self.category = self
+
+    def get(self, **kwargs):
+        return FakeResponse({'objects': [{
+            'title': 'Test Category',
+            'videos': ['http://localhost/api/v2/video/{0}/{1}'.format(video_id, slug)
+                       for video_id, slug in self.videos]
+        }]})
+
+    def video(self, video_id):
+        api = self
+
+        class Video(object):
+            def get(self, **kwargs):
+                time.sleep(api.delays.get(video_id, 0))
+                if video_id in api.broken:
+                    raise SteveException('no video {0}'.format(video_id))
+                slug = dict(api.videos)[video_id]
+                return FakeResponse({'title': slug, 'slug': slug,
+                                     'resource_uri': '/video/{0}'.format(video_id)})
+
+        return Video()
+
+
 class TestPull:
     def test_help(self):
         runner = CliRunner()
         result = runner.invoke(cli, ('pull', '--help'))
         assert result.exit_code == 0
 
+    def test_jobs(self, api_config, monkeypatch):
+        # Category order isn't id order, and the first ones finish last.
+        api = FakePullAPI(
+            [(7, 'seven'), (3, 'three'), (9, 'nine'), (1, 'one')],
+            delays={7: 0.08, 3: 0.06, 9: 0.04, 1: 0.02},
+            broken=[9])
+        monkeypatch.setattr(steve.cmdline, '_get_api', lambda *args: api)
+
+        result = CliRunner().invoke(cli, ('pull', '--jobs', '4'))
+        assert result.exit_code == 1
+        assert 'Error pulling http://localhost/api/v2/video/9/nine: no video 9' in result.output
+        assert '1 of 4 videos could not be pulled.' in result.output
+
+        data = dict(load_json_files(api_config))
+        assert sorted(data) == ['0000_seven.json', '0001_three.json', '0003_one.json']
+        assert data['0000_seven.json']['id'] == 7
+        assert data['0003_one.json']['id'] == 1
+        assert 'resource_uri' not in data['0001_three.json']
+
+        api.broken = []
+        result = CliRunner().invoke(cli, ('pull', '--jobs', '4'))
+        assert result.exit_code == 0, result.output
+        assert '0002_nine.json' in dict(load_json_files(api_config))
+
     # FIXME: More extensive tests
 
 
+@pytest.fixture
+def api_config(config, tmpdir, monkeypatch):
+    """Project config with api settings for a richard that isn't there"""
+    tmpdir.join('steve.ini').write(
+        'api_url = http://localhost/api/v2/\n'
+        'username = foo\n'
+        'api_key = bar\n', mode='a')
+    monkeypatch.setattr(steve.richardapi, 'get_all_categories',
+                        lambda *args, **kwargs: [{'title': 'Test Category'}])
+    return config
+
+
+def save_talks(cfg, count):
+    for i in range(count):
+        save_json_file(cfg, '{0}.json'.format(i),
+                       {'title': 'Talk {0}'.format(i), 'language': 'English'})
+
+
 class TestPush:
     def test_help(self):
         runner = CliRunner()
         result = runner.invoke(cli, ('push', '--help'))
         assert result.exit_code == 0
 
+    def test_sync(self, api_config, monkeypatch):
+        config = api_config
+        calls = []
+
+        def create_video(api_url, auth_token, video_data, api=None):
+            calls.append(('create', video_data['title']))
+            return {'id': 100 + len(calls)}
+
+        def update_video(api_url, auth_token, video_id, video_data, api=None):
+            calls.append(('update', video_id))
+            return {}
+
+        monkeypatch.setattr(steve.richardapi, 'create_video', create_video)
+        monkeypatch.setattr(steve.richardapi, 'update_video', update_video)
+        save_talks(config, 5)
+
+        result = CliRunner().invoke(cli, ('push', '--sync'), input='y\n')
+        assert result.exit_code == 0, result.output
+        assert len(calls) == 5
+        assert 'new:        5' in result.output
+
+        # Nothing changed, so nothing gets sent.
+        calls[:] = []
+        result = CliRunner().invoke(cli, ('push', '--sync'), input='y\n')
+        assert result.exit_code == 0, result.output
+        assert calls == []
+        assert 'unchanged:  5' in result.output
+
+        # Fix a typo in one and add one.
+        data = dict(load_json_files(config))
+        data['2.json']['title'] = 'Talk two'
+        save_json_file(config, '2.json', data['2.json'])
+        save_json_file(config, '5.json', {'title': 'Talk 5', 'language': 'English'})
+
+        result = CliRunner().invoke(cli, ('push', '--sync'), input='y\n')
+        assert result.exit_code == 0, result.output
+        assert sorted(calls) == [('create', 'Talk 5'), ('update', data['2.json']['id'])]
+
+    def test_sync_and_update(self, config):
+        result = CliRunner().invoke(cli, ('push', '--sync', '--update'))
+        assert result.exit_code == 1
+        assert "--sync can't be used" in result.output
+
+    def test_changed_only_needs_update(self, config):
+        result = CliRunner().invoke(cli, ('push', '--changed-only'))
+        assert result.exit_code == 1
+        assert '--changed-only only works with --update' in result.output
+
+    def test_update_changed_only(self, api_config, monkeypatch):
+        updated = []
+
+        def update_video(api_url, auth_token, video_id, video_data, api=None):
+            updated.append(video_id)
+            return {}
+
+        def create_video(api_url, auth_token, video_data, api=None):
+            return {'id': video_data['title']}
+
+        monkeypatch.setattr(steve.richardapi, 'create_video', create_video)
+        monkeypatch.setattr(steve.richardapi, 'update_video', update_video)
+        save_json_file(api_config, 'a.json', {'title': 'A', 'language': 'English'})
+        save_json_file(api_config, 'b.json', {'title': 'B', 'language': 'English'})
+        result = CliRunner().invoke(cli, ('push', '--sync'), input='y\n')
+        assert result.exit_code == 0, result.output
+
+        data = dict(load_json_files(api_config))
+        data['b.json']['title'] = 'B changed'
+        save_json_file(api_config, 'b.json', data['b.json'])
+        # Moving mtimes around doesn't matter.
+        os.utime(os.path.join(api_config.get('project', 'jsonpath'), 'a.json'), (1, 1))
+
+        result = CliRunner().invoke(
+            cli, ('push', '--update', '--changed-only'), input='y\n')
+        assert result.exit_code == 0, result.output
+        assert updated == [data['b.json']['id']]
+        assert 'Skipping a.json... unchanged since pull.' in result.output
+
+    def test_api(self, api_config, monkeypatch):
+        apis = []
+
+        def create_video(api_url, auth_token, video_data, api=None):
+            apis.append(api)
+            return {'id': len(apis)}
+
+        monkeypatch.setattr(steve.richardapi, 'create_video', create_video)
+        save_talks(api_config, 2)
+
+        result = CliRunner().invoke(cli, ('push', '--jobs', '1'), input='y\n')
+        assert result.exit_code == 0, result.output
+        # push hands over its API. --jobs 1 doesn't stop other things
+        # from using every connection.
+        assert apis[0] is apis[1]
+        assert apis[0].scheduler.limit == steve.restapi.DEFAULT_POOL_SIZE
+
+    def test_jobs_keep_file_order(self, api_config, monkeypatch):
+        def create_video(api_url, auth_token, video_data, api=None):
+            num = int(video_data['title'].split()[-1])
+            # The first ones finish last.
+            time.sleep((5 - num) * 0.02)
+            return {'id': 100 + num}
+
+        monkeypatch.setattr(steve.richardapi, 'create_video', create_video)
+        save_talks(api_config, 5)
+
+        result = CliRunner().invoke(cli, ('push', '--jobs', '5'), input='y\n')
+        assert result.exit_code == 0, result.output
+        created = [line for line in result.output.splitlines()
+                   if line.startswith('Created')]
+        assert created == ['Created {0}.json (id {1})'.format(i, 100 + i)
+                           for i in range(5)]
+        for fn, contents in load_json_files(api_config):
+            assert contents['id'] == 100 + int(fn.split('.')[0])
+
+    def test_failure_doesnt_stop_others(self, api_config, monkeypatch):
+        def create_video(api_url, auth_token, video_data, api=None):
+            num = int(video_data['title'].split()[-1])
+            if num == 2:
+                raise SteveException('server said no')
+            return {'id': 100 + num}
+
+        monkeypatch.setattr(steve.richardapi, 'create_video', create_video)
+        save_talks(api_config, 5)
+
+        result = CliRunner().invoke(cli, ('push', '--jobs', '3'), input='y\n')
+        assert result.exit_code == 1
+        assert 'Error pushing 2.json: server said no' in result.output
+        assert '1 of 5 videos could not be pushed.' in result.output
+        # The failure table
+        assert re.search(r'^2\.json\s+server said no$', result.output, re.M)
+
+        ids = dict((fn, contents.get('id'))
+                   for fn, contents in load_json_files(api_config))
+        assert ids == {'0.json': 100, '1.json': 101, '2.json': None,
+                       '3.json': 103, '4.json': 104}
+
+    def test_saves_in_batches(self, api_config, monkeypatch):
+        batches = []
+
+        def save_json_files(cfg, files):
+            batches.append([fn for fn, _ in files])
+            steve.util.save_json_files(cfg, files)
+
+        monkeypatch.setattr(steve.cmdline, 'PUSH_SAVE_BATCH_SIZE', 2)
+        monkeypatch.setattr(steve.cmdline, 'save_json_files', save_json_files)
+        monkeypatch.setattr(steve.richardapi, 'create_video',
+                            lambda api_url, auth_token, video_data, api=None: {'id': 1})
+        save_talks(api_config, 5)
+
+        result = CliRunner().invoke(cli, ('push', '--jobs', '2'), input='y\n')
+        assert result.exit_code == 0, result.output
+        assert batches == [['0.json', '1.json'], ['2.json', '3.json'], ['4.json']]
+
+    def test_interrupt_saves_ids(self, api_config, monkeypatch):
+        def create_video(api_url, auth_token, video_data, api=None):
+            num = int(video_data['title'].split()[-1])
+            if num == 3:
+                raise KeyboardInterrupt()
+            return {'id': 100 + num}
+
+        monkeypatch.setattr(steve.cmdline, 'PUSH_SAVE_BATCH_SIZE', 2)
+        monkeypatch.setattr(steve.richardapi, 'create_video', create_video)
+        save_talks(api_config, 5)
+
+        result = CliRunner().invoke(cli, ('push', '--jobs', '1'), input='y\n')
+        assert result.exit_code != 0
+
+        # 0 and 1 went out in a batch; 2 is saved on the way out.
+        ids = dict((fn, contents.get('id'))
+                   for fn, contents in load_json_files(api_config))
+        assert ids == {'0.json': 100, '1.json': 101, '2.json': 102,
+                       '3.json': None, '4.json': None}
+
     # FIXME: More extensive tests
 
 
@@ -100,6 +460,18 @@ class TestVerify:
         result = runner.invoke(cli, ('verify', '--help'))
         assert result.exit_code == 0
 
+    def test_exit_code(self, config):
+        save_json_file(config, 'a.json', {'title': 'Foo', 'language': 'English'})
+
+        runner = CliRunner()
+        result = runner.invoke(cli, ('verify', '--jobs', '2'))
+        assert result.exit_code == 0
+
+        save_json_file(config, 'b.json', {'title': 'Foo'})
+        result = runner.invoke(cli, ('verify', '--jobs', '2'))
+        assert result.exit_code == 1
+        assert '1 of 2 files have errors.' in result.output
+
     # FIXME: More extensive tests
 
 
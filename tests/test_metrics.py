@@ -0,0 +1,128 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import json
+
+import pytest
+import requests
+
+from steve import metrics
+from steve.metrics import MetricsRegistry, percentile
+from steve.restapi import API, Scheduler, endpoint_template
+
+
+def test_percentile():
+    values = range(1, 101)
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([3], 90) == 3
+    assert percentile([], 50) is None
+
+
+def test_endpoint_template():
+    assert (endpoint_template('http://localhost/api/v2/video/12/?page=2') ==
+            '/api/v2/video/{id}/')
+    assert endpoint_template('http://localhost/api/v2/category/') == '/api/v2/category/'
+
+
+class TestMetricsRegistry:
+    def test_disabled(self):
+        registry = MetricsRegistry()
+        registry.record('http', 'GET /', 0, 1)
+        assert registry.events() == []
+
+    def test_summary(self):
+        registry = MetricsRegistry(enabled=True)
+        for i in range(10):
+            registry.record('http', 'GET /video/{id}/', i, 0.1 * (i + 1),
+                            status=200, bytes_received=100)
+        registry.record('http', 'GET /video/{id}/', 10, 5, status=503, attempt=0)
+        registry.record('http', 'GET /video/{id}/', 15, 0.5, status=200,
+                        attempt=1, bytes_received=100)
+        registry.record('youtube-dl', 'youtube-dl -j', 0, 2, status=1)
+
+        http, ytdl = registry.summary()
+        assert http['count'] == 12
+        assert http['errors'] == 1
+        assert http['retries'] == 1
+        assert http['bytes_received'] == 1100
+        assert http['p50'] == pytest.approx(0.5)
+        assert http['max'] == 5
+        assert ytdl['errors'] == 1
+
+        report = registry.report()
+        assert 'GET /video/{id}/' in report
+        assert 'p99 ms' in report
+
+    def test_chrome_trace(self, tmpdir):
+        registry = MetricsRegistry(enabled=True)
+        registry.record('http', 'GET /', registry._started + 1, 0.25, status=200)
+
+        path = str(tmpdir.join('trace.json'))
+        registry.save_trace(path)
+        with open(path) as fp:
+            trace = json.load(fp)
+        event, thread = trace['traceEvents']
+        assert event['ts'] == 1000000
+        assert event['dur'] == 250000
+        assert event['ph'] == 'X'
+        assert thread['args']['name'] == 'MainThread'
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = '{"id": 1}'
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def request(self, method, url, **kwargs):
+        resp = self.responses.pop(0)
+        if isinstance(resp, type):
+            raise resp('nope')
+        return resp
+
+
+@pytest.fixture
+def enabled():
+    metrics.registry.clear()
+    metrics.enable()
+    yield metrics.registry
+    metrics.disable()
+
+
+def test_requests_are_recorded(enabled):
+    session = FakeSession([
+        requests.ConnectionError, FakeResponse(200), FakeResponse(201)])
+    api = API('http://localhost/api/v2/', session=session,
+              scheduler=Scheduler(retries=1, backoff=0.001))
+    api.video(5).get()
+    api.video.post({'title': 'x'})
+
+    events = enabled.events()
+    assert [(e.name, e.status, e.attempt) for e in events] == [
+        ('GET /api/v2/video/{id}/', None, 0),
+        ('GET /api/v2/video/{id}/', 200, 1),
+        ('POST /api/v2/video/', 201, 0),
+    ]
+    assert events[1].bytes_received == 9
+    assert events[2].bytes_sent == len('{"title": "x"}')
+
+
+def test_disable_removes_hook():
+    metrics.registry.clear()
+    metrics.enable()
+    metrics.disable()
+    api = API('http://localhost/api/v2/', session=FakeSession([FakeResponse(200)]))
+    api.video.get()
+    assert metrics.registry.events() == []
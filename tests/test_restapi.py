@@ -6,7 +6,30 @@
 # license.
 #######################################################################
 
-from steve.restapi import urljoin
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from steve.restapi import (
+    API,
+    AsyncAPI,
+    Http4xxException,
+    Http5xxException,
+    Scheduler,
+    add_request_hook,
+    get_api,
+    get_connection_stats,
+    get_content,
+    get_retry_after,
+    make_session,
+    paginate,
+    remove_request_hook,
+    resize_pool,
+    urljoin,
+)
 
 
 def test_urljoin():
@@ -19,3 +42,324 @@ def test_urljoin():
 
     for base, args, expected in data:
         assert urljoin(base, *args) == expected
+
+
+def test_resources_share_session():
+    api = API('http://localhost/api/v2/')
+    assert api.video.session is api.session
+    assert api.video(1).session is api.session
+    assert api.category.session is api.session
+
+
+def test_get_api():
+    api = get_api('http://localhost/api/v2/')
+    assert get_api('http://localhost/api/v2/') is api
+    assert get_api('http://localhost/api/v3/') is not api
+
+
+def test_connection_stats_no_requests():
+    api = API('http://localhost/api/v2/')
+    assert get_connection_stats(api.session) == {
+        'connections': 0,
+        'requests': 0,
+        'reused': 0
+    }
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return self.content
+
+
+class FakeListResource(object):
+    """Serves ``items`` in pages like a richard listing"""
+    def __init__(self, items, page_size, count=True):
+        self.items = items
+        self.page_size = page_size
+        self.count = count
+        self.requested = []
+
+    def get(self, page=1, **kwargs):
+        if isinstance(page, list):
+            page = page[0]
+        page = int(page)
+        self.requested.append(page)
+
+        start = (page - 1) * self.page_size
+        end = start + self.page_size
+        content = {
+            'next': ('http://localhost/api/v2/foo/?page={0}'.format(page + 1)
+                     if end < len(self.items) else None),
+            'results': self.items[start:end]
+        }
+        if self.count:
+            content['count'] = len(self.items)
+        return FakeResponse(content)
+
+
+def test_paginate():
+    items = range(23)
+
+    resource = FakeListResource(items, page_size=5)
+    assert list(paginate(resource, jobs=3)) == items
+    assert sorted(resource.requested) == [1, 2, 3, 4, 5]
+
+
+def test_paginate_without_count():
+    items = range(23)
+
+    resource = FakeListResource(items, page_size=5, count=False)
+    assert list(paginate(resource)) == items
+    assert resource.requested == [1, 2, 3, 4, 5]
+
+
+def test_paginate_single_page():
+    resource = FakeListResource(range(3), page_size=5)
+    assert list(paginate(resource)) == range(3)
+    assert resource.requested == [1]
+
+
+class FakeStatusResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+        self.content = '{}'
+
+
+class FakeSession(object):
+    """Hands back the given responses in order
+
+    A response that's an exception class gets raised instead.
+
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, time.time()))
+        resp = self.responses.pop(0)
+        if isinstance(resp, type):
+            raise resp('nope')
+        return resp
+
+
+def make_api(responses, **kwargs):
+    kwargs.setdefault('backoff', 0.001)
+    session = FakeSession(responses)
+    api = API('http://localhost/api/v2/', session=session,
+              scheduler=Scheduler(**kwargs))
+    return api, session
+
+
+def test_get_retry_after():
+    assert get_retry_after(FakeStatusResponse(503)) is None
+    assert get_retry_after(FakeStatusResponse(503, {'Retry-After': '3'})) == 3.0
+    assert get_retry_after(FakeStatusResponse(503, {'Retry-After': 'soon'})) is None
+
+    date = formatdate(time.time() + 60, usegmt=True)
+    delay = get_retry_after(FakeStatusResponse(503, {'Retry-After': date}))
+    assert 55 <= delay <= 60
+
+    date = formatdate(time.time() - 60, usegmt=True)
+    assert get_retry_after(FakeStatusResponse(503, {'Retry-After': date})) == 0
+
+
+class TestRetries:
+    def test_no_retries_by_default(self):
+        api, session = make_api([FakeStatusResponse(503)])
+        with pytest.raises(Http5xxException):
+            api.video.get()
+
+    def test_get_is_retried(self):
+        api, session = make_api(
+            [FakeStatusResponse(503), requests.ConnectionError,
+             FakeStatusResponse(200)],
+            retries=2)
+        assert api.video.get().status_code == 200
+        assert len(session.requests) == 3
+
+    def test_gives_up(self):
+        api, session = make_api([FakeStatusResponse(502)] * 3, retries=2)
+        with pytest.raises(Http5xxException):
+            api.video.get()
+        assert len(session.requests) == 3
+
+    def test_other_errors_are_not_retried(self):
+        api, session = make_api(
+            [FakeStatusResponse(500), FakeStatusResponse(404)], retries=2)
+        with pytest.raises(Http5xxException):
+            api.video.get()
+        with pytest.raises(Http4xxException):
+            api.video.get()
+        assert len(session.requests) == 2
+
+    def test_post_is_only_retried_after_429(self):
+        api, session = make_api(
+            [FakeStatusResponse(429), FakeStatusResponse(201),
+             FakeStatusResponse(503)],
+            retries=2)
+        assert api.video.post({}).status_code == 201
+        with pytest.raises(Http5xxException):
+            api.video.post({})
+
+        api, session = make_api([requests.ConnectionError], retries=2)
+        with pytest.raises(requests.ConnectionError):
+            api.video.post({})
+
+    def test_retry_after(self):
+        api, session = make_api(
+            [FakeStatusResponse(429, {'Retry-After': '1'}),
+             FakeStatusResponse(200)],
+            retries=1)
+        api.video.get()
+        first, second = session.requests
+        assert second[1] - first[1] >= 0.9
+
+
+class TestReleasesSlot:
+    """The scheduler gets its slot back no matter how a request fails"""
+    def test_other_request_exceptions(self):
+        api, session = make_api(
+            [requests.exceptions.ChunkedEncodingError, FakeStatusResponse(200)],
+            concurrency=1, retries=2)
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            api.video.get()
+        assert api.scheduler._in_flight == 0
+
+        # This would hang if the slot had leaked.
+        assert api.video.get().status_code == 200
+
+    def test_raising_hook(self):
+        def hook(info):
+            raise ValueError('broken hook')
+
+        api, session = make_api([FakeStatusResponse(200)] * 2, concurrency=1)
+        add_request_hook(hook)
+        try:
+            with pytest.raises(ValueError):
+                api.video.get()
+        finally:
+            remove_request_hook(hook)
+        assert api.scheduler._in_flight == 0
+        assert api.video.get().status_code == 200
+
+
+class TestScheduler:
+    def test_rate(self):
+        api, session = make_api([FakeStatusResponse(200)] * 5, rate=50)
+        for i in range(5):
+            api.video.get()
+
+        times = [t for method, t in session.requests]
+        assert times[-1] - times[0] >= 4 / 50.0 - 0.005
+
+    def test_aimd(self):
+        scheduler = Scheduler(concurrency=8)
+        assert scheduler.limit == 8
+
+        # A round of failures only halves the limit once.
+        tickets = [scheduler.acquire() for i in range(8)]
+        for ticket in tickets:
+            scheduler.release(ticket, failed=True)
+        assert scheduler.limit == 4
+
+        ticket = scheduler.acquire()
+        scheduler.release(ticket, failed=True)
+        assert scheduler.limit == 2
+
+        # Successes grow it back by about one per round.
+        for i in range(3):
+            scheduler.release(scheduler.acquire())
+        assert scheduler.limit == 3
+
+        for i in range(100):
+            scheduler.release(scheduler.acquire())
+        assert scheduler.limit == 8
+
+    def test_concurrency(self):
+        scheduler = Scheduler(concurrency=2)
+        tickets = [scheduler.acquire(), scheduler.acquire()]
+        acquired = []
+
+        thread = threading.Thread(
+            target=lambda: acquired.append(scheduler.acquire()))
+        thread.start()
+        thread.join(0.1)
+        assert not acquired
+
+        scheduler.release(tickets[0])
+        thread.join(1)
+        assert acquired
+
+
+class SlowSession(object):
+    """Takes a while to answer; video 'missing' doesn't exist"""
+    adapters = {}
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+
+        video_id = url.rstrip('/').split('/')[-1]
+        resp = FakeStatusResponse(404 if video_id == 'missing' else 200)
+        resp.json = lambda: {'id': int(video_id), 'method': method}
+        return resp
+
+
+class TestAsyncAPI:
+    def test_requests_run_at_the_same_time(self):
+        session = SlowSession(0.1)
+        with AsyncAPI(API('http://localhost/api/v2/', session=session),
+                      jobs=20) as api:
+            start = time.time()
+            pending = [api.video(i).get() for i in range(1, 21)]
+            assert [get_content(result.get())['id'] for result in pending] == range(1, 21)
+            assert time.time() - start < 1
+            assert session.max_in_flight > 1
+
+    def test_jobs(self):
+        session = SlowSession(0.01)
+        with AsyncAPI(API('http://localhost/api/v2/', session=session),
+                      jobs=3) as api:
+            for result in [api.video(i).put({}) for i in range(1, 21)]:
+                assert get_content(result.get())['method'] == 'PUT'
+        assert session.max_in_flight <= 3
+
+    def test_exceptions(self):
+        with AsyncAPI(API('http://localhost/api/v2/', session=SlowSession(0)),
+                      jobs=2) as api:
+            result = api.video('missing').delete()
+            with pytest.raises(Http4xxException):
+                result.get()
+
+            assert api.submit(lambda x: x * 2, 21).get() == 42
+
+    def test_shares_session(self):
+        api = API('http://localhost/api/v2/')
+        async_api = AsyncAPI(api, jobs=4)
+        assert async_api.video(1).resource.session is api.session
+        assert async_api.video.resource.scheduler is api.scheduler
+
+
+def test_resize_pool():
+    session = make_session(pool_size=2)
+    resize_pool(session, 50)
+    assert session.adapters['http://']._pool_maxsize == 50
+
+    # It never shrinks.
+    resize_pool(session, 10)
+    assert session.adapters['https://']._pool_maxsize == 50
@@ -0,0 +1,140 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import json
+
+import pytest
+
+from steve import restapi, richardapi
+
+
+API_URL = 'http://localhost/api/v2/'
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class TestGetAllCategories:
+    @pytest.fixture(autouse=True)
+    def fake_fetch(self, monkeypatch):
+        """Replaces fetching with something that records calls"""
+        richardapi._category_memo.clear()
+        self.calls = []
+        self.status_code = 200
+
+        def _fetch_categories(api, headers=None):
+            self.calls.append(headers)
+            if self.status_code == 304:
+                return FakeResponse(304), None
+            return (FakeResponse(200, {'etag': '"abc"'}),
+                    [{'title': 'PyCon 2014'}])
+
+        monkeypatch.setattr(richardapi, '_fetch_categories', _fetch_categories)
+
+    def test_memo(self):
+        assert richardapi.get_all_categories(API_URL) == [{'title': 'PyCon 2014'}]
+        assert richardapi.get_all_categories(API_URL) == [{'title': 'PyCon 2014'}]
+        assert len(self.calls) == 1
+
+    def test_cache_file(self, tmpdir):
+        cache_file = str(tmpdir.join('categories.json'))
+        richardapi.get_all_categories(API_URL, cache_file=cache_file)
+
+        # Start over with an empty memo and it should use the file.
+        richardapi._category_memo.clear()
+        cats = richardapi.get_all_categories(API_URL, cache_file=cache_file)
+        assert cats == [{'title': 'PyCon 2014'}]
+        assert len(self.calls) == 1
+
+    def test_revalidate(self):
+        richardapi.get_all_categories(API_URL)
+
+        self.status_code = 304
+        cats = richardapi.get_all_categories(API_URL, ttl=0)
+        assert cats == [{'title': 'PyCon 2014'}]
+        assert self.calls == [None, {'If-None-Match': '"abc"'}]
+
+    def test_get_category_refetches(self):
+        richardapi.get_all_categories(API_URL)
+        with pytest.raises(richardapi.DoesNotExist):
+            richardapi.get_category(API_URL, 'PyCon 2015')
+
+        # The category wasn't in the cached list, so it checked with
+        # the server again.
+        assert len(self.calls) == 2
+
+
+class FakeVideoSession(object):
+    adapters = {}
+
+    def request(self, method, url, **kwargs):
+        video_id = url.rstrip('/').split('/')[-1]
+        resp = FakeResponse(404 if video_id == '2' else 200)
+        resp.json = lambda: {'id': int(video_id)}
+        return resp
+
+
+def test_get_videos(monkeypatch):
+    api = restapi.AsyncAPI(
+        restapi.API(API_URL, session=FakeVideoSession()), jobs=4)
+    monkeypatch.setattr(restapi, 'get_async_api', lambda url, jobs: api)
+
+    results = list(richardapi.get_videos(API_URL, 'token', [1, 2, 3]))
+    assert [(video_id, data) for video_id, data, exc in results] == [
+        (1, {'id': 1}), (2, None), (3, {'id': 3})]
+    assert isinstance(results[1][2], restapi.Http4xxException)
+
+
+class RecordingSession(object):
+    """Records requests and answers with status_code"""
+    adapters = {}
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        resp = FakeResponse(self.status_code)
+        resp.content = '{"id": 5, "updated": "2014-05-01T10:00:00"}'
+        resp.json = lambda: json.loads(resp.content)
+        return resp
+
+
+class TestUpdateVideo:
+    video_data = {
+        'id': 5,
+        'category': 'Test Category',
+        'state': 1,
+        'title': 'Test video title',
+        'speakers': ['Jimmy Discotheque'],
+        'language': 'English',
+    }
+
+    def update(self, monkeypatch, status_code):
+        session = RecordingSession(status_code)
+        api = restapi.API(API_URL, session=session)
+        monkeypatch.setattr(restapi, 'get_api', lambda url: api)
+        try:
+            return richardapi.update_video(
+                API_URL, 'token', 5, dict(self.video_data))
+        finally:
+            self.requests = session.requests
+
+    def test_one_put(self, monkeypatch):
+        video = self.update(monkeypatch, 200)
+        assert video['updated'] == '2014-05-01T10:00:00'
+        assert self.requests == [('PUT', API_URL + 'video/5/')]
+
+    def test_missing_video(self, monkeypatch):
+        with pytest.raises(restapi.Http4xxException):
+            self.update(monkeypatch, 404)
+        assert self.requests == [('PUT', API_URL + 'video/5/')]
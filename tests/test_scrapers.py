@@ -0,0 +1,202 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2015 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import threading
+import time
+
+import pytest
+
+from steve.scrapers import (
+    get_scraper,
+    Scraper,
+    ScraperError,
+    ScraperRegistry,
+    YoutubeScraper,
+)
+
+
+URL = 'https://www.youtube.com/user/foo'
+
+
+class TestYoutubeScraper:
+    def test_not_handled(self):
+        assert YoutubeScraper().iter_scrape('http://vimeo.com/1') is None
+        assert YoutubeScraper().scrape('http://vimeo.com/1') is None
+
+    def test_scrape(self, fake_youtube_dl, monkeypatch):
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb')
+        videos = YoutubeScraper().scrape(URL, skip_ids=['aaa'])
+        assert [video['title'] for video in videos] == ['Talk bbb']
+
+    def test_subdomains(self, fake_youtube_dl, monkeypatch):
+        # The registry sends these here, so they'd better be handled.
+        monkeypatch.setenv('VIDEO_IDS', 'aaa')
+        url = 'https://m.youtube.com/watch?v=aaa'
+        scraper = get_scraper(url)
+        assert isinstance(scraper, YoutubeScraper)
+        videos = scraper.scrape(url)
+        assert [video['title'] for video in videos] == ['Talk aaa']
+
+    def test_streams(self, fake_youtube_dl, monkeypatch, tmpdir):
+        go = tmpdir.join('go')
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb')
+        monkeypatch.setenv('WAIT_FOR', str(go))
+
+        videos = YoutubeScraper().iter_scrape(URL)
+        # youtube-dl is stuck until "go" exists, so this only works if
+        # videos come out as soon as they're printed.
+        assert next(videos)['title'] == 'Talk aaa'
+        go.write('')
+        assert [video['title'] for video in videos] == ['Talk bbb']
+
+    def test_stop_early(self, fake_youtube_dl, monkeypatch, tmpdir):
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb')
+        monkeypatch.setenv('WAIT_FOR', str(tmpdir.join('never')))
+
+        videos = YoutubeScraper().iter_scrape(URL)
+        next(videos)
+        # This would hang if youtube-dl weren't killed.
+        videos.close()
+        assert fake_youtube_dl.read().split() == ['aaa']
+
+    def test_error(self, fake_youtube_dl, monkeypatch):
+        monkeypatch.setenv('VIDEO_IDS', 'aaa')
+        monkeypatch.setenv('FAIL', 'ERROR: nope')
+
+        videos = YoutubeScraper().iter_scrape(URL)
+        assert next(videos)['title'] == 'Talk aaa'
+        with pytest.raises(ScraperError) as exc_info:
+            next(videos)
+        assert 'ERROR: nope' in str(exc_info.value)
+
+
+class TestYoutubeScraperParallel:
+    @pytest.fixture(autouse=True)
+    def no_retry_delay(self, monkeypatch):
+        monkeypatch.setattr(YoutubeScraper, 'retry_delay', 0)
+
+    def test_list_video_ids(self, fake_youtube_dl, monkeypatch):
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb')
+        assert YoutubeScraper().list_video_ids(URL) == ['aaa', 'bbb']
+        # Listing doesn't scrape anything.
+        assert fake_youtube_dl.read() == ''
+
+    def test_in_playlist_order(self, fake_youtube_dl, monkeypatch):
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb ccc ddd eee')
+        results = list(YoutubeScraper().iter_scrape_parallel(
+            URL, skip_ids=['bbb'], jobs=3))
+        assert [(video_id, video['title'], exc)
+                for video_id, video, exc in results] == [
+            ('aaa', 'Talk aaa', None),
+            ('ccc', 'Talk ccc', None),
+            ('ddd', 'Talk ddd', None),
+            ('eee', 'Talk eee', None),
+        ]
+
+    def test_retries(self, fake_youtube_dl, monkeypatch):
+        monkeypatch.setenv('VIDEO_IDS', 'aaa bbb ccc')
+        monkeypatch.setenv('FLAKY_IDS', 'aaa')
+        monkeypatch.setenv('BAD_IDS', 'bbb')
+
+        results = list(YoutubeScraper().iter_scrape_parallel(
+            URL, jobs=2, retries=1))
+        assert [video_id for video_id, video, exc in results] == [
+            'aaa', 'bbb', 'ccc']
+        assert results[0][1]['title'] == 'Talk aaa'
+        assert 'bbb is broken' in str(results[1][2])
+        assert results[2][1]['title'] == 'Talk ccc'
+
+        # Without retries, the flaky one fails too.
+        monkeypatch.setenv('FLAKY_IDS', 'ccc')
+        results = list(YoutubeScraper().iter_scrape_parallel(
+            URL, jobs=2, retries=0))
+        assert [exc is None for video_id, video, exc in results] == [
+            True, False, False]
+
+
+class FakeScraper(Scraper):
+    hosts = ('example.com',)
+
+    def scrape(self, url, skip_ids=None):
+        return [{'title': url}]
+
+
+class TestScraperRegistry:
+    @pytest.fixture
+    def registry(self, monkeypatch):
+        registry = ScraperRegistry()
+        # Don't pick up whatever is installed.
+        monkeypatch.setattr(registry, '_read_entry_points', True)
+        return registry
+
+    def test_dispatch_by_host(self, registry):
+        registry.register(FakeScraper)
+        registry.register(YoutubeScraper)
+
+        assert isinstance(registry.get_scraper('http://example.com/foo'), FakeScraper)
+        assert isinstance(registry.get_scraper('http://www.example.com:80/'), FakeScraper)
+        assert isinstance(registry.get_scraper('https://youtu.be/aaa'), YoutubeScraper)
+        assert registry.get_scraper('http://vimeo.com/1') is None
+        assert registry.get_scraper('http://com/') is None
+        # Scrapers are only made once.
+        assert (registry.get_scraper('http://example.com/') is
+                registry.get_scraper('http://example.com/'))
+
+    def test_lazy_loading(self, registry):
+        registry.register('steve.nonexistent:Scraper', hosts=['broken.example.com'])
+        registry.register('tests.test_scrapers:FakeScraper', hosts=['vimeo.com'])
+
+        # Nothing is imported until a url for that host comes along.
+        assert isinstance(registry.get_scraper('http://vimeo.com/1'), FakeScraper)
+        assert registry.get_scraper('http://broken.example.com/') is None
+
+    def test_entry_points(self, monkeypatch):
+        class EntryPoint(object):
+            name = 'vimeo.com, player.vimeo.com'
+            module_name = 'tests.test_scrapers'
+            attrs = ('FakeScraper',)
+
+        import pkg_resources
+        monkeypatch.setattr(pkg_resources, 'iter_entry_points',
+                            lambda group: [EntryPoint()])
+        registry = ScraperRegistry()
+        assert isinstance(registry.get_scraper('http://player.vimeo.com/1'), FakeScraper)
+
+    def test_entry_points_read_once(self, monkeypatch):
+        registry = ScraperRegistry()
+        calls = []
+
+        def add_entry_points():
+            calls.append(1)
+            # Give the other threads time to get here.
+            time.sleep(0.05)
+            registry.register(FakeScraper)
+
+        monkeypatch.setattr(registry, '_add_entry_points', add_entry_points)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                registry.get_scraper('http://example.com/')))
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        # Nobody looked before the entry points were in the index.
+        assert len(results) == 4
+        assert all(isinstance(result, FakeScraper) for result in results)
+
+    def test_fallbacks(self):
+        scraper = FakeScraper()
+        assert list(scraper.iter_scrape('http://example.com/')) == [
+            {'title': 'http://example.com/'}]
+        assert list(scraper.iter_scrape_parallel('http://example.com/')) == [
+            (None, {'title': 'http://example.com/'}, None)]
@@ -0,0 +1,165 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import os
+import time
+
+import pytest
+
+from steve.storage import (
+    get_storage,
+    guess_storage_name,
+    open_storage,
+    StorageError,
+)
+from steve.util import (
+    get_project_config,
+    load_json_files,
+    save_json_file,
+)
+
+
+PATHS = {
+    'files': 'json',
+    'jsonl': 'videos.jsonl',
+    'sqlite': 'videos.sqlite',
+}
+
+
+@pytest.fixture(params=['files', 'jsonl', 'sqlite'])
+def storage(request, tmpdir):
+    return open_storage(request.param,
+                        str(tmpdir.join(PATHS[request.param])))
+
+
+class TestStorage:
+    def test_save_and_load(self, storage):
+        assert storage.names() == []
+        assert storage.get('a.json') is None
+
+        assert storage.save([('b.json', {'title': 'B'}),
+                             ('a.json', {'title': 'A'})]) == ['b.json', 'a.json']
+        assert storage.names() == ['a.json', 'b.json']
+        assert storage.get('a.json') == {'title': 'A'}
+        assert list(storage.load()) == [('a.json', {'title': 'A'}),
+                                        ('b.json', {'title': 'B'})]
+        assert list(storage.load(['b.json', 'nope.json'])) == [
+            ('b.json', {'title': 'B'})]
+
+    def test_skips_unchanged(self, storage):
+        storage.save([('a.json', {'title': 'A'})])
+        assert storage.save([('a.json', {'title': 'A'})]) == []
+        assert storage.save([('a.json', {'title': 'A2'})]) == ['a.json']
+        assert storage.get('a.json') == {'title': 'A2'}
+
+    def test_stamps(self, storage):
+        storage.save([('a.json', {'title': 'A'})])
+        stamp = storage.stamp('a.json')
+        listing_stamp = storage.listing_stamp()
+        assert storage.stamp('nope.json') is None
+
+        # Let mtimes move on.
+        time.sleep(0.01)
+        storage.save([('a.json', {'title': 'A changed'})])
+        assert storage.stamp('a.json') != stamp
+        # Nothing was added or removed.
+        assert storage.listing_stamp() == listing_stamp
+
+        storage.save([('b.json', {'title': 'B'})])
+        assert storage.listing_stamp() != listing_stamp
+
+    def test_saved_data_is_not_shared(self, storage):
+        data = {'title': 'A'}
+        storage.save([('a.json', data)])
+        data['title'] = 'changed after saving'
+        assert storage.get('a.json') == {'title': 'A'}
+
+    def test_loaded_data_is_not_shared(self, storage):
+        storage.save([('a.json', {'title': 'A', 'id': 1})])
+        # Start over with what's on disk.
+        storage = type(storage)(storage.path)
+        for name, data in storage.load():
+            data['title'] = 'changed after loading'
+            del data['id']
+        storage.get('a.json')['category'] = 'changed after getting'
+
+        assert storage.get('a.json') == {'title': 'A', 'id': 1}
+        assert list(storage.load()) == [('a.json', {'title': 'A', 'id': 1})]
+
+    def test_malformed_record(self, storage):
+        # Whatever the storage, a record that can't be parsed is an
+        # error and not a missing record.
+        storage.save([('a.json', {'title': 'A'})])
+        if storage.name == 'files':
+            with open(os.path.join(storage.path, 'a.json'), 'w') as fp:
+                fp.write('{"title": ')
+        elif storage.name == 'jsonl':
+            with open(storage.path, 'w') as fp:
+                fp.write('{"name": "a.json", "data": {"title": \n')
+        else:
+            with storage._db:
+                storage._db.execute('UPDATE videos SET data = \'{"title": \'')
+
+        with pytest.raises(StorageError) as exc_info:
+            storage.get('a.json')
+        assert storage.path in str(exc_info.value)
+
+
+def test_jsonl_picks_up_changes_on_disk(tmpdir):
+    path = tmpdir.join('videos.jsonl')
+    storage = open_storage('jsonl', str(path))
+    storage.save([('a.json', {'title': 'A'})])
+    assert storage.names() == ['a.json']
+
+    path.write('{"name": "b.json", "data": {"title": "B"}}\n')
+    assert storage.names() == ['b.json']
+
+    path.write('{"name": "b.json"\n')
+    with pytest.raises(StorageError):
+        storage.names()
+
+
+def test_guess_storage_name():
+    assert guess_storage_name('json') == 'files'
+    assert guess_storage_name('out/videos.jsonl') == 'jsonl'
+    assert guess_storage_name('videos.sqlite') == 'sqlite'
+    assert guess_storage_name('videos.db') == 'sqlite'
+
+
+class TestGetStorage:
+    def make_config(self, tmpdir, storage):
+        tmpdir.join('steve.ini').write(
+            '[project]\n'
+            'category = Test Category\n'
+            'storage = {0}\n'.format(storage))
+        tmpdir.chdir()
+        return get_project_config()
+
+    def test_default_is_files(self, config):
+        storage = get_storage(config)
+        assert storage.name == 'files'
+        assert storage.path == config.get('project', 'jsonpath')
+
+    @pytest.mark.parametrize('name', ['jsonl', 'sqlite'])
+    def test_packed(self, tmpdir, monkeypatch, name):
+        monkeypatch.chdir(tmpdir)
+        config = self.make_config(tmpdir, name)
+        storage = get_storage(config)
+        assert storage.name == name
+        assert storage.path == str(tmpdir.join(PATHS[name]))
+
+        # The util functions go through the storage.
+        save_json_file(config, 'a.json', {'title': 'A'})
+        assert load_json_files(config) == [('a.json', {'title': 'A'})]
+        assert not tmpdir.join('json').check()
+
+    def test_bad_storage(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        config = self.make_config(tmpdir, 'floppy')
+        with pytest.raises(StorageError):
+            get_storage(config)
@@ -6,14 +6,36 @@
 # license.
 #######################################################################
 
+import os
+
 import pytest
 
 from steve.util import (
+    AtomicWriteBatch,
+    changed_since_pull,
+    diff_sync_manifest,
+    get_content_hash,
     get_video_id,
+    get_youtube_id,
+    get_video_requirements,
+    get_video_validator,
     html_to_markdown,
     is_youtube,
+    iter_json_files,
+    iter_verify_json_files,
+    JSONFileCache,
+    load_fetch_checkpoint,
+    load_json_files,
+    load_sync_manifest,
+    pool_map,
+    save_fetch_checkpoint,
+    save_json_file,
+    save_json_files,
+    save_sync_manifest,
     SteveException,
+    update_sync_manifest,
     verify_video_data,
+    write_file_atomically,
 )
 
 
@@ -120,6 +142,15 @@ class TestVerifyVideoData:
         assert len(verify_video_data(data)) == 1
 
 
+def test_get_video_validator():
+    validator = get_video_validator()
+    assert get_video_validator() is validator
+    assert validator.requirements is get_video_requirements()
+    assert 'title' in validator.allowed_keys
+    assert 'id' in validator.allowed_keys
+    assert 'whatever' not in validator.allowed_keys
+
+
 def test_html_to_markdown():
     """Test html_to_markdown"""
     assert (
@@ -132,12 +163,75 @@ def test_is_youtube():
     data = [
         ('http://www.youtube.com/watch?v=N29XAFjiKf4', True),
         ('http://youtu.be/N29XAFjiKf4', True),
+        ('https://m.youtube.com/watch?v=N29XAFjiKf4', True),
+        ('https://YouTube.com:443/watch?v=N29XAFjiKf4', True),
+        ('http://youtube.com.example.com/watch?v=N29XAFjiKf4', False),
+        ('http://vimeo.com/1234', False),
     ]
 
     for url, expected in data:
         assert is_youtube(url) == expected
 
 
+def test_get_youtube_id():
+    data = [
+        ('http://www.youtube.com/watch?v=N29XAFjiKf4', 'N29XAFjiKf4'),
+        ('https://www.youtube.com/watch?feature=x&v=N29XAFjiKf4', 'N29XAFjiKf4'),
+        ('http://youtu.be/N29XAFjiKf4', 'N29XAFjiKf4'),
+        ('https://www.youtube.com/user/PyConDE/videos', None),
+        ('http://vimeo.com/1234', None),
+        ('', None),
+    ]
+
+    for url, expected in data:
+        assert get_youtube_id(url) == expected
+
+
+def test_fetch_checkpoint(config):
+    url = 'https://www.youtube.com/user/foo'
+    assert load_fetch_checkpoint(config, url) == set()
+    save_fetch_checkpoint(config, url, set(['b', 'a']))
+    save_fetch_checkpoint(config, 'https://www.youtube.com/user/bar', set(['c']))
+    assert load_fetch_checkpoint(config, url) == set(['a', 'b'])
+
+
+class TestSyncManifest:
+    def test_get_content_hash(self):
+        data = {'title': u'Foo', 'speakers': [u'Jimmy'], 'id': 1,
+                'updated': '2014-01-01T00:00:00'}
+        same = {'speakers': [u'Jimmy'], 'title': u'Foo', 'id': 2}
+        assert get_content_hash(data) == get_content_hash(same)
+        assert get_content_hash(data) != get_content_hash(dict(data, title=u'Fo'))
+
+    def test_save_and_load(self, config):
+        api_url = 'http://example.com/api/v2/'
+        assert load_sync_manifest(config, api_url) == {}
+
+        manifest = {}
+        update_sync_manifest(manifest, 'a.json', {'id': 1, 'title': u'A'})
+        save_sync_manifest(config, api_url, manifest)
+        save_sync_manifest(config, 'http://example.com/api/v3/', {})
+        assert load_sync_manifest(config, api_url) == manifest
+
+    def test_diff(self):
+        manifest = {}
+        update_sync_manifest(manifest, 'same.json', {'id': 1, 'title': u'A'})
+        update_sync_manifest(manifest, 'edited.json', {'id': 2, 'title': u'B'})
+        update_sync_manifest(manifest, 'moved.json', {'id': 3, 'title': u'C'})
+
+        data = [
+            ('new.json', {'title': u'N'}),
+            ('same.json', {'id': 1, 'title': u'A', 'updated': 'later'}),
+            ('edited.json', {'id': 2, 'title': u'B!'}),
+            ('moved.json', {'id': 4, 'title': u'C'}),
+            ('unknown.json', {'id': 5, 'title': u'D'}),
+        ]
+        new, modified, unchanged = diff_sync_manifest(manifest, data)
+        assert [fn for fn, _ in new] == ['new.json']
+        assert [fn for fn, _ in modified] == ['edited.json', 'moved.json', 'unknown.json']
+        assert [fn for fn, _ in unchanged] == ['same.json']
+
+
 def test_get_video_id():
     # Test valid urls
     data = [
@@ -162,3 +256,211 @@ def test_get_video_id():
     for url in data:
         with pytest.raises(SteveException):
             get_video_id(url)
+
+
+def test_pool_map():
+    def divide(x):
+        return 10 / x
+
+    for jobs in (1, 4):
+        results = list(pool_map(divide, [5, 0, 2, 1], jobs=jobs))
+
+        # Results are in item order and the failure doesn't stop the
+        # other items.
+        assert [item for item, _, _ in results] == [5, 0, 2, 1]
+        assert [result for _, result, _ in results] == [2, None, 5, 10]
+        assert isinstance(results[1][2], ZeroDivisionError)
+        assert [exc for _, _, exc in results if exc is None] == [None] * 3
+
+
+class TestChangedSincePull:
+    def test_unchanged(self, config):
+        data = {'id': 1, 'title': 'Foo', 'updated': '2014-08-05T12:34:56'}
+        manifest = {}
+        assert changed_since_pull(manifest, 'foo.json', data)
+
+        update_sync_manifest(manifest, 'foo.json', data)
+        assert not changed_since_pull(manifest, 'foo.json', data)
+
+    def test_edited(self, config):
+        data = {'id': 1, 'title': 'Foo'}
+        manifest = {}
+        update_sync_manifest(manifest, 'foo.json', data)
+        assert changed_since_pull(manifest, 'foo.json', dict(data, title='Bar'))
+        assert changed_since_pull(manifest, 'foo.json', dict(data, id=2))
+
+    def test_ignores_mtime(self, config):
+        # Checkouts, copies and editors can set mtimes to anything.
+        data = {'id': 1, 'title': 'Foo'}
+        save_json_file(config, 'foo.json', data)
+        manifest = {}
+        update_sync_manifest(manifest, 'foo.json', data)
+
+        os.utime(os.path.join(config.get('project', 'jsonpath'), 'foo.json'), (1, 1))
+        assert not changed_since_pull(manifest, 'foo.json', data)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_iter_verify_json_files(config, jobs):
+    save_json_file(config, 'b.json', {'title': 'Foo', 'language': 'English'})
+    save_json_file(config, 'a.json', {'title': 'Foo'})
+    with open(os.path.join(config.get('project', 'jsonpath'), 'c.json'), 'w') as fp:
+        fp.write('{"title": ')
+
+    results = list(iter_verify_json_files(config, 'Test Category', jobs=jobs))
+    assert [fn for fn, _ in results] == ['a.json', 'b.json', 'c.json']
+    assert results[0][1] == ['"language" field is required']
+    assert results[1][1] == []
+    assert results[2][1][0].startswith('file is not valid JSON')
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_iter_verify_json_files_unreadable(config, jobs):
+    jsonpath = config.get('project', 'jsonpath')
+    save_json_file(config, 'a.json', {'title': 'Foo', 'language': 'English'})
+    # Can't open a directory or a link to nowhere.
+    os.mkdir(os.path.join(jsonpath, 'b.json'))
+    os.symlink(os.path.join(jsonpath, 'nowhere'), os.path.join(jsonpath, 'c.json'))
+    save_json_file(config, 'd.json', {'title': 'Foo'})
+
+    cache = JSONFileCache(config)
+    results = list(iter_verify_json_files(
+        config, 'Test Category', jobs=jobs, cache=cache))
+    assert [fn for fn, _ in results] == ['a.json', 'b.json', 'c.json', 'd.json']
+    assert results[0][1] == []
+    assert results[1][1][0].startswith('file could not be read')
+    assert results[2][1][0].startswith('file could not be read')
+    assert results[3][1] == ['"language" field is required']
+
+    # Errors reading a file aren't worth caching.
+    assert cache.get_errors('b.json', 'Test Category') is None
+
+
+class TestIterJsonFiles:
+    @pytest.fixture(autouse=True)
+    def files(self, config):
+        save_json_file(config, 'a.json', {'title': 'A'})
+        save_json_file(config, 'b.json', {'title': 'B'})
+        # This one would blow up if it was parsed.
+        with open(os.path.join(config.get('project', 'jsonpath'), 'c.json'), 'w') as fp:
+            fp.write('{"title": ')
+
+    def test_stop_early(self, config):
+        files = iter_json_files(config)
+        assert next(files) == ('a.json', {'title': 'A'})
+        assert next(files) == ('b.json', {'title': 'B'})
+
+    def test_filenames(self, config):
+        assert (
+            list(iter_json_files(config, filenames=['b.json'])) ==
+            [('b.json', {'title': 'B'})]
+        )
+        assert load_json_files(config, filenames=['a.json', 'nope.json']) == [
+            ('a.json', {'title': 'A'})
+        ]
+
+
+class TestJSONFileCache:
+    def test_reparses_changed_files(self, config):
+        save_json_file(config, 'a.json', {'title': 'A'})
+        cache = JSONFileCache(config)
+        assert load_json_files(config, cache=cache) == [('a.json', {'title': 'A'})]
+        cache.save()
+
+        cache = JSONFileCache(config)
+        assert cache.get('a.json') == {'title': 'A'}
+
+        save_json_file(config, 'a.json', {'title': 'A changed'})
+        assert load_json_files(config, cache=cache) == [('a.json', {'title': 'A changed'})]
+
+    def test_drops_deleted_files(self, config):
+        save_json_file(config, 'a.json', {'title': 'A'})
+        cache = JSONFileCache(config)
+        list(iter_verify_json_files(config, None, cache=cache))
+        os.remove(os.path.join(config.get('project', 'jsonpath'), 'a.json'))
+        cache.save()
+
+        assert JSONFileCache(config)._index == {}
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_verify(self, config, jobs):
+        save_json_file(config, 'a.json', {'title': 'A', 'category': 'Test Category'})
+        cache = JSONFileCache(config)
+
+        def verify(category):
+            return list(iter_verify_json_files(config, category, jobs=jobs, cache=cache))
+
+        expected = [('a.json', ['"language" field is required'])]
+        assert verify('Test Category') == expected
+        cache.save()
+
+        cache = JSONFileCache(config)
+        assert cache.get_errors('a.json', 'Test Category') == expected[0][1]
+
+        # Different category, different errors.
+        assert cache.get_errors('a.json', 'Other') is None
+        assert len(verify('Other')[0][1]) == 2
+
+        # Changed file, not cached anymore.
+        save_json_file(config, 'a.json', {'title': 'A', 'language': 'English'})
+        assert cache.get_errors('a.json', 'Test Category') is None
+        assert verify('Test Category') == [('a.json', [])]
+
+    def test_video_reqs_change(self, config):
+        save_json_file(config, 'a.json', {'title': 'A'})
+        cache = JSONFileCache(config)
+        list(iter_verify_json_files(config, None, cache=cache))
+        cache.reqs_hash = 'something else'
+        cache.save()
+
+        cache = JSONFileCache(config)
+        assert cache.get_errors('a.json', None) is None
+
+
+class TestAtomicWrites:
+    def test_skips_identical_content(self, tmpdir):
+        path = str(tmpdir.join('a.json'))
+        assert write_file_atomically(path, '{}') is True
+        os.utime(path, (1, 1))
+
+        assert write_file_atomically(path, '{}') is False
+        assert os.path.getmtime(path) == 1
+
+        assert write_file_atomically(path, u'{"a": "\xe9"}') is True
+        assert tmpdir.join('a.json').read('rb') == '{"a": "\xc3\xa9"}'
+
+    def test_batch(self, tmpdir):
+        for name in ('a', 'b'):
+            tmpdir.join(name).write('old')
+        tmpdir.join('b').chmod(0o600)
+
+        batch = AtomicWriteBatch()
+        batch.add(str(tmpdir.join('a')), 'old')
+        batch.add(str(tmpdir.join('b')), 'new')
+        batch.add(str(tmpdir.join('c')), 'new')
+        assert len(batch) == 3
+
+        assert batch.commit() == [str(tmpdir.join('b')), str(tmpdir.join('c'))]
+        assert len(batch) == 0
+        assert [tmpdir.join(name).read() for name in 'abc'] == ['old', 'new', 'new']
+        assert tmpdir.join('b').stat().mode & 0o777 == 0o600
+        # No temp files left behind.
+        assert sorted(os.listdir(str(tmpdir))) == ['a', 'b', 'c']
+
+    def test_failed_batch_leaves_files_alone(self, tmpdir):
+        tmpdir.join('a').write('old')
+        batch = AtomicWriteBatch()
+        batch.add(str(tmpdir.join('a')), 'new')
+        batch.add(str(tmpdir.join('nodir', 'b')), 'new')
+
+        with pytest.raises(OSError):
+            batch.commit()
+        assert tmpdir.join('a').read() == 'old'
+        assert os.listdir(str(tmpdir)) == ['a']
+
+    def test_save_json_files(self, config):
+        assert save_json_files(config, [('a.json', {'a': 1}), ('b.json', {})]) == [
+            'a.json', 'b.json']
+        assert save_json_files(config, [('a.json', {'a': 1}), ('b.json', {'b': 2})]) == [
+            'b.json']
+        assert load_json_files(config) == [('a.json', {'a': 1}), ('b.json', {'b': 2})]
@@ -0,0 +1,221 @@
+#######################################################################
+# This file is part of steve.
+#
+# Copyright (C) 2012-2014 Will Kahn-Greene
+# Licensed under the Simplified BSD License. See LICENSE for full
+# license.
+#######################################################################
+
+import gzip
+import httplib
+import os
+import threading
+import time
+from StringIO import StringIO
+
+import pytest
+
+from steve.util import get_project_config, save_json_file
+from steve.webedit import (PageCache, ProjectStore, WebEditRequestHandler,
+                           WebEditServer)
+
+
+class QuietHandler(WebEditRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class TestProjectStore:
+    def test_get_and_neighbors(self, config):
+        for fn in ('a.json', 'b.json', 'c.json'):
+            save_json_file(config, fn, {'title': fn})
+
+        store = ProjectStore(config)
+        assert store.get('b.json') == {'title': 'b.json'}
+        assert store.get('nope.json') is None
+        assert store.neighbors('a.json') == ('', 'b.json')
+        assert store.neighbors('b.json') == ('a.json', 'c.json')
+        assert store.neighbors('c.json') == ('b.json', '')
+
+    def test_picks_up_changes(self, config):
+        save_json_file(config, 'a.json', {'title': 'A'})
+        store = ProjectStore(config)
+
+        save_json_file(config, 'a.json', {'title': 'A changed'})
+        save_json_file(config, 'b.json', {'title': 'B'})
+        assert store.items() == [
+            ('a.json', {'title': 'A changed'}),
+            ('b.json', {'title': 'B'}),
+        ]
+
+        os.remove(os.path.join(config.get('project', 'jsonpath'), 'a.json'))
+        assert store.get('a.json') is None
+        assert store.items() == [('b.json', {'title': 'B'})]
+
+    def test_save(self, config):
+        save_json_file(config, 'a.json', {'title': 'A'})
+        store = ProjectStore(config)
+
+        store.save('a.json', {'title': 'A saved'})
+        assert store.get('a.json') == {'title': 'A saved'}
+        assert ProjectStore(config).get('a.json') == {'title': 'A saved'}
+
+    def test_packed_storage(self, config, tmpdir):
+        tmpdir.join('steve.ini').write('storage = sqlite\n', mode='a')
+        config = get_project_config()
+        save_json_file(config, 'a.json', {'title': 'A'})
+        store = ProjectStore(config)
+        stamp = store.version('a.json')
+
+        save_json_file(config, 'a.json', {'title': 'A changed'})
+        save_json_file(config, 'b.json', {'title': 'B'})
+        assert store.items() == [
+            ('a.json', {'title': 'A changed'}),
+            ('b.json', {'title': 'B'}),
+        ]
+        assert store.version('a.json') != stamp
+
+    def test_query(self, config):
+        save_json_file(config, 'a.json', {
+            'title': 'Alpha', 'whiteboard': '', 'state': 1,
+            'speakers': ['Jane Doe']})
+        save_json_file(config, 'b.json', {
+            'title': 'Beta', 'whiteboard': 'needs summary', 'state': 2,
+            'category': 'Other'})
+        save_json_file(config, 'c.json', {
+            'title': 'Gamma', 'whiteboard': 'bad audio', 'state': 1})
+        store = ProjectStore(config)
+
+        def fns(**kwargs):
+            summaries, total = store.query(**kwargs)
+            return [s['fn'] for s in summaries], total
+
+        assert fns() == (['a.json', 'b.json', 'c.json'], 3)
+        assert fns(page=2, size=2) == (['c.json'], 3)
+        assert fns(page=3, size=2) == ([], 3)
+        assert fns(whiteboard='set') == (['b.json', 'c.json'], 2)
+        assert fns(whiteboard='empty') == (['a.json'], 1)
+        assert fns(category='Other') == (['b.json'], 1)
+        assert fns(state=1) == (['a.json', 'c.json'], 2)
+        assert fns(q='JANE') == (['a.json'], 1)
+        assert fns(q='audio', state=1) == (['c.json'], 1)
+
+        # Summaries follow saves.
+        store.save('a.json', {'title': 'Alpha', 'whiteboard': 'fix'})
+        assert fns(whiteboard='empty') == ([], 0)
+
+
+class TestPageCache:
+    def test_etag_must_match(self):
+        cache = PageCache(size=2)
+        cache.set('/a', 'etag1', 'body')
+        assert cache.get('/a', 'etag1')['body'] == 'body'
+        assert cache.get('/a', 'etag2') is None
+
+    def test_evicts_least_recently_used(self):
+        cache = PageCache(size=2)
+        cache.set('/a', 'e', 'a')
+        cache.set('/b', 'e', 'b')
+        cache.get('/a', 'e')
+        cache.set('/c', 'e', 'c')
+        assert cache.get('/a', 'e') is not None
+        assert cache.get('/b', 'e') is None
+        assert cache.get('/c', 'e') is not None
+
+
+class TestWebEditServer:
+    @pytest.yield_fixture
+    def server(self, config):
+        save_json_file(config, 'a.json', {'title': 'A', 'summary': 'a' * 1000})
+        httpd = WebEditServer(('127.0.0.1', 0), QuietHandler,
+                              store=ProjectStore(config))
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        yield httpd
+        httpd.shutdown()
+        thread.join()
+
+    def get(self, server, path, headers=None):
+        conn = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+        conn.request('GET', path, headers=headers or {})
+        resp = conn.getresponse()
+        return resp, resp.read()
+
+    def test_conditional_get(self, config, server):
+        resp, body = self.get(server, '/edit/a.json')
+        assert resp.status == 200
+        etag = resp.getheader('ETag')
+        assert etag
+        assert resp.getheader('Last-Modified')
+
+        resp, body = self.get(server, '/edit/a.json',
+                              {'If-None-Match': etag})
+        assert resp.status == 304
+        assert body == ''
+
+        save_json_file(config, 'a.json', {'title': 'A changed'})
+        resp, body = self.get(server, '/edit/a.json',
+                              {'If-None-Match': etag})
+        assert resp.status == 200
+        assert 'A changed' in body
+        assert resp.getheader('ETag') != etag
+
+    def test_saving_leaves_other_pages_alone(self, config, server):
+        save_json_file(config, 'b.json', {'title': 'B'})
+        save_json_file(config, 'c.json', {'title': 'C'})
+        resp, body = self.get(server, '/edit/a.json')
+        etag = resp.getheader('ETag')
+        last_modified = resp.getheader('Last-Modified')
+
+        time.sleep(0.01)
+        server.store.save('c.json', {'title': 'C changed'})
+        resp, body = self.get(server, '/edit/a.json', {'If-None-Match': etag})
+        assert resp.status == 304
+        assert resp.getheader('Last-Modified') == last_modified
+
+        # A new neighbor does change the page.
+        save_json_file(config, 'a2.json', {'title': 'A2'})
+        resp, body = self.get(server, '/edit/a.json', {'If-None-Match': etag})
+        assert resp.status == 200
+        assert 'a2.json' in body
+
+    def test_home_refreshes_once(self, server, monkeypatch):
+        refreshes = []
+        refresh = server.store.refresh
+
+        def counting_refresh():
+            refreshes.append(1)
+            refresh()
+
+        monkeypatch.setattr(server.store, 'refresh', counting_refresh)
+        resp, body = self.get(server, '/?q=a')
+        assert resp.status == 200
+        assert 'a.json' in body
+        assert len(refreshes) == 1
+
+    def test_home_etag_changes_with_data(self, config, server):
+        resp, body = self.get(server, '/')
+        etag = resp.getheader('ETag')
+        assert self.get(server, '/', {'If-None-Match': etag})[0].status == 304
+
+        save_json_file(config, 'b.json', {'title': 'B'})
+        resp, body = self.get(server, '/', {'If-None-Match': etag})
+        assert resp.status == 200
+        assert 'b.json' in body
+
+    def test_malformed_file(self, config, server):
+        with open(os.path.join(config.get('project', 'jsonpath'), 'a.json'), 'w') as fp:
+            fp.write('{"title": ')
+
+        resp, body = self.get(server, '/edit/a.json')
+        assert resp.status == 500
+        assert 'a.json is not valid JSON' in body
+
+    def test_gzip(self, server):
+        resp, plain = self.get(server, '/edit/a.json')
+        assert resp.getheader('Content-Encoding') is None
+
+        resp, body = self.get(server, '/edit/a.json',
+                              {'Accept-Encoding': 'gzip, deflate'})
+        assert resp.getheader('Content-Encoding') == 'gzip'
+        assert gzip.GzipFile(fileobj=StringIO(body)).read() == plain